@@ -921,6 +921,48 @@ def handleResults():
     title = T("Test Results")
     return dict(title=title, item=message)
 
+@auth.shn_requires_membership(1)
+def index_recommendations():
+    """ Indexes which would support the most frequently used URL filters
+        (as seen by this server process since startup) """
+
+    try:
+        min_hits = int(request.vars.get("min_hits", 100))
+    except ValueError:
+        min_hits = 100
+
+    recommendations = _s3xrc.S3Resource.index_recommendations(min_hits=min_hits)
+    if recommendations:
+        item = TABLE(THEAD(TR(TH(T("Table")),
+                              TH(T("Fields")),
+                              TH(T("Requests")),
+                              TH("SQL"))),
+                     TBODY([TR(r.tablename,
+                               ", ".join(r.fields),
+                               r.hits,
+                               r.sql) for r in recommendations]))
+    else:
+        item = T("No frequently used filters found.")
+
+    response.view = "display.html"
+    title = T("Index Recommendations")
+    return dict(title=title, item=item)
+
+@auth.shn_requires_membership(1)
+def pentity_repair():
+    """ Repairs the links between pr_pentity and its instance records
+        (persons, groups, organisations, offices...) """
+
+    result = s3xrc.model.repair_super(db.pr_pentity)
+    item = TABLE(THEAD(TR(TH(T("Table")),
+                          TH(T("Records")))),
+                 TBODY([TR(tablename, result[tablename])
+                        for tablename in sorted(result.keys())]))
+
+    response.view = "display.html"
+    title = T("Person Entities repaired")
+    return dict(title=title, item=item)
+
 # Ticket Viewer functions Borrowed from admin application of web2py
 @auth.shn_requires_membership(1)
 def errors():
@@ -1363,32 +1363,35 @@ def budget_totals(budget):
     total_onetime_cost = 0
     total_recurring_cost = 0
 
+    # Staff lines with their staff type and location, in one query
     table = db.budget_budget_staff
-    query = (table.budget_id == budget)
-    staffs = db(query).select()
-    for staff in staffs:
-        query = (table.budget_id == budget) & (table.staff_id == staff.staff_id)
-        row = db(query).select(table.quantity, table.months, limitby=(0, 1)).first()
-        quantity = row.quantity
-        months = row.months
-        row2 = db(db.budget_staff.id == staff.staff_id).select(db.budget_staff.travel, db.budget_staff.salary, limitby=(0, 1)).first()
-        row3 = db(db.budget_location.id == staff.location_id).select(db.budget_location.subsistence, db.budget_location.hazard_pay, limitby=(0, 1)).first()
-        total_onetime_cost += row2.travel * quantity
-        total_recurring_cost += row2.salary * quantity * months
-        total_recurring_cost += row3.subsistence * quantity * months
-        total_recurring_cost += row3.hazard_pay * quantity * months
-
+    staff = db.budget_staff
+    location = db.budget_location
+    query = (table.budget_id == budget) & (staff.id == table.staff_id)
+    rows = db(query).select(table.quantity, table.months,
+                            staff.travel, staff.salary,
+                            location.subsistence, location.hazard_pay,
+                            left = [location.on(location.id == table.location_id)])
+    for row in rows:
+        quantity = row.budget_budget_staff.quantity
+        months = row.budget_budget_staff.months
+        total_onetime_cost += (row.budget_staff.travel or 0) * quantity
+        monthly = row.budget_staff.salary or 0
+        monthly += row.budget_location.subsistence or 0
+        monthly += row.budget_location.hazard_pay or 0
+        total_recurring_cost += monthly * quantity * months
+
+    # Bundle lines with their bundle totals, in one query
     table = db.budget_budget_bundle
-    query = (table.budget_id == budget)
-    bundles = db(query).select()
-    for bundle in bundles:
-        query = (table.budget_id == budget) & (table.bundle_id == bundle.bundle_id)
-        row = db(query).select(table.quantity, table.months, limitby=(0, 1)).first()
-        quantity = row.quantity
-        months = row.months
-        row2 = db(db.budget_bundle.id == bundle.bundle_id).select(db.budget_bundle.total_unit_cost, db.budget_bundle.total_monthly_cost, limitby=(0, 1)).first()
-        total_onetime_cost += row2.total_unit_cost * quantity
-        total_recurring_cost += row2.total_monthly_cost * quantity * months
+    bundle = db.budget_bundle
+    query = (table.budget_id == budget) & (bundle.id == table.bundle_id)
+    rows = db(query).select(table.quantity, table.months,
+                            bundle.total_unit_cost, bundle.total_monthly_cost)
+    for row in rows:
+        quantity = row.budget_budget_bundle.quantity
+        months = row.budget_budget_bundle.months
+        total_onetime_cost += (row.budget_bundle.total_unit_cost or 0) * quantity
+        total_recurring_cost += (row.budget_bundle.total_monthly_cost or 0) * quantity * months
 
     db(db.budget_budget.id == budget).update(total_onetime_costs=total_onetime_cost, total_recurring_costs=total_recurring_cost)
 
@@ -4,6 +4,8 @@
     Delphi Decision Maker - Controllers
 """
 
+import math
+
 module = request.controller
 
 if module not in deployment_settings.modules:
@@ -30,120 +32,146 @@ if shn_has_role(1):
     ])
 
 
-UNIT_NORMAL = (
-    ( 0.0, .0, .01, .02, .03, .04, .05, .06, .07, .08, .09 ),
-    ( .0, .5000, .5040, .5080, .5120, .5160, .5199, .5239, .5279, .5319, .5359 ),
-    ( .1, .5398, .5438, .5478, .5517, .5557, .5596, .5636, .5675, .5714, .5753 ),
-    ( .2, .5793, .5832, .5871, .5910, .5948, .5987, .6026, .6064, .6103, .6141 ),
-    ( .3, .6179, .6217, .6255, .6293, .6331, .6368, .6406, .6443, .6480, .6517 ),
-    ( .4, .6554, .6591, .6628, .6664, .6700, .6736, .6772, .6808, .6844, .6879 ),
-
-    ( .5, .6915, .6950, .6985, .7019, .7054, .7088, .7123, .7157, .7190, .7224 ),
-    ( .6, .7257, .7291, .7324, .7357, .7389, .7422, .7454, .7486, .7517, .7549 ),
-    ( .7, .7580, .7611, .7642, .7673, .7703, .7734, .7764, .7794, .7823, .7852 ),
-    ( .8, .7881, .7910, .7939, .7967, .7995, .8023, .8051, .8078, .8106, .8133 ),
-    ( .9, .8159, .8186, .8212, .8238, .8264, .8289, .8315, .8340, .8365, .8389 ),
-
-    ( 1.0, .8415, .8438, .8461, .8485, .8508, .8531, .8554, .8577, .8509, .8621 ),
-    ( 1.1, .8643, .8665, .8686, .8708, .8729, .8749, .8770, .8790, .8810, .8830 ),
-    ( 1.2, .8849, .8869, .8888, .8907, .8925, .8944, .8962, .8980, .8997, .90147 ),
-    ( 1.3, .90320, .90490, .90658, .90824, .90988, .91149, .91309, .91466, .91621, .91774 ),
-    ( 1.4, .91924, .92073, .92220, .92364, .92507, .92647, .92785, .92922, .93056, .93189 ),
-
-    ( 1.5, .93319, .93448, .93574, .93699, .93822, .93943, .94062, .94179, .94295, .94408 ),
-    ( 1.6, .94520, .94630, .94738, .94845, .94950, .95053, .95154, .95254, .95352, .95449 ),
-    ( 1.7, .95543, .95637, .95728, .95818, .95907, .95994, .96080, .96164, .96246, .96327 ),
-    ( 1.8, .96407, .96485, .96562, .96638, .96712, .96784, .97856, .96926, .96995, .97062 ),
-    ( 1.9, .97128, .97193, .97257, .97320, .97381, .97441, .97500, .97558, .97615, .97670 ),
-
-    ( 2.0, .97725, .97778, .97831, .97882, .97932, .97982, .98030, .98077, .98124, .98169 ),
-    ( 2.1, .98214, .98257, .98300, .98341, .98382, .98422, .98461, .98500, .98537, .98574 ),
-    ( 2.2, .98610, .98645, .98679, .98713, .98745, .98778, .98809, .98840, .98870, .98899 ),
-    ( 2.3, .98928, .98956, .98983, .990097, .990358, .990613, .990863, .991106, .991344, .991576 ),
-    ( 2.4, .991802, .992024, .992240, .992451, .992656, .992857, .993053, .993244, .993431, .993613 ),
-
-    ( 2.5, .993790, .993963, .994132, .994297, .994457, .994614, .994766, .994915, .995060, .995201 ),
-    ( 2.6, .995339, .995473, .995604, .995731, .995855, .995975, .996093, .996207, .996319, .996427 ),
-    ( 2.7, .996533, .996636, .996736, .996833, .996928, .997020, .997110, .997197, .997282, .997365 ),
-    ( 2.8, .997445, .997523, .997599, .997673, .997744, .997814, .997882, .997948, .998012, .998074 ),
-    ( 2.9, .998134, .998193, .998250, .998305, .998359, .998411, .998460, .998511, .998559, .998605 ),
-
-    ( 3.0, .998650, .998694, .998736, .998777, .998817, .998856, .998893, .998930, .998965, .998999 ),
-    ( 3.1, .9990324, .9990646, .9990957, .9991260, .9991553, .9991836, .9992112, .9992378, .9992636, .9992886 ),
-    ( 3.2, .9993129, .9993363, .9993590, .9993810, .9994024, .9994230, .9994429, .9994623, .9994810, .9994991 ),
-    ( 3.3, .9995166, .9995335, .9995499, .9995658, .9995811, .9995959, .9996103, .9996242, .9996376, .9996505 ),
-    ( 3.4, .9996631, .9996752, .9996869, .9996982, .9997091, .9997197, .9997299, .9997398, .9997493, .9997585 ),
-
-    ( 3.5, .9997674, .9997759, .9997842, .9997922, .9997999, .9998074, .9998146, .9998215, .9998282, .9998347 ),
-    ( 3.6, .9998409, .9998469, .9998527, .9998583, .9998637, .9998689, .9998739, .9998787, .9998834, .9998879 ),
-    ( 3.7, .9998922, .9998964, .99990039, .99990426, .99990799, .99991158, .99991504, .99991838, .99992159, .99992468 ),
-    ( 3.8, .99992765, .99993052, .99993327, .99993593, .99993848, .99994094, .99994331, .99994558, .99994777, .99994988 ),
-    ( 3.9, .99995190, .99995385, .99995573, .99995753, .99995926, .99996092, .99996253, .99996406, .99996554, .99996696 ),
-
-    ( 4.0, .99996833, .99996964, .99997090, .99997211, .99997327, .99997439, .99997546, .99997649, .99997748, .99997843 ),
-    ( 4.1, .99997934, .99998022, .99998106, .99998186, .99998263, .99998338, .99998409, .99998477, .99998542, .99998605 ),
-    ( 4.2, .99998665, .99998723, .99998778, .99998832, .99998882, .99998931, .99998978, .999990226, .999990655, .999991066 ),
-    ( 4.3, .999991460, .999991837, .999992199, .999992545, .999992876, .999993193, .999993497, .999993788, .999994066, .999994332 ),
-    ( 4.4, .999994587, .999994831, .999995065, .999995288, .999995502, .999995706, .999995902, .999996089, .999996268, .999996439 ),
-
-    ( 4.5, .999996602, .999996759, .999996908, .999997051, .999997187, .999997318, .999997442, .999997561, .999997675, .999997784 ),
-    ( 4.6, .999997888, .999997987, .999998081, .999998172, .999998258, .999998340, .999998419, .999998494, .999998566, .999998634 ),
-    ( 4.7, .999998699, .999998761, .999998821, .999998877, .999998931, .999998983, .9999990320, .9999990789, .9999991235, .9999991661 ),
-    ( 4.8, .9999992067, .9999992453, .9999992822, .9999993173, .9999993508, .9999993827, .9999994131, .9999994420, .9999994696, .9999994958 ),
-    ( 4.9, .9999995208, .9999995446, .9999995673, .9999995889, .9999996094, .9999996289, .9999996475, .9999996652, .9999996821, .9999996981 )
-)
 MIN_COLOR = (0xfc, 0xaf, 0x3e)
 MAX_COLOR = (0x4e, 0x9a, 0x06)
 
 
-def __lookupTable(mp):
-    unitValue = 0.0
-
-    for j in range(1, 50):
-        if mp == UNIT_NORMAL[j][1]:
-            unitValue = UNIT_NORMAL[j][0]
-        elif (UNIT_NORMAL[j][1] < mp) and (mp < UNIT_NORMAL[j + 1][1]):
-            for i in range(2, 11):
-                if (UNIT_NORMAL[j][i - 1] < mp) and (mp <= UNIT_NORMAL[j][i]):
-                    unitValue = UNIT_NORMAL[j][0] + UNIT_NORMAL[0][i]
-            if mp > UNIT_NORMAL[j][10]:
-                unitValue = UNIT_NORMAL[j + 1][0]
+# Upper limit of the normal deviate (for unanimous preferences)
+MAX_DEVIATE = 5.0
+
+# Seconds to keep a vote tally in the cache (save_vote clears it
+# immediately, but other processes only see that after expiry)
+TALLY_EXPIRE = 300
+
+
+def __inverse_normal(mp):
+    """ Inverse of the standard normal CDF for 0.5 <= mp <= 1.0, i.e. the
+        unit normal deviate z with P(Z <= z) = mp
+
+        Rational approximation by P. J. Acklam (relative error < 1.15e-9),
+        doesn't need math.erf (Python >= 2.7) """
+
+    if mp <= 0.5:
+        return 0.0
+    if mp >= 1.0 - 2.9e-7:
+        return MAX_DEVIATE # suppose infinite value occur
+
+    a = (-3.969683028665376e+01, 2.209460984245205e+02,
+         -2.759285104469687e+02, 1.383577518672690e+02,
+         -3.066479806614716e+01, 2.506628277459239e+00)
+    b = (-5.447609879822406e+01, 1.615858368580409e+02,
+         -1.556989798598866e+02, 6.680131188771972e+01,
+         -1.328068155288572e+01)
+    c = (-7.784894002430293e-03, -3.223964580411365e-01,
+         -2.400758277161838e+00, -2.549732539343734e+00,
+         4.374664141464968e+00, 2.938163982698783e+00)
+    d = (7.784695709041462e-03, 3.224671290700398e-01,
+         2.445134137142996e+00, 3.754408661907416e+00)
+
+    if mp <= 1.0 - 0.02425:
+        # Central region
+        q = mp - 0.5
+        r = q * q
+        z = (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * q / \
+            (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1.0)
+    else:
+        # Upper tail
+        q = math.sqrt(-2.0 * math.log(1.0 - mp))
+        z = -(((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / \
+             ((((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1.0)
+    return min(z, MAX_DEVIATE)
 
-    if (mp > UNIT_NORMAL[50][1]) and (mp < UNIT_NORMAL[50][10]):
-        for i in range(2, 11):
-            if (UNIT_NORMAL[50][i - 1] < mp) and (mp <= UNIT_NORMAL[50][i]):
-                unitValue = UNIT_NORMAL[50][0] + UNIT_NORMAL[0][i];
 
-    if mp > UNIT_NORMAL[50][10]:
-        unitValue = 5.0; # suppose infinite value occur
+def __cal_votes(pr, i_ids):
+    """ Pairwise preferences: votes[(i1, i2)] = number of users who
+        ranked i1 above i2, from a single select of all votes of the
+        problem (ordered by user and rank) """
 
-    return unitValue
+    index = dict([(i, n) for n, i in enumerate(i_ids)])
+    size = len(i_ids)
+    matrix = [[0] * size for n in xrange(size)]
 
+    table = db.delphi_vote
+    query = (table.problem_id == pr.id) & \
+            (table.user_id > 0) & \
+            (table.rank < 9888)
+    rows = db(query).select(table.user_id,
+                            table.solution_id,
+                            orderby = table.user_id|table.rank)
 
-def __cal_votes(pr, i_ids):
     num_voted = 0
+    def tally(ranked):
+        for n in xrange(len(ranked)):
+            row = matrix[ranked[n]]
+            for other in ranked[n+1:]:
+                row[other] += 1
+
+    user_id = None
+    ranked = []
+    for row in rows:
+        if row.user_id != user_id:
+            if len(ranked) > 1:
+                num_voted += 1
+                tally(ranked)
+            user_id = row.user_id
+            ranked = []
+        if row.solution_id in index:
+            ranked.append(index[row.solution_id])
+    if len(ranked) > 1:
+        num_voted += 1
+        tally(ranked)
+
     votes = {}
     for i1 in i_ids:
+        row = matrix[index[i1]]
         for i2 in i_ids:
-            votes[(i1, i2)] = 0
-
-    users = db(db.auth_user.id > 0).select()
+            votes[(i1, i2)] = row[index[i2]]
+    return (votes, num_voted)
 
-    for u in users:
-        query = (db.delphi_vote.problem_id == pr.id) & \
-                (db.delphi_vote.user_id == u.id) & \
-                (db.delphi_vote.rank < 9888)
 
-        u_votes = [v.solution_id for v in db(query).select(
-                                db.delphi_vote.solution_id,
-                                db.delphi_vote.rank,
-                                orderby = db.delphi_vote.rank)]
+def __cal_scale(votes, i_ids):
+    """ Scale of results: sum of the normal deviates of the pairwise
+        preferences of each item """
 
-        if len(u_votes) > 1: num_voted += 1
-        for i1 in range(len(u_votes)):
-            for i2 in range(i1+1, len(u_votes)):
-                votes[(u_votes[i1], u_votes[i2])] += 1
-    return (votes, num_voted)
+    deviates = {}
+    scale = {}
+    for i1 in i_ids:
+        scale[i1] = 0
+        for i2 in i_ids:
+            if i1 == i2:
+                continue
+            v12 = votes[(i1, i2)]
+            v21 = votes[(i2, i1)]
+            if v12 == v21:
+                continue
+            key = (max(v12, v21), v12 + v21)
+            if key not in deviates:
+                deviates[key] = __inverse_normal(key[0] / float(key[1]))
+            if v12 > v21:
+                scale[i1] += deviates[key]
+            else:
+                scale[i1] -= deviates[key]
+    return scale
+
+
+def __get_tally(pr, i_ids):
+    """ Votes, number of voters and scale of a problem, cached per
+        problem until the next save_vote """
+
+    key = "delphi_tally_%s" % pr.id
+    ids = tuple(sorted(i_ids))
+    def tally():
+        votes, num_voted = __cal_votes(pr, ids)
+        return Storage(ids=ids,
+                       votes=votes,
+                       num_voted=num_voted,
+                       scale=__cal_scale(votes, ids))
+    result = cache.ram(key, tally, time_expire=TALLY_EXPIRE)
+    if result.ids != ids:
+        # Solutions added or removed
+        cache.ram(key, None)
+        result = cache.ram(key, tally, time_expire=TALLY_EXPIRE)
+    return result
 
 
 class DU:
@@ -354,6 +382,9 @@ def save_vote():
     for item_id, rank in ranks.items():
          table.insert(problem_id=pr.id, solution_id=item_id, rank=rank)
 
+    # Clear the cached tally
+    cache.ram("delphi_tally_%s" % pr.id, None)
+
     return '"OK"'
 
 
@@ -387,7 +418,7 @@ def vote():
                     sorted_items.insert(last_enabled + 1, i)
                 ranks[i] = 9998
     else:
-        votes, num_voted = __cal_votes(pr, items.keys())
+        votes = __get_tally(pr, items.keys()).votes
         def cc1(i1, i2):
             if votes[(i1, i2)] > votes[(i2, i1)]: return -1
             if votes[(i1, i2)] < votes[(i2, i1)]: return +1
@@ -412,24 +443,14 @@ def status():
     if n == 0:
         return empty
 
-    votes, num_voted = __cal_votes(pr, i_ids)
-
-    scale = {}
+    tally = __get_tally(pr, i_ids)
+    votes = tally.votes
+    num_voted = tally.num_voted
+    scale = tally.scale
 
     if num_voted == 0:
         return empty
 
-    for i1 in i_ids:
-        scale[i1] = 0
-        for i2 in i_ids:
-            if i1 == i2:
-                continue
-            tt2 = float(votes[(i1, i2)] + votes[(i2, i1)])
-            if votes[(i1, i2)] > votes[(i2, i1)]:
-                scale[i1] += __lookupTable(votes[(i1, i2)]/tt2)
-            elif votes[(i1, i2)] < votes[(i2, i1)]:
-                scale[i1] -= __lookupTable(votes[(i2, i1)]/tt2)
-
     def cc2(i1, i2):
         if scale[i1] > scale[i2]: return -1
         if scale[i1] < scale[i2]: return +1
@@ -278,19 +278,11 @@ def location_duplicates():
         unauthorised()
 
     def delete_location(old, new):
-        # Find all tables which link to the Locations table
-        # @ToDo Replace with db.gis_location._referenced_by
-        tables = shn_table_links("gis_location")
-
-        for table in tables:
-            for count in range(len(tables[table])):
-                field = tables[str(db[table])][count]
-                query = db[table][field] == old
-                db(query).update(**{field:XXX})
-
-        # Remove the record
-        db(db.gis_location.id == old).update(deleted=True)
-
+        # Re-link all records which link to the old Location, and remove it
+        s3xrc.model.merge_references(db.gis_location, old, new)
+        # Children of the old Location have moved to the new one
+        gis.update_location_subtree(int(new))
+        db.commit()
         return
 
     def open_btn(id):
@@ -356,44 +348,143 @@ def location_links():
 
     import gluon.contrib.simplejson as json
 
-    # Find all tables which link to the Locations table
-    # @ToDo Replace with db.gis_location._referenced_by
-    tables = shn_table_links("gis_location")
+    # Tables which link to this Location (one query for all tables)
+    counts = s3xrc.model.count_references(db.gis_location, record_id)
+    fields = dict()
+    for tablename, fieldname in s3xrc.model.referenced_by(db.gis_location):
+        if tablename in counts:
+            fields.setdefault(tablename, []).append(fieldname)
 
     results = []
-    for table in tables:
-        for count in range(len(tables[table])):
-            field = tables[str(db[table])][count]
-            query = db[table][field] == record_id
-            _results = db(query).select()
-            module, resource = table.split("_", 1)
-            for result in _results:
-                id = result.id
-                # We currently have no easy way to get the default represent for a table!
+    for tablename in counts:
+        table = db[tablename]
+        module, resource = tablename.split("_", 1)
+        query = None
+        for fieldname in fields[tablename]:
+            q = (table[fieldname] == record_id)
+            if query is None:
+                query = q
+            else:
+                query = query | q
+        if "deleted" in table.fields:
+            query = query & (table.deleted == False)
+        # We currently have no easy way to get the default represent for a table!
+        # Locations & Persons, Organisations
+        represent = globals().get("shn_%s_represent" % tablename,
+                                  globals().get("shn_%s_represent" % resource, None))
+        if "name" in table.fields:
+            rows = db(query).select(table.id, table.name)
+        else:
+            rows = db(query).select(table.id)
+        for row in rows:
+            id = row.id
+            if represent:
                 try:
-                    # Locations & Persons
-                    represent = eval("shn_%s_represent(id)" % table)
+                    r = represent(id)
                 except:
-                    try:
-                        # Organisations
-                        represent = eval("shn_%s_represent(id)" % resource)
-                    except:
-                        try:
-                            # Many tables have a Name field
-                            represent = (id and [db[table][id].name] or ["None"])[0]
-                        except:
-                            # Fallback
-                            represent = id
-                results.append({
-                    "module" : module,
-                    "resource" : resource,
-                    "id" : id,
-                    "represent" : represent
-                    })
+                    r = id
+            elif "name" in row:
+                # Many tables have a Name field
+                r = row.name or "None"
+            else:
+                # Fallback
+                r = id
+            results.append({
+                "module" : module,
+                "resource" : resource,
+                "id" : id,
+                "represent" : r
+                })
+
+    output = json.dumps(results)
+    return output
+
+def location_duplicates_candidates():
+    """
+        Returns a JSON array of likely duplicate Locations:
+            [[score, id1, name1, id2, name2], ...]
+
+        Locations are compared only within the same level, and if their
+        names have the same Soundex code or beginning
+
+        @arg level - only check Locations of this level (optional)
+        @arg threshold - minimum similarity of the names (default 0.9)
+    """
+
+    if deployment_settings.get_security_map() and not shn_has_role("MapAdmin"):
+        unauthorised()
+
+    import gluon.contrib.simplejson as json
+    s3match = local_import("s3match")
+
+    try:
+        threshold = float(request.vars.get("threshold", 0.9))
+    except ValueError:
+        threshold = 0.9
+
+    table = db.gis_location
+    query = (table.deleted == False)
+    level = request.vars.get("level", None)
+    if level:
+        query = query & (table.level == level)
+
+    def per_level(key):
+        # Blocking key within the level of the location
+        def level_key(record):
+            k = key(record)
+            return k and (record["level"], k) or None
+        return level_key
+
+    index = s3match.S3MatchIndex([per_level(s3match.s3_key_soundex("name")),
+                                  per_level(s3match.s3_key_prefix("name", 3))],
+                                 [("name", 1)],
+                                 max_block=1000)
+    names = {}
+    for row in db(query).select(table.id, table.name, table.level):
+        names[row.id] = row.name
+        index.add(row.id, row)
+
+    results = [[score, id1, names[id1], id2, names[id2]]
+               for score, id1, id2 in index.duplicates(threshold=threshold)]
 
     output = json.dumps(results)
     return output
 
+def location_merge():
+    """
+        Merges duplicate Locations into one (e.g. from
+        location_duplicates_candidates), via POST:
+
+        @arg old - comma-separated IDs of the duplicates (to delete)
+        @arg new - ID of the Location to keep
+
+        Returns a JSON object with the number of re-linked records per table
+    """
+
+    if deployment_settings.get_security_map() and not shn_has_role("MapAdmin"):
+        unauthorised()
+
+    if request.env.request_method != "POST":
+        item = s3xrc.xml.json_message(False, 405, "Use POST to merge Locations!")
+        raise HTTP(405, body=item)
+
+    import gluon.contrib.simplejson as json
+
+    try:
+        new = int(request.post_vars.new)
+        old = [int(id) for id in request.post_vars.old.split(",") if id.strip()]
+    except (AttributeError, ValueError):
+        item = s3xrc.xml.json_message(False, 400, "Need to specify the Locations to merge!")
+        raise HTTP(400, body=item)
+
+    counts = s3xrc.model.merge_references(db.gis_location, old, new)
+    # Children of the old Locations have moved to the new one
+    gis.update_location_subtree(new)
+    db.commit()
+
+    output = json.dumps(counts)
+    return output
+
 # -----------------------------------------------------------------------------
 def map_service_catalogue():
     """
@@ -1591,9 +1682,7 @@ def proxy():
     content type. It supports GET and POST requests.
     """
 
-    import urllib2
     import cgi
-    import sys, os
 
     # ToDo - need to link to map_service_catalogue
     # prevent Open Proxy abuse
@@ -1618,58 +1707,36 @@ def proxy():
             url = "http://www.openlayers.org"
     else:
         # GET
-        #fs = cgi.FieldStorage()
-        #url = fs.getvalue("url", "http://www.openlayers.org")
         if "url" in request.vars:
             url = request.vars.url
         else:
             session.error = T("Need a 'url' argument!")
             raise HTTP(400, body=s3xrc.xml.json_message(False, 400, session.error))
 
-    try:
-        host = url.split("/")[2]
-        if allowedHosts and not host in allowedHosts:
-            msg = "Status: 502 Bad Gateway\n"
-            msg += "Content-Type: text/plain\n\n"
-            msg += "This proxy does not allow you to access that location (%s).\n\n" % (host,)
-
-            msg += os.environ
-            return msg
-
-        elif url.startswith("http://") or url.startswith("https://"):
-            if method == "POST":
-                length = int(request["wsgi"].environ["CONTENT_LENGTH"])
-                headers = {"Content-Type": request["wsgi"].environ["CONTENT_TYPE"]}
-                body = request.body.read(length)
-                r = urllib2.Request(url, body, headers)
-                y = urllib2.urlopen(r)
-            else:
-                y = urllib2.urlopen(url)
-
-            # print content type header
-            # TODO: this doesn't work in web2py, need to figure out how that happens?
-            #i = y.info()
-            #if i.has_key("Content-Type"):
-            # msg = "Content-Type: %s" % (i["Content-Type"])
-            #else:
-            # msg = "Content-Type: text/plain"
+    if not (url.startswith("http://") or url.startswith("https://")):
+        raise HTTP(400, body="Illegal request.", **{"Content-Type": "text/plain"})
 
-            #msg += "\n" + y.read()
+    host = url.split("/")[2]
+    if allowedHosts and not host in allowedHosts:
+        raise HTTP(502,
+                   body="This proxy does not allow you to access that location (%s)." % host,
+                   **{"Content-Type": "text/plain"})
 
-            msg = y.read()
-            y.close()
-            return msg
-        else:
-            msg = "Content-Type: text/plain\n\n"
+    # Responses are streamed in chunks, and GET responses are cached on disk
+    s3proxy = local_import("s3proxy")
+    proxy = s3proxy.S3Proxy(os.path.join(request.folder, "cache", "proxy"))
 
-            msg += "Illegal request."
-            return msg
+    if method == "POST":
+        length = int(request["wsgi"].environ["CONTENT_LENGTH"])
+        headers = {"Content-Type": request["wsgi"].environ["CONTENT_TYPE"]}
+        body = request.body.read(length)
+        status, headers, body = proxy.forward(url, data=body, headers=headers)
+    else:
+        headers = {"Accept": request.env.http_accept,
+                   "Accept-Language": request.env.http_accept_language}
+        status, headers, body = proxy.get(url, headers=headers)
 
-    except Exception, E:
-        msg = "Status: 500 Unexpected Error\n"
-        msg += "Content-Type: text/plain\n\n"
-        msg += "Some unexpected error occurred. Error text was: %s" % str(E)
-        return msg
+    raise HTTP(status, body, **headers)
 
 # -----------------------------------------------------------------------------
 # Tests - not Production
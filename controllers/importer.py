@@ -67,17 +67,8 @@ def import_spreadsheet():
         for x in range(0, len(j["map"])):
 	    j["map"][x][2] = j["map"][x][2].replace("&gt;", ">")
     if not j.has_key("re_import"):# and j["re_import"] is not True:
-    	for x in range(0, len(j["spreadsheet"])):
-	    for y in range(x + 1, len(j["spreadsheet"])):
- 	        k = importer.jaro_winkler_distance_row(j["spreadsheet"][x], j["spreadsheet"][y])
-	        if k is True:
-	           similar_rows.append(j["spreadsheet"][x])
-	           similar_rows.append(j["spreadsheet"][y])
-	        else:
-	           pass
-	for k in similar_rows:
-	    for l in k:
-	       l = l.encode("ascii")
+        # Compare only rows which begin alike in at least one column
+        similar_rows = [j["spreadsheet"][x] for x in importer.similar_rows(j["spreadsheet"])]
         session.similar_rows = similar_rows
     for k in j["spreadsheet"]:
         if k in similar_rows:
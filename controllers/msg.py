@@ -206,9 +206,10 @@ def tropo():
                 except:
                     # SyntaxError: s.from => invalid syntax (why!?)
                     fromaddress = ""
-                db.msg_log.insert(uuid=uuid, fromaddress=fromaddress, recipient=recipient, message=message, inbound=True)
-                # Send the message to the parser
-                reply = parserdooth(message)
+                # Route the message, and log it as actioned with the reply
+                reply = s3_msg_router.route(message)
+                db.msg_log.insert(uuid=uuid, fromaddress=fromaddress, recipient=recipient, message=message, inbound=True,
+                                  actioned=True, actioned_comments=reply)
                 t.say([reply])
                 return t.RenderJson()
             except:
@@ -221,103 +222,27 @@ def tropo():
 
 
 #------------------------------------------------------------------------------
-# Parser
-#
-def parserdooth(message):
-
-    """ This function hopes to grow into a full fledged page that offers
-        customizable routing with keywords
-            - Dooth = Messenger
+@auth.shn_requires_membership(1)
+def router():
+
+    """ Latency statistics of the inbound message handlers """
+
+    stats = s3_msg_router.stats()
+    if stats:
+        item = TABLE(THEAD(TR(TH(T("Keyword")),
+                              TH(T("Messages")),
+                              TH(T("Average (ms)")),
+                              TH(T("Maximum (ms)")))),
+                     TBODY([TR(s.keyword,
+                               s.count,
+                               "%.1f" % (s.avg * 1000),
+                               "%.1f" % (s.max * 1000)) for s in stats]))
+    else:
+        item = T("No messages routed yet.")
 
-    """
-    import difflib
-    import string
-
-    primary_keywords = ["get", "give", "show"] # Equivalent keywords in one list
-    contact_keywords = ["email", "mobile", "facility", "clinical", "security", "phone", "status", "hospital", "person", "organisation"]
-    keywords = string.split(message)
-    query = []
-    name = ""
-    reply = ""
-    for word in keywords:
-        match = difflib.get_close_matches(word, primary_keywords + contact_keywords)
-        if match:
-            query.append(match[0])
-        else:
-            name = word
-
-#   ------------ Person Search [get name person phone email]------------
-    if "person" in query:
-        result = person_search(name)
-
-        if len(result) > 1:
-            return "Multiple Matches"
-        if len(result) == 1:
-            if "Person" in result[0]["name"]:
-                reply = result[0]["name"]
-                table3 = db.pr_pe_contact
-                if "email" in query:
-                    query = (table3.pe_id == result[0]["id"]) & (table3.contact_method == 1)
-                    recipient = db(query).select(table3.value, orderby = table3.priority, limitby=(0, 1)).first()
-                    reply = reply + " Email->" + recipient.value
-                if "mobile" in query:
-                    query = (table3.pe_id == result[0]["id"]) & (table3.contact_method == 2)
-                    recipient = db(query).select(table3.value, orderby = table3.priority, limitby=(0, 1)).first()
-                    reply = reply + " Mobile->" + str(recipient.value)
-
-        if len(reply) == 0:
-            return "No Match"
-
-        return reply
-
-#   -------------Hospital Search [example: get name hospital facility status ] --------------
-    if "hospital" in query:
-        table = db.hms_hospital
-        result = s3xrc.search_simple(table,fields=["name"],label = str(name))
-        if len(result) > 1:
-            return "Multiple Matches"
-
-        if len(result) == 1:
-            hospital = db(table.id == result[0]).select().first()
-            reply = reply + " " + hospital.name + "(Hospital) "
-            if "phone" in query:
-                reply = reply + "Phone->" + str(hospital.phone_emergency)
-            if "facility" in query:
-                reply = reply + "Facility status " + str(table.facility_status.represent(hospital.facility_status))
-            if "clinical" in query:
-                reply = reply + "Clinical status " + str(table.facility_status.represent(hospital.clinical_status))
-            if "security" in query:
-                reply = reply + "Security status " + str(table.facility_status.represent(hospital.security_status))
-
-        if len(reply) == 0:
-            return "No Match"
-
-        return reply
-
-#   -----------------Organisation search [example: get name organisation phone]------------------------------
-    if "organisation" in query:
-        table = db.org_organisation
-        result = s3xrc.search_simple(table, fields=["name"], label = str(name))
-        if len(result) > 1:
-            return "Multiple Matches"
-
-        if len(result) == 1:
-            organisation = db(table.id == result[0]).select().first()
-            reply = reply + " " + organisation.name + "(Organisation) "
-            if "phone" in query:
-                reply = reply + "Phone->" + str(organisation.donation_phone)
-            if "office" in query:
-                reply = reply + "Address->" + shn_get_db_field_value(db = db,
-                                                                     table = "org_office",
-                                                                     field = "address",
-                                                                     look_up = organisation.id
-                                                                     )            
-        if len(reply) == 0:
-            return "No Match"
-
-        return reply
-
-    return "Please provide one of the keywords - person, hospital, organisation"
+    response.view = "display.html"
+    title = T("Message Router")
+    return dict(title=title, item=item)
 
 
 #------------------------------------------------------------------------------
@@ -235,67 +235,12 @@ def now():
         db(db.sync_status.id==pid).update(locked=True)
         db.commit()
 
-        session._unlock(response)
-        session.s3.roles.append(1)
-
-        jobs = status.jobs.split(",")
-        total_errors = 0
-        while jobs:
-
-            result = None
-
-            job_id = jobs.pop(0)
-            job = db(db.sync_job.id == job_id).select(db.sync_job.ALL, limitby=(0, 1)).first()
-
-            if job:
-                pending = status.pending.split(",")
-                result = sync_run_job(job,
-                                      settings=settings,
-                                      pid=pid,
-                                      tables=pending,
-                                      silent=False)
-
-            if result:
-                errors = ",".join(result.errors)
-                done = ",".join(result.done)
-                pending = ",".join(result.pending)
-                total_errors += result.errcount
-                notify("Job %s done." % job_id, type="DONE")
-            else:
-                errors = ""
-                done = ""
-                pending = ""
-
-            if not pending:
-                if jobs:
-                    job_id = jobs[0]
-                    job = db(db.sync_job.id == job_id).select(db.sync_job.ALL, limitby=(0, 1)).first()
-                    res_list = ",".join(map(str, job.resources))
-                else:
-                    res_list = ""
-            else:
-                # Restore job
-                jobs.insert(0, job_id)
-                res_list = pending
-
-            db(db.sync_status.id==status.id).update(
-                    jobs = ",".join(jobs),
-                    done = "%s,%s" % (status.done, done),
-                    errors = "%s,%s" % (status.errors, errors),
-                    pending = res_list)
-            status = db(db.sync_status.id == pid).select(db.sync_status.ALL, limitby=(0, 1)).first()
-            if status and status.halt:
-                break
-
-        if not status.halt and not status.jobs:
-            # @todo: log in history
-            db(db.sync_status.id==pid).delete()
-            notify("Synchronization complete (%s errors)." % total_errors, type="DONE")
-            return dict(item="SYNC NOW: done")
-        else:
-            db(db.sync_status.id==pid).update(locked=False, halt=False)
-            notify("Synchronization halted.", type="DONE")
-            return dict(item="SYNC NOW: halted")
+        # Messages and HALT go through the bus from here
+        s3_sync_bus.open(pid)
+        try:
+            return sync_now(status, settings)
+        finally:
+            s3_sync_bus.close(pid)
 
     elif action == "halt":
 
@@ -306,6 +251,7 @@ def now():
         table = db.sync_status
         if status:
             pid = status.id
+            s3_sync_bus.halt(pid)
             db(table.id == pid).update(halt=True)
         else:
             return dict(item="HALT: No synchronization process found.")
@@ -351,11 +297,18 @@ def now():
 
         response.view = "xml.html"
 
-        s3_sync_clear_messages()
-
-        messages = s3_sync_get_messages()
+        if s3_sync_bus.active(pid):
+            # Running in this process: wait for messages (long-poll)
+            session._unlock(response)
+            messages = s3_sync_bus.wait(pid) or []
+            if s3_sync_bus.flushed(pid):
+                s3_sync_clear_messages()
+                messages = s3_sync_get_messages(pid) + messages
+        else:
+            s3_sync_clear_messages()
+            messages = s3_sync_get_messages()
         if not messages:
-            if status.locked:
+            if status and status.locked:
                 return dict(item="")
 
         msg_list = []
@@ -548,6 +501,83 @@ def sync():
     return output
 
 
+# -----------------------------------------------------------------------------
+def sync_now(status, settings):
+
+    """ Run the jobs of a manual synchronization """
+
+    pid = status.id
+
+    notify = lambda message, type="": \
+             s3_sync_push_message(message, pid=pid, type=type)
+
+    session._unlock(response)
+    session.s3.roles.append(1)
+
+    jobs = status.jobs.split(",")
+    total_errors = 0
+    halted = False
+    while jobs:
+
+        result = None
+
+        job_id = jobs.pop(0)
+        job = db(db.sync_job.id == job_id).select(db.sync_job.ALL, limitby=(0, 1)).first()
+
+        if job:
+            pending = status.pending.split(",")
+            result = sync_run_job(job,
+                                  settings=settings,
+                                  pid=pid,
+                                  tables=pending,
+                                  silent=False)
+
+        if result:
+            errors = ",".join(result.errors)
+            done = ",".join(result.done)
+            pending = ",".join(result.pending)
+            total_errors += result.errcount
+            notify("Job %s done." % job_id, type="DONE")
+        else:
+            errors = ""
+            done = ""
+            pending = ""
+
+        if not pending:
+            if jobs:
+                job_id = jobs[0]
+                job = db(db.sync_job.id == job_id).select(db.sync_job.ALL, limitby=(0, 1)).first()
+                res_list = ",".join(map(str, job.resources))
+            else:
+                res_list = ""
+        else:
+            # Restore job
+            jobs.insert(0, job_id)
+            res_list = pending
+
+        db(db.sync_status.id==status.id).update(
+                jobs = ",".join(jobs),
+                done = "%s,%s" % (status.done, done),
+                errors = "%s,%s" % (status.errors, errors),
+                pending = res_list)
+
+        # Checkpoint: commit, and pick up HALT from other processes
+        halted = s3_sync_bus.checkpoint(pid)
+        status = db(db.sync_status.id == pid).select(db.sync_status.ALL, limitby=(0, 1)).first()
+        if not status or halted:
+            break
+
+    if status and not halted and not status.jobs:
+        # @todo: log in history
+        db(db.sync_status.id==pid).delete()
+        notify("Synchronization complete (%s errors)." % total_errors, type="DONE")
+        return dict(item="SYNC NOW: done")
+    else:
+        db(db.sync_status.id==pid).update(locked=False, halt=False)
+        notify("Synchronization halted.", type="DONE")
+        return dict(item="SYNC NOW: halted")
+
+
 # -----------------------------------------------------------------------------
 def sync_run_job(job, settings=None, pid=None, tables=[], silent=False):
 
@@ -557,7 +587,7 @@ def sync_run_job(job, settings=None, pid=None, tables=[], silent=False):
 
     # Notification helpers
     error = lambda message, pid=pid, silent=silent: not silent and \
-                   s3_sync_push_message(message, pid=pid, error=True)
+                   s3_sync_push_message(message, pid=pid, type="ERROR")
     notify = lambda message, pid=pid, silent=silent: not silent and \
                     s3_sync_push_message(message, pid=pid)
 
@@ -674,12 +704,8 @@ def s3_sync_eden_eden(peer, mode, tablenames,
             output.done.append(tablename)
             continue
 
-        # Reload status
-        now = db.sync_status
-        status = db(now.id==pid).select(db.sync_status.halt, limitby=(0,1)).first()
-
         # Check for HALT
-        if status and status.halt:
+        if s3_sync_bus.halted(pid):
             notify("HALT command received.")
             output.success = True
             return output
@@ -879,12 +905,8 @@ def s3_sync_eden_other(peer, mode, tablenames,
             output.done.append(tablename)
             continue
 
-        # Reload status
-        now = db.sync_status
-        status = db(now.id==pid).select(db.sync_status.halt, limitby=(0,1)).first()
-
         # Check for HALT
-        if status and status.halt:
+        if s3_sync_bus.halted(pid):
             notify("HALT command received.")
             output.success = True
             return output
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+# This script processes uploaded photos (doc_image) in the background:
+# EXIF metadata (date, GPS position), thumbnails and checksums, so that
+# the upload request only needs to store the file.
+#
+# See modules/s3image.py
+#
+
+s3image = local_import("s3image")
+
+processor = s3image.S3ImageProcessor(db)
+while processor.process() and not processor.errors:
+    pass
+print processor.report()
+
+# Explicitly commit DB operations when running from Cron
+db.commit()
@@ -34,46 +34,9 @@ path = os.path.join(request.folder, "modules")
 if not path in sys.path:
             sys.path.append(path)
 import pygsm
-import threading
-import time
 from pygsm.autogsmmodem import GsmModemNotFound
 import s3msg
-
-class ModemThread( threading.Thread ):
-    def __init__(self, modem):
-        self.modem = modem
-        threading.Thread.__init__ ( self )
-        self.msg = s3msg.Msg(globals(), deployment_settings, db, T, modem=modem)
-
-    def run(self):
-        boxdata = self.modem.query("AT+CMGD=?")
-        boxsize = int(boxdata.split("(")[1].split(")")[0].split("-")[1])
-        cleanup = False
-        while True:
-            self.msg.process_outbox(contact_method=2, option=2)
-            for i in range(5):
-                # parse 5 messages in one shot
-                message = self.modem.next_message()
-                if message is not None:
-                    cleanup = True
-                    # for debug purposes
-                    #print "Got message: " + message.text
-                    # Temp: SMS AutoResponder on by default
-                    #self.modem.send_sms(message.sender, "This is to be replaced with the autorespond message")
-                    self.msg.receive_msg(message=message.text, fromaddress=message.sender, pr_message_method=2) 
-                    # ^ dependent on the pr_message_method
-                if cleanup:
-                    for i in range(boxsize): # For cleaning up read messages.
-                        try:
-                            temp = self.modem.command("AT+CMGR=" + str(i+1) + ",1")
-                            if "REC READ" in temp[0]:
-                                self.modem.query("AT+CMGD=" + str(i+1))
-                        except:
-                            pass
-                    cleanup = False
-            time.sleep(5)
-		#self.modem.send_sms("9935648569", "Hey!")
-
+import s3modem
 
 modem_configs = db(db.msg_modem_settings.enabled == True).select()
 
@@ -82,7 +45,7 @@ modems = []
 
 for modem in modem_configs:
     # mode is set to text as PDU mode is flaky
-    modems.append(pygsm.GsmModem(port=modem.modem_port, baudrate=modem.modem_baud, mode="text")) 
+    modems.append(pygsm.GsmModem(port=modem.modem_port, baudrate=modem.modem_baud, mode="text"))
 
 if len(modems) == 0:
     # If no modem is found try autoconfiguring - We shouldn't do this anymore
@@ -93,6 +56,12 @@ if len(modems) == 0:
     #  pass
     pass
 else:
-    # Starting a thread for each modem we have
-    for modem in modems:
-        ModemThread(modem).run()
+    # One worker thread for each modem we have, sharing the outbox
+    msg = s3msg.Msg(globals(), deployment_settings, db, T)
+    if deployment_settings.get_msg_sms_router():
+        # Reply to keyword queries
+        router = s3_msg_router
+    else:
+        router = None
+    gateway = s3modem.S3SmsGateway(msg, modems, router=router)
+    gateway.run()
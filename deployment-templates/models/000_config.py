@@ -60,6 +60,16 @@ deployment_settings.base.prepopulate = True
 # Set this to True to use Content Delivery Networks to speed up Internet-facing sites
 deployment_settings.base.cdn = False
 
+# Set this to True to profile the database queries of each request
+# (shown as footer in debug mode, and logged as JSON line if profiler_log
+# is True or if the request exceeds one of the thresholds)
+deployment_settings.base.profiler = False
+#deployment_settings.base.profiler_log = False
+#deployment_settings.base.profiler_max_queries = 100
+#deployment_settings.base.profiler_max_time = 1.0 # seconds
+# Maximum number of executions of the same statement (N+1 queries)
+#deployment_settings.base.profiler_max_repeat = 10
+
 # Email settings
 # Outbound server
 deployment_settings.mail.server = "127.0.0.1:25"
@@ -71,6 +81,10 @@ deployment_settings.mail.sender = "'Sahana' <sahana@your.org>"
 # Address to which mails get sent to approve new users
 deployment_settings.mail.approver = "useradmin@your.org"
 
+# Messaging settings
+# Reply to inbound SMS keyword queries (e.g. "get <name> hospital phone")
+deployment_settings.msg.sms_router = False
+
 # Twitter settings:
 # Register an app at http://twitter.com/apps
 # (select Aplication Type: Client)
@@ -174,6 +188,10 @@ deployment_settings.security.archive_not_delete = True
 # NB Auditing (especially Reads) slows system down & consumes diskspace
 #deployment_settings.security.audit_write = False
 #deployment_settings.security.audit_read = False
+# Number of audit entries to buffer in memory before writing them in one bulk
+# insert (0 = write immediately). Buffered entries are written when the request
+# commits, so this is strongly recommended if audit_read is enabled
+#deployment_settings.security.audit_buffer = 100
 
 # UI/Workflow options
 # Should user be prompted to save before navigating away?
@@ -99,10 +99,28 @@ gis = s3gis.GIS(globals(), deployment_settings, db, auth, cache=cache)
 s3vita = local_import("s3vita")
 vita = s3vita.S3Vita(globals(), db)
 
+# Search Index
+s3search = local_import("s3search")
+s3_search_index = s3search.S3SearchIndex(db, migrate=migrate)
+
+# Message Router (handlers are registered by the modules)
+s3router = local_import("s3router")
+s3_msg_router = s3router.S3Router()
+s3_msg_router.keywords("get", give="get", show="get")
+
 # S3XRC
 _s3xrc = local_import("s3xrc")
 s3.crud = Storage()
-s3_audit = _s3xrc.S3Audit(db, session, migrate=migrate)
+if request.env.request_method:
+    audit_buffer = deployment_settings.get_security_audit_buffer()
+else:
+    # Shell or cron script (-S -M): no end of request to flush the buffer
+    audit_buffer = 0
+s3_audit = _s3xrc.S3Audit(db, session, migrate=migrate,
+                          buffer_size=audit_buffer)
+if s3_audit.buffer_size:
+    # Write buffered audit entries within the request's transaction
+    response._custom_commit = s3_audit.commit
 s3xrc = _s3xrc.S3ResourceController(globals(),
             domain=request.env.server_name,
             base_url="%s/%s" % (deployment_settings.get_base_public_url(),
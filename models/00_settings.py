@@ -42,6 +42,19 @@ NOT_APPLICABLE = T("N/A")
 ROWSPERPAGE = 20
 PRETTY_PRINT = False
 
+# Query Profiler (opt-in)
+if deployment_settings.get_base_profiler():
+    s3profiler = local_import("s3profiler")
+    s3_profiler = s3profiler.S3QueryProfiler(db, request,
+                    log=deployment_settings.get_base_profiler_log(),
+                    max_queries=deployment_settings.get_base_profiler_max_queries(),
+                    max_time=deployment_settings.get_base_profiler_max_time(),
+                    max_repeat=deployment_settings.get_base_profiler_max_repeat())
+    # Log summary when the controller returns
+    response.postprocessing.append(s3_profiler.finish)
+else:
+    s3_profiler = None
+
 # Keep all our configuration options in a single pair of global variables
 
 # Use response for one-off variables which are visible in views without explicit passing
@@ -75,6 +88,9 @@ elif auth.is_logged_in():
 #    # Use what browser requests (default web2py behaviour)
 #    T.force(T.http_accept_language)
 
+# Option sets of IS_ONE_OF are cached per language
+IS_ONE_OF_EMPTY.set_language(T.accepted_language)
+
 # List of Languages which use a Right-to-Left script (Arabic, Hebrew, Farsi, Urdu)
 s3_rtl_languages = ["ur"]
 
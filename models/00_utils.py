@@ -776,7 +776,36 @@ def shn_search(r, **attr):
 
             filter = _vars.filter
             if filter == "~":
-                if field2 and field3:
+                # Use the search index where available
+                # (all filters are applied in the index query, so that the
+                # limit applies to the records which are actually returned)
+                index_query = query
+                if exclude_field and exclude_value:
+                    index_query = index_query & (_table[exclude_field] != exclude_value)
+                if parent:
+                    index = None
+                elif field2 and field3:
+                    index = s3_search_index.search(_table, value,
+                                                   fields=[field, field2, field3],
+                                                   limit=limit,
+                                                   query=index_query)
+                else:
+                    index = s3_search_index.search(_table, value,
+                                                   fields=[field],
+                                                   limit=limit,
+                                                   query=index_query)
+
+                if index is not None:
+                    # Indexed search (results ordered by relevance)
+                    if index:
+                        rank = dict([(index[i], i) for i in xrange(len(index))])
+                        rows = db(_table.id.belongs(index)).select()
+                        item = rows.sort(lambda row: rank[row.id]).json()
+                    else:
+                        item = "[]"
+                    query = None
+
+                elif field2 and field3:
                     # pr_person name search
                     if " " in value:
                         value1, value2 = value.split(" ", 1)
@@ -868,12 +897,28 @@ def shn_barchart (r, **attr):
 
         used as REST method handler for S3Resources
 
+        Optional request.vars:
+            name        field for the bar labels
+            aggregate   sum|count|min|max of value per name (SQL GROUP BY)
+            series      pre-aggregated series as JSON [[name, value], ...]
+                        (the resource is not queried at all)
+            start/limit paging
+            settings    SaVaGe settings as JSON
+
+        Rendered charts are cached per request parameters, together with
+        the data version of the resource (number of records, highest ID,
+        latest modification), and re-rendered when the version changes.
+
         @todo: replace by a S3MethodHandler
 
     """
 
+    import hashlib
     import gluon.contrib.simplejson as json
 
+    if r.representation.lower() != "svg":
+        raise HTTP(501, body=BADFORMAT)
+
     # Get all the variables and format them if needed
     valKey = r.request.vars.get("value")
 
@@ -882,18 +927,31 @@ def shn_barchart (r, **attr):
         # Try defaulting to the most-commonly used:
         nameKey = "name"
 
-    # The parameter value is required; it must be provided
-    # The parameter name is optional; it is useful, but we don't need it
-    # Here we check to make sure we can find value in the table,
-    # and name (if it was provided)
-    if not r.table.get(valKey):
-        raise HTTP (400, s3xrc.xml.json_message(success=False, status_code="400", message="Need a Value for the Y axis"))
-    elif nameKey and not r.table.get(nameKey):
-        raise HTTP (400, s3xrc.xml.json_message(success=False, status_code="400", message=nameKey + " attribute not found in this resource."))
+    series = r.request.vars.get("series")
+    if series:
+        try:
+            series = [(name, float(value)) for name, value in json.loads(series)]
+        except (ValueError, TypeError):
+            raise HTTP (400, s3xrc.xml.json_message(success=False, status_code="400", message="Invalid series"))
+    else:
+        # The parameter value is required; it must be provided
+        # The parameter name is optional; it is useful, but we don't need it
+        # Here we check to make sure we can find value in the table,
+        # and name (if it was provided)
+        if not r.table.get(valKey):
+            raise HTTP (400, s3xrc.xml.json_message(success=False, status_code="400", message="Need a Value for the Y axis"))
+        elif nameKey and not r.table.get(nameKey):
+            raise HTTP (400, s3xrc.xml.json_message(success=False, status_code="400", message=nameKey + " attribute not found in this resource."))
+
+    aggregate = r.request.vars.get("aggregate")
+    if aggregate and aggregate not in ("sum", "count", "min", "max"):
+        raise HTTP (400, s3xrc.xml.json_message(success=False, status_code="400", message="Unsupported aggregate: %s" % aggregate))
 
     start = request.vars.get("start")
     if start:
         start = int(start)
+    else:
+        start = 0
 
     limit = r.request.vars.get("limit")
     if limit:
@@ -905,46 +963,94 @@ def shn_barchart (r, **attr):
     else:
         settings = {}
 
-    if r.representation.lower() == "svg":
-        r.response.headers["Content-Type"] = "image/svg+xml"
+    title = str(deployment_settings.modules.get(module).name_nice)
 
-        graph = local_import("savage.graph")
-        bar = graph.BarGraph(settings=settings)
+    xlabel = None
+    if nameKey and r.table.get(nameKey):
+        xlabel = str(r.table.get(nameKey).label or nameKey)
 
-        title = deployment_settings.modules.get(module).name_nice
-        bar.setTitle(title)
+    ylabel = valKey
+    if r.table.get(valKey):
+        ylabel = str(r.table.get(valKey).label or valKey)
 
-        if nameKey:
-            xlabel = r.table.get(nameKey).label
-            if xlabel:
-                bar.setXLabel(str(xlabel))
+    if series:
+        version = None
+    else:
+        version = r.resource.version()[0]
+
+    key = "barchart_%s" % hashlib.md5(repr((r.tablename,
+                                             str(r.resource.get_query()),
+                                             valKey, nameKey, aggregate,
+                                             series, start, limit,
+                                             sorted(settings.items()),
+                                             title, xlabel, ylabel))).hexdigest()
+
+    def data():
+        """ Aggregate the data in the database """
+
+        table = r.resource.table
+        query = r.resource.get_query()
+        valField = table[valKey]
+        nameField = nameKey and table[nameKey] or None
+        if limit:
+            limitby = (start, start + limit)
+        else:
+            limitby = None
+
+        if aggregate:
+            value = getattr(valField, aggregate)()
+            if nameField:
+                rows = db(query).select(nameField, value,
+                                        groupby=nameField,
+                                        orderby=nameField,
+                                        limitby=limitby)
+                result = [(row[nameField], row[value]) for row in rows]
+            else:
+                row = db(query).select(value).first()
+                result = [(None, row[value])]
+        else:
+            # Can't graph None type
+            query = query & (valField != None)
+            if nameField:
+                rows = db(query).select(nameField, valField, limitby=limitby)
+                result = [(row[nameField], row[valField]) for row in rows]
             else:
-                bar.setXLabel(nameKey)
+                rows = db(query).select(valField, limitby=limitby)
+                result = [(None, row[valField]) for row in rows]
+
+        if start and not limit:
+            result = result[start:]
+        return result
 
-        ylabel = r.table.get(valKey).label
+    def render():
+        """ Render the SVG """
+
+        graph = local_import("savage.graph")
+        bar = graph.BarGraph(settings=settings)
+        bar.setTitle(title)
+        if xlabel:
+            bar.setXLabel(xlabel)
         if ylabel:
-            bar.setYLabel(str(ylabel))
-        else:
-            bar.setYLabel(valKey)
+            bar.setYLabel(ylabel)
 
-        try:
-            records = r.resource.load(start, limit)
-            for entry in r.resource:
-                val = entry[valKey]
-
-                # Can't graph None type
-                if not val is None:
-                    if nameKey:
-                        name = entry[nameKey]
-                    else:
-                        name = None
-                    bar.addBar(name, val)
-            return bar.save()
-        # If the field that was provided was not numeric, we have problems
-        except ValueError:
-            raise HTTP(400, "Bad Request")
-    else:
-        raise HTTP(501, body=BADFORMAT)
+        for name, val in series or data():
+            if not val is None:
+                bar.addBar(name, val)
+        return (version, bar.save())
+
+    try:
+        cached_version, output = cache.ram(key, render, time_expire=3600)
+        if cached_version != version:
+            # Data changed: replace the cached chart (rather than adding
+            # a new key per version, which would never be evicted)
+            cache.ram(key, None)
+            cached_version, output = cache.ram(key, render, time_expire=3600)
+    # If the field that was provided was not numeric, we have problems
+    except ValueError:
+        raise HTTP(400, "Bad Request")
+
+    r.response.headers["Content-Type"] = "image/svg+xml"
+    return output
 
 
 # -----------------------------------------------------------------------------
@@ -104,107 +104,89 @@ admin_menu_options = [
 
 # Modules Menu (available in all Controllers)
 # NB This is just a default menu - most deployments will customise this
-s3.menu_modules = []
-# Home always 1st
-_module = deployment_settings.modules["default"]
-s3.menu_modules.append([_module.name_nice, False, URL(r=request, c="default", f="index")])
-# The Modules to display at the top level
-for module in deployment_settings.modules:
-    _module = deployment_settings.modules[module]
-    if (_module.module_type == 1):
-        if not _module.access:
-            s3.menu_modules.append([_module.name_nice, False, URL(r=request, c=module, f="index")])
-        else:
-            authorised = False
-            groups = re.split("\|", _module.access)[1:-1]
-            for group in groups:
-                if shn_has_role(group):
-                    authorised = True
-            if authorised == True:
-                s3.menu_modules.append([_module.name_nice, False, URL(r=request, c=module, f="index")])
-for module in deployment_settings.modules:
-    _module = deployment_settings.modules[module]
-    if (_module.module_type == 2):
-        if not _module.access:
-            s3.menu_modules.append([_module.name_nice, False, URL(r=request, c=module, f="index")])
-        else:
-            authorised = False
-            groups = re.split("\|", _module.access)[1:-1]
-            for group in groups:
-                if shn_has_role(group):
-                    authorised = True
-            if authorised == True:
-                s3.menu_modules.append([_module.name_nice, False, URL(r=request, c=module, f="index")])
-for module in deployment_settings.modules:
-    _module = deployment_settings.modules[module]
-    if (_module.module_type == 3):
-        if not _module.access:
-            s3.menu_modules.append([_module.name_nice, False, URL(r=request, c=module, f="index")])
-        else:
-            authorised = False
-            groups = re.split("\|", _module.access)[1:-1]
-            for group in groups:
-                if shn_has_role(group):
-                    authorised = True
-            if authorised == True:
-                s3.menu_modules.append([_module.name_nice, False, URL(r=request, c=module, f="index")])
-for module in deployment_settings.modules:
-    _module = deployment_settings.modules[module]
-    if (_module.module_type == 4):
-        if not _module.access:
-            s3.menu_modules.append([_module.name_nice, False, URL(r=request, c=module, f="index")])
-        else:
-            authorised = False
-            groups = re.split("\|", _module.access)[1:-1]
-            for group in groups:
-                if shn_has_role(group):
-                    authorised = True
-            if authorised == True:
-                s3.menu_modules.append([_module.name_nice, False, URL(r=request, c=module, f="index")])
-for module in deployment_settings.modules:
-    _module = deployment_settings.modules[module]
-    if (_module.module_type == 5):
-        if not _module.access:
-            s3.menu_modules.append([_module.name_nice, False, URL(r=request, c=module, f="index")])
-        else:
-            authorised = False
-            groups = re.split("\|", _module.access)[1:-1]
-            for group in groups:
-                if shn_has_role(group):
-                    authorised = True
-            if authorised == True:
-                s3.menu_modules.append([_module.name_nice, False, URL(r=request, c=module, f="index")])
-
-# Modules to display off the 'more' menu
-module_more_menu = ([T("more"), False, "#"])
-modules_submenu = []
-for module in deployment_settings.modules:
-    _module = deployment_settings.modules[module]
-    if (_module.module_type == 10):
+def s3_menu_modules(roles):
+
+    """ Build the modules menu and the admin menu for a set of roles
+
+        Labels are translated into str, as the result is cached and
+        shared between requests (lazy T() strings are not)
+
+        @returns: tuple (list of (module, menu item), admin menu item)
+
+    """
+
+    def authorised(_module):
         if not _module.access:
-            modules_submenu.append([_module.name_nice, False, URL(r=request, c=module, f="index")])
-        else:
-            authorised = False
-            groups = re.split("\|", _module.access)[1:-1]
-            for group in groups:
-                if shn_has_role(group):
-                    authorised = True
-            if authorised == True:
-                modules_submenu.append([_module.name_nice, False, URL(r=request, c=module, f="index")])
-module_more_menu.append(modules_submenu)
-s3.menu_modules.append(module_more_menu)
-
-# Admin always last
-_module = deployment_settings.modules["admin"]
-authorised = False
-groups = re.split("\|", _module.access)[1:-1]
-for group in groups:
-    if int(group) in session.s3.roles:
-        authorised = True
-if authorised == True:
-    s3.menu_admin = [_module.name_nice, True, URL(r=request, c="admin", f="index")]
+            return True
+        groups = re.split("\|", _module.access)[1:-1]
+        for group in groups:
+            if shn_has_role(group):
+                return True
+        return False
+
+    menu = []
+    # Home always 1st
+    _module = deployment_settings.modules["default"]
+    menu.append(("default", [str(_module.name_nice), False, URL(r=request, c="default", f="index")]))
+    # The Modules to display at the top level
+    for module_type in (1, 2, 3, 4, 5):
+        for module in deployment_settings.modules:
+            _module = deployment_settings.modules[module]
+            if _module.module_type == module_type and authorised(_module):
+                menu.append((module, [str(_module.name_nice), False, URL(r=request, c=module, f="index")]))
+
+    # Modules to display off the 'more' menu
+    modules_submenu = []
+    for module in deployment_settings.modules:
+        _module = deployment_settings.modules[module]
+        if _module.module_type == 10 and authorised(_module):
+            modules_submenu.append((module, [str(_module.name_nice), False, URL(r=request, c=module, f="index")]))
+    menu.append((None, [str(T("more")), False, "#", modules_submenu]))
+
+    # Admin always last
+    _module = deployment_settings.modules["admin"]
+    menu_admin = []
+    groups = re.split("\|", _module.access)[1:-1]
+    for group in groups:
+        if int(group) in roles:
+            menu_admin = [str(_module.name_nice), True, URL(r=request, c="admin", f="index")]
+
+    return (menu, menu_admin)
+
+# The menus only depend on the roles of the user, the language and the
+# module settings, so they are built once for each combination and kept
+# in cache.ram - only the highlighting of the current module is done per
+# request (on copies, as the cached lists are shared)
+if auth.shn_logged_in():
+    _roles = tuple(sorted(session.s3.roles or []))
 else:
-    s3.menu_admin = []
+    _roles = ()
+_modules = [(module,
+             str(deployment_settings.modules[module].name_nice),
+             deployment_settings.modules[module].module_type,
+             deployment_settings.modules[module].access)
+            for module in deployment_settings.modules]
+_key = "menu_modules_%s" % hash((request.application,
+                                 _roles,
+                                 T.accepted_language,
+                                 repr(_modules)))
+_menu, s3.menu_admin = cache.ram(_key, lambda: s3_menu_modules(_roles), time_expire=86400)
+
+def s3_menu_highlight(menu):
+    """ Copy a cached menu, highlighting the current module """
+    items = []
+    for module, item in menu:
+        item = list(item)
+        if module:
+            item[1] = module == request.controller
+        else:
+            item[3] = s3_menu_highlight(item[3])
+        items.append(item)
+    return items
+
+s3.menu_modules = s3_menu_highlight(_menu)
+if s3.menu_admin:
+    s3.menu_admin = list(s3.menu_admin)
 
 # Build overall menu out of components
 response.menu = s3.menu_modules
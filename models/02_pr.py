@@ -366,6 +366,9 @@ s3xrc.model.configure(table,
         "age_group"
     ])
 
+# Name search index for autocomplete
+s3_search_index.define(table, "first_name", "middle_name", "last_name")
+
 
 # *****************************************************************************
 # Group (group)
@@ -491,6 +491,9 @@ table.lon.comment = A(CONVERSION_TOOL,
 s3xrc.model.configure(table, listadd=False)
     #list_fields=["id", "name", "level", "parent", "lat", "lon"])
 
+# Name search index for autocomplete
+s3_search_index.define(table, "name")
+
 # Reusable field to include in other table definitions
 ADD_LOCATION = T("Add Location")
 repr_select = lambda l: len(l.name) > 48 and "%s..." % l.name[:44] or l.name
@@ -180,6 +180,57 @@ s3.crud_strings[tablename] = Storage(
     msg_list_empty = T("No contact information available"))
 
 
+# -----------------------------------------------------------------------------
+def shn_pr_msg_handler(command):
+
+    """ Message handler: contact details of a person
+        [example: get <name> person email mobile]
+
+    """
+
+    table = db.pr_person
+    ids = s3xrc._search_simple(table,
+                               fields=["first_name", "middle_name", "last_name"],
+                               label=command.name)
+    if not ids:
+        return None
+    if len(ids) > 1:
+        return "Multiple Matches"
+
+    person = db(table.id == ids[0]).select(table.pe_id,
+                                           table.first_name,
+                                           table.middle_name,
+                                           table.last_name,
+                                           limitby=(0, 1)).first()
+    reply = vita.fullname(person)
+
+    methods = []
+    if "email" in command.keywords:
+        methods.append((1, "Email"))
+    if "mobile" in command.keywords:
+        methods.append((2, "Mobile"))
+    if methods:
+        # All requested contacts in one query, best priority first
+        table = db.pr_pe_contact
+        query = (table.pe_id == person.pe_id) & \
+                (table.contact_method.belongs([m for m, l in methods])) & \
+                (table.deleted == False)
+        rows = db(query).select(table.contact_method,
+                                table.value,
+                                orderby=table.priority)
+        contacts = dict()
+        for row in rows:
+            contacts.setdefault(row.contact_method, row.value)
+        for method, label in methods:
+            if method in contacts:
+                reply = "%s %s->%s" % (reply, label, contacts[method])
+
+    return reply
+
+s3_msg_router.handler("person", shn_pr_msg_handler)
+s3_msg_router.keywords("email", "mobile")
+
+
 # *****************************************************************************
 # Image (image)
 #
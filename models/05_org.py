@@ -293,6 +293,43 @@ s3xrc.model.configure(table,
                                      "country",
                                      "website"])
 
+# -----------------------------------------------------------------------------
+def shn_org_msg_handler(command):
+
+    """ Message handler: contact details of an organisation
+        [example: get <name> organisation phone office]
+
+    """
+
+    table = db.org_organisation
+    ids = s3xrc._search_simple(table, fields=["name"], label=command.name)
+    if not ids:
+        return None
+    if len(ids) > 1:
+        return "Multiple Matches"
+
+    organisation = db(table.id == ids[0]).select(table.id,
+                                                 table.name,
+                                                 table.donation_phone,
+                                                 limitby=(0, 1)).first()
+    reply = "%s (Organisation)" % organisation.name
+    if "phone" in command.keywords:
+        reply = "%s Phone->%s" % (reply, organisation.donation_phone)
+    if "office" in command.keywords:
+        table = db.org_office
+        query = (table.organisation_id == organisation.id) & \
+                (table.deleted == False)
+        office = db(query).select(table.address,
+                                  orderby=~table.type,
+                                  limitby=(0, 1)).first()
+        if office:
+            reply = "%s Address->%s" % (reply, office.address)
+
+    return reply
+
+s3_msg_router.handler("organisation", shn_org_msg_handler)
+s3_msg_router.keywords("phone", "office", organization="organisation")
+
 # -----------------------------------------------------------------------------
 # Offices
 #
@@ -112,6 +112,11 @@ tablename = "%s_%s" % (module, resourcename)
 table = db.define_table(tablename,
                         Field("name", length=128, notnull=True, unique=True),
                         Field("image", "upload"),
+                        # Filled by cron/doc_image_process.py
+                        Field("thumbnail", "upload", readable=False, writable=False),
+                        Field("preview", "upload", readable=False, writable=False),
+                        Field("checksum", length=40, readable=False, writable=False),
+                        Field("processed", "boolean", default=False, readable=False, writable=False),
                         Field("url"),
                         person_id(),
                         organisation_id(),
@@ -128,13 +133,56 @@ table.person_id.label = T("Person")
 
 # upload folder needs to be visible to the download() function as well as the upload
 table.image.uploadfolder = os.path.join(request.folder, "uploads/images")
+table.thumbnail.uploadfolder = table.image.uploadfolder
+table.preview.uploadfolder = table.image.uploadfolder
 IMAGE_EXTENSIONS = ["png", "PNG", "jpg", "JPG", "jpeg", "JPEG", "gif", "GIF", "tif", "TIF", "tiff", "TIFF", "bmp", "BMP", "raw", "RAW"]
 table.image.requires = IS_IMAGE(extensions=(IMAGE_EXTENSIONS))
 
+# Uploaded images are processed outside of the request (EXIF metadata,
+# thumbnails, checksums) by cron/doc_image_process.py, see modules/s3image.py
+s3image = local_import("s3image")
+
+def shn_doc_image_url(filename, size="thumbnail"):
+    """ URL of a generated size of an uploaded image (or of the original,
+        until the image has been processed) """
+    if not filename:
+        return None
+    name = s3image.s3_image_size_name(filename, size)
+    if os.path.exists(os.path.join(db.doc_image.image.uploadfolder, name)):
+        filename = name
+    return URL(r=request, c="default", f="download", args=filename)
+
+def shn_doc_image_represent(filename):
+    if not filename:
+        return ""
+    return A(IMG(_src=shn_doc_image_url(filename), _height=40),
+             _href=URL(r=request, c="default", f="download", args=filename))
+
+table.image.represent = shn_doc_image_represent
+
+def shn_doc_image_onaccept(form):
+    """ Queue new uploads for processing """
+    image = request.vars.get("image", None)
+    if hasattr(image, "file"):
+        db(db.doc_image.id == form.vars.id).update(processed=False)
+
+s3xrc.model.configure(table, onaccept=shn_doc_image_onaccept)
+
+def shn_image_id_represent(id):
+    if not id:
+        return ""
+    image = db(db.doc_image.id == id).select(db.doc_image.image, limitby=(0, 1)).first()
+    if not image or not image.image:
+        return ""
+    return DIV(A(IMG(_src=shn_doc_image_url(image.image), _height=40),
+                 _class="zoom", _href="#zoom-media_image-%s" % id),
+               DIV(IMG(_src=shn_doc_image_url(image.image, "preview"), _width=600),
+                   _id="zoom-media_image-%s" % id, _class="hidden"))
+
 ADD_IMAGE = T("Add Photo")
 image_id = S3ReusableField("image_id", db.doc_image,
                 requires = IS_NULL_OR(IS_ONE_OF(db, "doc_image.id", "%(name)s")),
-                represent = lambda id: (id and [DIV(A(IMG(_src=URL(r=request, c="default", f="download", args=db(db.doc_image.id == id).select(db.doc_image.image, limitby=(0, 1)).first().image), _height=40), _class="zoom", _href="#zoom-media_image-%s" % id), DIV(IMG(_src=URL(r=request, c="default", f="download", args=db(db.doc_image.id == id).select(db.doc_image.image, limitby=(0, 1)).first().image),_width=600), _id="zoom-media_image-%s" % id, _class="hidden"))] or [""])[0],
+                represent = shn_image_id_represent,
                 label = T("Image"),
                 comment = DIV(A(ADD_IMAGE, _class="colorbox", _href=URL(r=request, c="doc", f="image", args="create", vars=dict(format="popup")), _target="top", _title=ADD_IMAGE),
                           DIV( _class="tooltip", _title=ADD_IMAGE + "|" + T("Add an Photo."))),
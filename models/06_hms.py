@@ -227,6 +227,46 @@ if deployment_settings.has_module(module):
                                        "total_beds",
                                        "available_beds"])
 
+    # -----------------------------------------------------------------------------
+    def shn_hms_msg_handler(command):
+
+        """ Message handler: hospital status
+            [example: get <name> hospital phone facility clinical security]
+
+        """
+
+        table = db.hms_hospital
+        ids = s3xrc._search_simple(table, fields=["name"], label=command.name)
+        if not ids:
+            return None
+        if len(ids) > 1:
+            return "Multiple Matches"
+
+        hospital = db(table.id == ids[0]).select(table.name,
+                                                 table.phone_emergency,
+                                                 table.facility_status,
+                                                 table.clinical_status,
+                                                 table.security_status,
+                                                 limitby=(0, 1)).first()
+        keywords = command.keywords
+        reply = "%s (Hospital)" % hospital.name
+        if "phone" in keywords:
+            reply = "%s Phone->%s" % (reply, hospital.phone_emergency)
+        if "facility" in keywords:
+            reply = "%s Facility status %s" % (reply,
+                    table.facility_status.represent(hospital.facility_status))
+        if "clinical" in keywords:
+            reply = "%s Clinical status %s" % (reply,
+                    table.clinical_status.represent(hospital.clinical_status))
+        if "security" in keywords:
+            reply = "%s Security status %s" % (reply,
+                    table.security_status.represent(hospital.security_status))
+
+        return reply
+
+    s3_msg_router.handler("hospital", shn_hms_msg_handler)
+    s3_msg_router.keywords("phone", "facility", "clinical", "security")
+
     # -----------------------------------------------------------------------------
     # Contacts
     #
@@ -441,47 +481,17 @@ if deployment_settings.has_module(module):
     table.beds_add24.comment = DIV(DIV(_class="tooltip",
         _title=T("Additional Beds / 24hrs") + "|" + T("Number of additional beds of that type expected to become available in this unit within the next 24 hours.")))
 
-    # -----------------------------------------------------------------------------
-    #
-    def shn_hms_bedcount_update(form):
-
-        """ updates the number of total/available beds of a hospital """
-
-        if isinstance(form, Row):
-            formvars = form
-        else:
-            formvars = form.vars
-
-        table = db.hms_bed_capacity
-        query = ((table.id == formvars.id) &
-                 (db.hms_hospital.id == table.hospital_id))
-        hospital = db(query).select(db.hms_hospital.id, limitby=(0, 1))
-
-        if hospital:
-            hospital = hospital.first()
-
-            a_beds = table.beds_available.sum()
-            t_beds = table.beds_baseline.sum()
-            query = (table.hospital_id == hospital.id) & (table.deleted == False)
-            count = db(query).select(a_beds, t_beds)
-            if count:
-               a_beds = count[0]._extra[a_beds]
-               t_beds = count[0]._extra[t_beds]
-
-            db(db.hms_hospital.id == hospital.id).update(
-                total_beds=t_beds,
-                available_beds=a_beds)
-
     # add as component
     s3xrc.model.add_component(module, resourcename,
                               multiple=True,
                               joinby=dict(hms_hospital="hospital_id"))
 
+    # total/available beds of the hospital = sums over all units
+    s3xrc.model.aggregate(table, "hospital_id", db.hms_hospital,
+                          total_beds="beds_baseline",
+                          available_beds="beds_available")
+
     s3xrc.model.configure(table,
-                          onaccept = lambda form: \
-                                     shn_hms_bedcount_update(form),
-                          ondelete = lambda row: \
-                                     shn_hms_bedcount_update(row),
                           list_fields=["id",
                                        "unit_name",
                                        "bed_type",
@@ -532,6 +532,18 @@ if deployment_settings.has_module(module):
                               deletable = True,
                               editable = True)
 
+    # -----------------------------------------------------------------------------
+    # Ushahidi instances imported from, with the last imported incident
+    # (to pull only newer incidents, see modules/s3ushahidi.py)
+    resourcename = "ushahidi"
+    tablename = "%s_%s" % (module, resourcename)
+    table = db.define_table(tablename,
+                            Field("url", unique=True),
+                            Field("last_id", "integer", default=0),
+                            Field("last_date", "datetime"),
+                            Field("imported", "integer", default=0),
+                            migrate=migrate, *s3_timestamp())
+
     # -----------------------------------------------------------------------------
     @auth.shn_requires_membership(1) # must be Administrator
     def shn_irs_ushahidi_import(r, **attr):
@@ -551,6 +563,8 @@ if deployment_settings.has_module(module):
                         TH(DIV(SPAN("*", _class="req", _style="padding-right: 5px;")))),
                         TR(TD("Ignore Errors?: "),
                         TD(INPUT(_type="checkbox", _name="ignore_errors", _id="ignore_errors"))),
+                        TR(TD("Import all (not only new reports)?: "),
+                        TD(INPUT(_type="checkbox", _name="reset", _id="reset"))),
                         TR("", INPUT(_type="submit", _value=T("Import")))))
 
             label_list_btn = shn_get_crud_string(r.tablename, "title_list")
@@ -564,35 +578,31 @@ if deployment_settings.has_module(module):
 
             if form.accepts(request.vars, session):
 
-                import_count = [0]
-                def sync(vector, import_count = import_count):
-                    if vector.tablename == "irs_ireport":
-                        import_count[0] += 1
-                s3xrc.sync_resolve = sync
-
-                ireports = r.resource
                 ushahidi = form.vars.url
 
                 ignore_errors = form.vars.get("ignore_errors", None)
+                reset = form.vars.get("reset", None)
 
                 template = os.path.join(request.folder, "static", "xslt", "import", "ushahidi.xsl")
 
                 if os.path.exists(template) and ushahidi:
+                    s3ushahidi = local_import("s3ushahidi")
+                    importer = s3ushahidi.S3UshahidiImport(s3xrc, r.resource, template)
                     try:
-                        success = ireports.import_xml(ushahidi, template=template, ignore_errors=ignore_errors)
+                        success = importer.pull(ushahidi, reset=reset, ignore_errors=ignore_errors)
                     except:
                         import sys
                         e = sys.exc_info()[1]
                         response.error = e
                     else:
                         if success:
-                            count = import_count[0]
-                            if count:
-                                response.flash = "%s %s" % (import_count[0], T("reports successfully imported."))
+                            if importer.imported:
+                                response.flash = "%s %s" % (importer.imported, T("reports successfully imported."))
                             else:
                                 response.flash = T("No reports available.")
                         else:
-                            response.error = s3xrc.error
+                            response.error = importer.error
+                        s3_debug("Ushahidi import", importer.report())
 
 
             response.view = "create.html"
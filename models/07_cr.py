@@ -201,6 +201,36 @@ if deployment_settings.has_module(module):
                                        "shelter_service_id",
                                        "location_id"])
 
+    # -------------------------------------------------------------------------
+    def shn_cr_msg_handler(command):
+
+        """ Message handler: shelter details
+            [example: get <name> shelter phone capacity]
+
+        """
+
+        table = db.cr_shelter
+        ids = s3xrc._search_simple(table, fields=["name"], label=command.name)
+        if not ids:
+            return None
+        if len(ids) > 1:
+            return "Multiple Matches"
+
+        shelter = db(table.id == ids[0]).select(table.name,
+                                                table.phone,
+                                                table.capacity,
+                                                limitby=(0, 1)).first()
+        reply = "%s (Shelter)" % shelter.name
+        if "phone" in command.keywords:
+            reply = "%s Phone->%s" % (reply, shelter.phone)
+        if "capacity" in command.keywords:
+            reply = "%s Capacity->%s" % (reply, shelter.capacity)
+
+        return reply
+
+    s3_msg_router.handler("shelter", shn_cr_msg_handler)
+    s3_msg_router.keywords("phone", "capacity")
+
     # Link to shelter from pr_presence
     table = db.pr_presence
     table.shelter_id.requires = IS_NULL_OR(IS_ONE_OF(db, "cr_shelter.id", "%(name)s", sort=True))
@@ -215,3 +245,97 @@ if deployment_settings.has_module(module):
     s3xrc.model.add_component("pr", "presence",
         multiple=True,
         joinby=dict(cr_shelter="shelter_id"))
+
+    # -------------------------------------------------------------------------
+    def shn_cr_shelter_presence(shelter_id, pe_ids, condition=None):
+
+        """ Bulk check-in/check-out of persons at a shelter (e.g. mass
+            registration after an evacuation)
+
+            @param shelter_id: the shelter record ID
+            @param pe_ids: list of person entity IDs
+            @param condition: vita.CHECK_IN (default) or vita.CHECK_OUT
+
+        """
+
+        shelter = db(db.cr_shelter.id == shelter_id).select(db.cr_shelter.location_id,
+                                                            limitby=(0, 1)).first()
+        if not shelter:
+            return []
+        reporter = s3_logged_in_person()
+        ids = vita.shelter_presence(shelter_id, pe_ids,
+                                    condition=condition,
+                                    location_id=shelter.location_id,
+                                    reporter=reporter)
+        s3xrc.model.update_super(db.pr_presence, [dict(id=id) for id in ids])
+        return ids
+
+    # -------------------------------------------------------------------------
+    def shn_cr_shelter_checkin(r, **attr):
+
+        """ Bulk check-in/check-out at a shelter: cr/shelter/<id>/checkin
+
+            Interactive: form to select the persons. Other formats: POST
+            pe_id=<comma-separated person entity IDs> (and
+            condition=checkout to check out), returns a JSON message.
+
+        """
+
+        if r.name != "shelter" or not r.id or r.component:
+            raise HTTP(501, body=BADMETHOD)
+        if not shn_has_permission("update", db.cr_shelter, r.id):
+            unauthorised()
+
+        conditions = dict(checkin=vita.CHECK_IN, checkout=vita.CHECK_OUT)
+
+        if r.representation in shn_interactive_view_formats:
+
+            requires = IS_ONE_OF(db, "pr_person.pe_id",
+                                 "%(first_name)s %(middle_name)s %(last_name)s",
+                                 orderby="pr_person.first_name",
+                                 multiple=True)
+            form = FORM(TABLE(
+                        TR(TD(T("Persons") + ": "),
+                           TD(SELECT([OPTION(label, _value=k)
+                                      for k, label in requires.options()],
+                                     _name="pe_id",
+                                     _multiple="multiple",
+                                     _size=20,
+                                     requires=requires))),
+                        TR(TD(T("Condition") + ": "),
+                           TD(SELECT(OPTION(T("Check-In"), _value="checkin"),
+                                     OPTION(T("Check-Out"), _value="checkout"),
+                                     _name="condition"))),
+                        TR("", INPUT(_type="submit", _value=T("Save")))))
+
+            if form.accepts(r.request.vars, session):
+                pe_ids = form.vars.pe_id
+                if not isinstance(pe_ids, (list, tuple)):
+                    pe_ids = [pe_ids]
+                condition = conditions.get(form.vars.condition, vita.CHECK_IN)
+                ids = shn_cr_shelter_presence(r.id, [int(i) for i in pe_ids],
+                                              condition=condition)
+                session.confirmation = "%s %s" % (len(ids), T("presence records created"))
+                redirect(r.other(method="presence", representation="html"))
+
+            response.view = "create.html"
+            return dict(title=T("Shelter"),
+                        subtitle=T("Check-In / Check-Out"),
+                        form=form)
+
+        else:
+            if r.request.env.request_method != "POST":
+                raise HTTP(405, body=s3xrc.xml.json_message(False, 405, "Use POST to check in persons!"))
+            try:
+                pe_ids = [int(i) for i in str(r.request.post_vars.pe_id).split(",") if i.strip()]
+            except ValueError:
+                pe_ids = None
+            if not pe_ids:
+                raise HTTP(400, body=s3xrc.xml.json_message(False, 400, "Need to specify the persons (pe_id)!"))
+            condition = conditions.get(r.request.post_vars.condition, vita.CHECK_IN)
+            ids = shn_cr_shelter_presence(r.id, pe_ids, condition=condition)
+            return s3xrc.xml.json_message(message="%s presence records created" % len(ids))
+
+    s3xrc.model.set_method(module, "shelter",
+                           method="checkin",
+                           action=shn_cr_shelter_checkin)
@@ -36,10 +36,8 @@ table.resource.requires = IS_IN_SET(["organisation", "office", "staff"])
 
 # Import lines
 def display_dict_pickle_as_str(data):
-    try:
-        t = pickle.loads(data)
-    except pickle.UnpicklingError:
-        t = {}
+    s3importjob = local_import("s3importjob")
+    t = s3importjob.s3_import_line_data(data) or {}
     return ", ".join(["%s: %s" % (k, v) for k, v in t.iteritems() if v])
 
 
@@ -223,6 +223,33 @@ if deployment_settings.has_module(module):
     tablename = "%s_%s" % (module, resourcename)
     table = db.define_table(tablename,
                             Field("status"),
+                            Field("uidvalidity", "integer"),            # IMAP: UIDVALIDITY of the inbox
+                            Field("last_uid", "integer", default=0),    # IMAP: highest UID received
+                            migrate=migrate)
+
+    #------------------------------------------------------------------------
+    # Inbound Email - filled by cron/email_receive.py
+    resourcename = "email_inbox"
+    tablename = "%s_%s" % (module, resourcename)
+    table = db.define_table(tablename,
+                            message_id(),
+                            Field("account", length=128),   # username@server
+                            Field("uid", length=128),   # IMAP: UIDVALIDITY.UID, POP3: UIDL
+                            Field("sender"),
+                            Field("subject"),
+                            Field("body", "text"),
+                            migrate=migrate,
+                            *(s3_timestamp() + s3_uid() + s3_deletion_status()))
+
+    table.uuid.requires = IS_NOT_IN_DB(db, "%s.uuid" % tablename)
+
+    # Attachments of inbound Emails
+    resourcename = "email_attachment"
+    tablename = "%s_%s" % (module, resourcename)
+    table = db.define_table(tablename,
+                            Field("email_id", db.msg_email_inbox),
+                            Field("name"),
+                            Field("file", "upload", autodelete = True),
                             migrate=migrate)
 
 
@@ -231,7 +258,8 @@ if deployment_settings.has_module(module):
         1:T("Unsent"),
         2:T("Sent"),
         3:T("Draft"),
-        4:T("Invalid")
+        4:T("Invalid"),
+        5:T("Queued")   # handed over to the modem gateway, not yet sent
         }
 
     opt_msg_status = db.Table(None, "opt_msg_status",
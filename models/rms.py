@@ -177,6 +177,36 @@ if deployment_settings.has_module(module):
                           onaccept = lambda form: rms_req_onaccept(form),
                           )
 
+    # -------------------------------------------------------------------------
+    def shn_rms_msg_handler(command):
+
+        """ Message handler: request details by number
+            [example: get request 42]
+
+        """
+
+        ids = [int(t) for t in command.terms if t.isdigit()]
+        if len(ids) != 1:
+            return "Please provide the request number"
+
+        table = db.rms_req
+        query = (table.id == ids[0]) & (table.deleted == False)
+        req = db(query).select(table.id,
+                               table.type,
+                               table.priority,
+                               table.message,
+                               limitby=(0, 1)).first()
+        if not req:
+            return None
+
+        return "Request %s: %s, %s priority: %s" % \
+               (req.id,
+                rms_type_opts.get(req.type, UNKNOWN_OPT),
+                rms_priority_opts.get(req.priority, UNKNOWN_OPT),
+                (req.message or "")[:100])
+
+    s3_msg_router.handler("request", shn_rms_msg_handler)
+
     # rms_req as component of doc_documents, shelters, hospitals, activities and inventory store
     s3xrc.model.add_component(module,
                               resourcename,
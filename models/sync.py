@@ -415,6 +415,12 @@ s3.crud_strings[tablename] = Storage(
     msg_no_match = T("No pending registrations matching the query"))
 
 
+# -----------------------------------------------------------------------------
+# Notification bus for running synchronizations (in-process)
+#
+s3sync = local_import("s3sync")
+s3_sync_bus = s3sync.S3SyncBus(db)
+
 # -----------------------------------------------------------------------------
 def s3_sync_push_message(message, type="", pid=None):
 
@@ -430,6 +436,10 @@ def s3_sync_push_message(message, type="", pid=None):
             else:
                 pid = 0
 
+        # Messages of a running synchronization go through the bus
+        if s3_sync_bus.push(pid, message, type=type):
+            return True
+
         success = table.insert(pid=pid, message=message, type=type)
 
         if success:
@@ -6,11 +6,20 @@
 
 # Deployments can change settings live via appadmin
 
-# Set deployment_settings.base.prepopulate to False in Production (to save 1x DAL hit every page)
-if not deployment_settings.get_base_prepopulate() or db(db["s3_setting"].id > 0).count():
-    populate = False
-else:
-    populate = True
+# Set deployment_settings.base.prepopulate to False in Production
+# Once the database has been found to be populated, this is recorded in a
+# marker file next to the table definitions, so the check doesn't cost a
+# DAL hit on every page (delete the file to re-check)
+populate = False
+if deployment_settings.get_base_prepopulate():
+    import hashlib
+    populated = os.path.join(request.folder, "databases",
+                             "%s.populated" % hashlib.md5(db_string[0]).hexdigest())
+    if not os.path.exists(populated):
+        if db(db["s3_setting"].id > 0).count():
+            open(populated, "w").close()
+        else:
+            populate = True
 
 if populate:
 
@@ -259,6 +268,10 @@ if populate:
         table = db[tablename]
         if not db(table.id > 0).count():
             table.insert( pin = "" )
+        # POP3 checks the received UIDLs per account
+        tablename = "msg_email_inbox"
+        field = "uid"
+        db.executesql("CREATE INDEX %s__idx on %s(account, %s);" % (field, tablename, field))
 
     # Assessment
     if "assess" in deployment_settings.modules:
@@ -1055,3 +1068,5 @@ if populate:
 
     # Ensure DB population committed when running through shell
     db.commit()
+
+    open(populated, "w").close()
@@ -53,6 +53,10 @@ SCATTER = keygen ('SCATTER')
 
 EUCLIDEAN = keygen ('EUCLIDEAN')
 TAXICAB = keygen ('TAXICAB')
+HAVERSINE = keygen ('HAVERSINE')
+
+NUMPY = keygen ('NUMPY')
+PYTHON = keygen ('PYTHON')
 
 DICT = keygen ('DICT')
 
@@ -0,0 +1,346 @@
+"""                                                                                                                            
+    Healthscapes Geolytics Module                                                                                                   
+                                                                                                                                                                               
+                                                                                                                               
+    @author: Nico Preston <nicopresto@gmail.com>                                                                                 
+    @author: Colin Burreson <kasapo@gmail.com>                                                                         
+    @author: Zack Krejci <zack.krejci@gmail.com>                                                                             
+    @copyright: (c) 2010 Healthscapes                                                                             
+    @license: MIT                                                                                                              
+                                                                                                                               
+    Permission is hereby granted, free of charge, to any person                                                                
+    obtaining a copy of this software and associated documentation                                                             
+    files (the "Software"), to deal in the Software without                                                                    
+    restriction, including without limitation the rights to use,                                                               
+    copy, modify, merge, publish, distribute, sublicense, and/or sell                                                          
+    copies of the Software, and to permit persons to whom the                                                                  
+    Software is furnished to do so, subject to the following                                                                   
+    conditions:                                                                                                                
+          
+    The above copyright notice and this permission notice shall be                                                             
+    included in all copies or substantial portions of the Software.                                                            
+                                                                                                                               
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,                                                            
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES                                                            
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND                                                                   
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT                                                                
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,                                                               
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING                                                               
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR                                                              
+    OTHER DEALINGS IN THE SOFTWARE.                                                                                            
+                                                                                                                               
+"""
+
+
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Mean earth radius (km)
+EARTH_RADIUS = 6371.0
+
+
+"""
+    Vectorized geometry kernels (NumPy): all functions take
+    coordinate sequences (lists, tuples or arrays) and work on
+    all points at once.
+"""
+
+def available ():
+    return numpy is not None
+
+
+def asArrays (*args):
+    return [numpy.asarray (a, dtype=float) for a in args]
+
+
+def pointsInPolygon (x, y, polyX, polyY):
+    """
+        Ray casting for all points at once: a point is inside if a
+        horizontal ray from it crosses an odd number of polygon
+        edges, so there is one vectorized pass per edge. Points on
+        the boundary count as inside (as with sp's point.in.polygon).
+        Returns a boolean array.
+    """
+    x, y, polyX, polyY = asArrays (x, y, polyX, polyY)
+    inside = numpy.zeros (x.shape, dtype=bool)
+    boundary = numpy.zeros (x.shape, dtype=bool)
+    n = len (polyX)
+    j = n - 1
+    for i in xrange (n):
+        xi, yi = polyX[i], polyY[i]
+        xj, yj = polyX[j], polyY[j]
+        # on this edge?
+        cross = (xj - xi) * (y - yi) - (yj - yi) * (x - xi)
+        boundary |= (numpy.abs (cross) <= 1e-12 * (abs (xj - xi) + abs (yj - yi) + 1.0)) & \
+                    (x >= min (xi, xj)) & (x <= max (xi, xj)) & \
+                    (y >= min (yi, yj)) & (y <= max (yi, yj))
+        if yi != yj:
+            crosses = (yi > y) != (yj > y)
+            xCross = (xj - xi) * (y - yi) / (yj - yi) + xi
+            inside ^= crosses & (x < xCross)
+        j = i
+    return inside | boundary
+
+
+def haversine (lon1, lat1, lon2, lat2, radius=EARTH_RADIUS):
+    """
+        Great circle distances between points given in degrees,
+        with NumPy broadcasting (pass column vectors for the first
+        and row vectors for the second set to get a matrix)
+    """
+    lon1, lat1, lon2, lat2 = [numpy.radians (a) for a in asArrays (lon1, lat1, lon2, lat2)]
+    a = numpy.sin ((lat2 - lat1) / 2) ** 2 + \
+        numpy.cos (lat1) * numpy.cos (lat2) * numpy.sin ((lon2 - lon1) / 2) ** 2
+    return 2 * radius * numpy.arcsin (numpy.sqrt (numpy.minimum (a, 1.0)))
+
+
+def euclidean (x1, y1, x2, y2):
+    x1, y1, x2, y2 = asArrays (x1, y1, x2, y2)
+    return numpy.hypot (x1 - x2, y1 - y2)
+
+
+def taxicab (x1, y1, x2, y2):
+    x1, y1, x2, y2 = asArrays (x1, y1, x2, y2)
+    return numpy.abs (x1 - x2) + numpy.abs (y1 - y2)
+
+
+def distanceMatrix (x1, y1, x2, y2, metric=euclidean):
+    """
+        Distances between all points of the first and all points
+        of the second set: matrix[i][j] is the distance between
+        the i-th point of the first and the j-th of the second set
+    """
+    x1, y1, x2, y2 = asArrays (x1, y1, x2, y2)
+    return metric (x1[:, numpy.newaxis], y1[:, numpy.newaxis], x2, y2)
+
+
+def gridDensity (x, y, minPair, maxPair, cells=(100, 100)):
+    """
+        Bins points into a regular grid of cells[0] x cells[1]
+        cells over the rectangle minPair - maxPair.
+        Returns (counts, xEdges, yEdges), with counts[row][column]
+        (rows along y).
+    """
+    x, y = asArrays (x, y)
+    counts, yEdges, xEdges = numpy.histogram2d (y, x,
+                                                bins=(cells[1], cells[0]),
+                                                range=[[minPair[1], maxPair[1]],
+                                                       [minPair[0], maxPair[0]]])
+    return counts, xEdges, yEdges
+
+
+def kernelDensity (x, y, minPair, maxPair, cells=(100, 100), bandwidth=None):
+    """
+        Gaussian kernel density estimate on a grid: the binned
+        counts are convolved with the (separable) kernel, which is
+        linear in the number of points.
+        Bandwidth (in coordinate units) defaults to Scott's rule.
+        Returns (density, xEdges, yEdges), density per unit area.
+    """
+    x, y = asArrays (x, y)
+    n = len (x)
+    counts, xEdges, yEdges = gridDensity (x, y, minPair, maxPair, cells)
+    if n == 0:
+        return counts, xEdges, yEdges
+    if bandwidth is None:
+        bandwidth = (numpy.std (x) + numpy.std (y)) / 2 * n ** (-1.0 / 6)
+    dx = xEdges[1] - xEdges[0]
+    dy = yEdges[1] - yEdges[0]
+    if bandwidth <= 0 or dx <= 0 or dy <= 0:
+        return counts / (n * max (dx, 1e-12) * max (dy, 1e-12)), xEdges, yEdges
+
+    def kernel (sigma):
+        radius = max (1, int (3 * sigma))
+        k = numpy.exp (-0.5 * (numpy.arange (-radius, radius + 1) / sigma) ** 2)
+        return k / k.sum ()
+
+    kx = kernel (bandwidth / dx)
+    ky = kernel (bandwidth / dy)
+    density = numpy.apply_along_axis (lambda row: numpy.convolve (row, kx, mode='same'), 1, counts)
+    density = numpy.apply_along_axis (lambda col: numpy.convolve (col, ky, mode='same'), 0, density)
+    return density / (n * dx * dy), xEdges, yEdges
+
+
+class ArrayQuadTree (object):
+    """
+        Region quadtree over coordinate arrays.
+
+        The point indices are reordered so that every node owns a
+        contiguous slice of the index array: a range query collects
+        the whole slices of the nodes inside the box, and filters
+        the points of the leaves on its border in one vectorized
+        test. Queries return arrays of point indices.
+    """
+    def __init__ (self, x, y, capacity=32, depth=20):
+        self.x, self.y = asArrays (x, y)
+        self.index = numpy.arange (len (self.x))
+        self.bounds = []
+        self.slices = []
+        self.children = []
+        if len (self.x):
+            self._build (capacity, depth)
+
+    def _node (self, bounds, start, end):
+        self.bounds.append (bounds)
+        self.slices.append ((start, end))
+        self.children.append (None)
+        return len (self.bounds) - 1
+
+    def _build (self, capacity, depth):
+        x, y, index = self.x, self.y, self.index
+        root = self._node ((x.min (), y.min (), x.max (), y.max ()), 0, len (x))
+        stack = [(root, depth)]
+        while stack:
+            node, level = stack.pop ()
+            start, end = self.slices[node]
+            if end - start <= capacity or level == 0:
+                continue
+            minX, minY, maxX, maxY = self.bounds[node]
+            midX = (minX + maxX) / 2.0
+            midY = (minY + maxY) / 2.0
+            idx = index[start:end]
+            quadrant = (x[idx] > midX).astype (int) + 2 * (y[idx] > midY)
+            order = numpy.argsort (quadrant, kind='mergesort')
+            index[start:end] = idx[order]
+            counts = numpy.bincount (quadrant, minlength=4)
+            quadBounds = ((minX, minY, midX, midY),
+                          (midX, minY, maxX, midY),
+                          (minX, midY, midX, maxY),
+                          (midX, midY, maxX, maxY))
+            children = []
+            offset = start
+            for q in xrange (4):
+                if counts[q]:
+                    child = self._node (quadBounds[q], offset, offset + counts[q])
+                    children.append (child)
+                    stack.append ((child, level - 1))
+                offset += counts[q]
+            self.children[node] = children
+
+    def search (self, minX, minY, maxX, maxY):
+        """ Indices of the points in the box (borders included) """
+        found = []
+        if self.bounds:
+            stack = [0]
+        else:
+            stack = []
+        while stack:
+            node = stack.pop ()
+            bMinX, bMinY, bMaxX, bMaxY = self.bounds[node]
+            if bMaxX < minX or bMinX > maxX or bMaxY < minY or bMinY > maxY:
+                continue
+            start, end = self.slices[node]
+            if minX <= bMinX and bMaxX <= maxX and minY <= bMinY and bMaxY <= maxY:
+                found.append (self.index[start:end])
+            elif self.children[node]:
+                stack.extend (self.children[node])
+            else:
+                idx = self.index[start:end]
+                px = self.x[idx]
+                py = self.y[idx]
+                found.append (idx[(px >= minX) & (px <= maxX) & (py >= minY) & (py <= maxY)])
+        if found:
+            return numpy.concatenate (found)
+        else:
+            return numpy.zeros (0, dtype=int)
+
+    def searchBox (self, box):
+        """ Indices of the points in a BoundingBox """
+        return self.search (box[2].x, box[2].y, box[0].x, box[0].y)
+
+
+def benchmark (n=20000, queries=200, seed=0):
+    """
+        Compares the PYTHON and NUMPY backends on a synthetic point
+        cloud (gaussian clusters, like incident data), from the
+        modules folder:
+
+            python -c "from hs.analysis.geometry import benchmark; benchmark ()"
+    """
+    import random
+    import time
+    import enum
+    from point import QuadTree, SpatialPoint, SpatialPointList
+    from utils import BoundingBox
+
+    rnd = random.Random (seed)
+    centers = [(rnd.uniform (-180, 180), rnd.uniform (-60, 60)) for i in xrange (20)]
+    points = []
+    for i in xrange (n):
+        cx, cy = rnd.choice (centers)
+        points.append (SpatialPoint (rnd.gauss (cx, 5.0), rnd.gauss (cy, 5.0), [], None))
+    boxes = []
+    for i in xrange (queries):
+        x, y = rnd.uniform (-180, 170), rnd.uniform (-60, 50)
+        boxes.append (BoundingBox ((x + rnd.uniform (1, 20), y + rnd.uniform (1, 20)), (x, y)))
+
+    def timed (function):
+        start = time.time ()
+        result = function ()
+        return time.time () - start, result
+
+    def report (name, python, numpy):
+        print ('%-24s python %8.3fs   numpy %8.3fs   x%.1f' % \
+               (name, python, numpy, python / max (numpy, 1e-9)))
+
+    # QuadTree: build and range queries
+    def quadtree (backend):
+        tree = QuadTree (backend)
+        for p in points:
+            tree.append (p)
+        return [sorted ([id (p) for p in tree.search (box)]) for box in boxes]
+    tPython, rPython = timed (lambda: quadtree (enum.PYTHON))
+    tNumpy, rNumpy = timed (lambda: quadtree (enum.NUMPY))
+    assert rPython == rNumpy
+    report ('quadtree (%s queries)' % queries, tPython, tNumpy)
+
+    # Distance matrix
+    m = min (n, 500)
+    pointList = SpatialPointList ()
+    pointList.extend (points[:m])
+    for mode, name in ((enum.EUCLIDEAN, 'euclidean'), (enum.HAVERSINE, 'haversine')):
+        pointList.distanceMode (mode)
+        del pointList.mode
+        tPython, dPython = timed (lambda: pointList.distances (pointList))
+        pointList.mode = mode
+        tNumpy, dNumpy = timed (lambda: pointList.distances (pointList))
+        assert numpy.allclose (dPython, dNumpy)
+        report ('%s (%sx%s)' % (name, m, m), tPython, tNumpy)
+
+    # Point in polygon (star-shaped polygon around a cluster)
+    cx, cy = centers[0]
+    vertices = 60
+    polyX = []
+    polyY = []
+    for i in xrange (vertices):
+        angle = 2 * numpy.pi * i / vertices
+        r = rnd.uniform (3.0, 10.0)
+        polyX.append (cx + r * numpy.cos (angle))
+        polyY.append (cy + r * numpy.sin (angle))
+    x = [p.x for p in points]
+    y = [p.y for p in points]
+
+    def rayCast ():
+        result = []
+        for px, py in zip (x, y):
+            inside = False
+            j = vertices - 1
+            for i in xrange (vertices):
+                if (polyY[i] > py) != (polyY[j] > py) and \
+                   px < (polyX[j] - polyX[i]) * (py - polyY[i]) / (polyY[j] - polyY[i]) + polyX[i]:
+                    inside = not inside
+                j = i
+            result.append (inside)
+        return result
+    tPython, rPython = timed (rayCast)
+    tNumpy, rNumpy = timed (lambda: pointsInPolygon (x, y, polyX, polyY))
+    assert rPython == rNumpy.tolist ()
+    report ('point in polygon', tPython, tNumpy)
+
+    # Density (NUMPY only)
+    tNumpy, result = timed (lambda: kernelDensity (x, y, (-180, -90), (180, 90), (360, 180)))
+    print ('%-24s numpy %8.3fs' % ('kernel density', tNumpy))
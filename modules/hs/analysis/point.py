@@ -34,29 +34,64 @@
 
 
 import enum
+import geometry
 
 from query import Query
 from utils import Vector, decode, BoundingBox
 from ..utils.dictionary import Dictionary
 from base import SpatialData, SpatialCollection
 
-from math import pow, sqrt
+from math import pow, sqrt, radians, sin, cos, asin
 from re import match
 
 
+def defaultBackend ():
+    if geometry.available ():
+        return enum.NUMPY
+    else:
+        return enum.PYTHON
+
+
 class QuadTree (object):
-    def __init__ (self):
+    """
+        With the NUMPY backend, the points are collected and the
+        tree (geometry.ArrayQuadTree) is built over coordinate
+        arrays at the first search after an append.
+    """
+    def __init__ (self, backend=None):
+        if backend is None:
+            backend = defaultBackend ()
+        self.backend = backend
         self.root = None
+        self.points = []
+        self._tree = None
 
     def append (self, point):
-        if not self.root:
+        if self.backend is enum.NUMPY:
+            self.points.append (point)
+            self._tree = None
+        elif not self.root:
             self.root = Treenode (point)
         else:
             self.root.append (point)
 
+    def build (self):
+        if self._tree is None:
+            self._tree = geometry.ArrayQuadTree ([p.x for p in self.points],
+                                                 [p.y for p in self.points])
+        return self._tree
+
+    def indices (self, box):
+        return self.build ().searchBox (box)
+
     def search (self, box):
         pointList = SpatialPointList ()
-        self.root.search (pointList, box)
+        if self.backend is enum.NUMPY:
+            points = self.points
+            for i in self.indices (box):
+                pointList.append (points[i])
+        elif self.root:
+            self.root.search (pointList, box)
         return pointList
 
 
@@ -189,6 +224,18 @@ class SpatialPointList (PointList):
         self.sort (SpatialPoint.compareY)
 
     def distances (self, pointList):
+        mode = getattr (self, 'mode', None)
+        if mode and defaultBackend () is enum.NUMPY:
+            if mode == enum.EUCLIDEAN:
+                metric = geometry.euclidean
+            elif mode == enum.TAXICAB:
+                metric = geometry.taxicab
+            else:
+                metric = geometry.haversine
+            v1 = self.vector ()
+            v2 = pointList.vector ()
+            return geometry.distanceMatrix (v1.x, v1.y, v2.x, v2.y,
+                                            metric=metric).tolist ()
         dList = []
         for p1 in self:
             list = []
@@ -200,10 +247,13 @@ class SpatialPointList (PointList):
 
 
     def distanceMode (self, mode):
+        self.mode = mode
         if mode == enum.EUCLIDEAN:
             self.d = SpatialPointList.euclidean
         elif mode == enum.TAXICAB:
             self.d = SpatialPointList.taxicab
+        elif mode == enum.HAVERSINE:
+            self.d = SpatialPointList.haversine
 
     @staticmethod
     def euclidean (p1, p2):
@@ -220,6 +270,14 @@ class SpatialPointList (PointList):
         y = abs (p1.y - p2.y)
         return x + y
 
+    @staticmethod
+    def haversine (p1, p2):
+        """ Great circle distance in km (x = longitude, y = latitude) """
+        lon1, lat1, lon2, lat2 = map (radians, (p1.x, p1.y, p2.x, p2.y))
+        a = pow (sin ((lat2 - lat1) / 2), 2) + \
+            cos (lat1) * cos (lat2) * pow (sin ((lon2 - lon1) / 2), 2)
+        return 2 * geometry.EARTH_RADIUS * asin (sqrt (min (a, 1.0)))
+
 
 class GeneralizedPointList (object):
     def __init__ (self, type, *args):
@@ -35,6 +35,7 @@
 
 
 import enum
+import geometry
 
 from utils import R, Vector, BoundingBox
 from ..utils.dictionary import Dictionary
@@ -176,11 +177,24 @@ class SpatialPolygon (Polygon):
         minX = min (minXList)
         minY = min (minYList)
         self.bounds = BoundingBox ((maxX, maxY), (minX, minY))
-        if not SpatialPolygon.pointInPolygon:
+        if not SpatialPolygon.pointInPolygon and not geometry.available ():
             R.importLibrary ('sp')
             SpatialPolygon.pointInPolygon = True
 
     def pushPoints (self, pointTree):
+        if pointTree.backend is enum.NUMPY:
+            # Candidates from the tree, then ray casting over all of them
+            tree = pointTree.build ()
+            for s in self.simplePolys:
+                idx = pointTree.indices (s.bounds)
+                c = s.coordinates
+                inside = geometry.pointsInPolygon (tree.x[idx], tree.y[idx], c.x, c.y)
+                for i in idx[inside]:
+                    self.points.append (pointTree.points[i])
+            return
+        if not SpatialPolygon.pointInPolygon:
+            R.importLibrary ('sp')
+            SpatialPolygon.pointInPolygon = True
         for s in self.simplePolys:
             pList = pointTree.search (s.bounds)
             v = pList.vector ()
@@ -14,6 +14,8 @@ except ImportError:
 
 import os
 
+from s3match import s3_jaro_winkler, s3_key_prefix, S3MatchIndex
+
 from gluon.html import *
 from gluon.http import *
 from gluon.validators import *
@@ -106,73 +108,7 @@ def jaro_winkler(str1, str2):
           str2  The second string
     """
 
-    jaro_winkler_marker_char = chr(1)
-    if (str1 == str2):
-        return 1.0
-
-    len1 = len(str1)
-    len2 = len(str2)
-    halflen = max(len1, len2) / 2 - 1
-
-    ass1  = ""  # Characters assigned in str1
-    ass2  = ""  # Characters assigned in str2
-    workstr1 = str1
-    workstr2 = str2
-
-    common1 = 0    # Number of common characters
-    common2 = 0
-
-    for i in range(len1):
-        start = max(0, i - halflen)
-        end   = min(i + halflen + 1, len2)
-        index = workstr2.find(str1[i], start, end)
-        if (index > -1):    # Found common character
-            common1 += 1
-        ass1 = ass1 + str1[i]
-        workstr2 = workstr2[:index] + jaro_winkler_marker_char + workstr2[index + 1:]
-
-    for i in range(len2):
-        start = max(0, i - halflen)
-        end   = min(i + halflen + 1, len1)
-        index = workstr1.find(str2[i], start, end)
-        #print 'len2', str2[i], start, end, index, ass1, workstr1, common2
-        if (index > -1):    # Found common character
-            common2 += 1
-        #ass2 += str2[i]
-        ass2 = ass2 + str2[i]
-        workstr1 = workstr1[:index] + jaro_winkler_marker_char + workstr1[index + 1:]
-
-    if (common1 != common2):
-        print('Winkler: Wrong common values for strings "%s" and "%s"' % \
-            (str1, str2) + ', common1: %i, common2: %i' % (common1, common2) + \
-            ', common should be the same.')
-        common1 = float(common1 + common2) / 2.0
-
-    if (common1 == 0):
-        return 0.0
-
-    # Compute number of transpositions
-    transposition = 0
-    for i in range(len(ass1)):
-        if (ass1[i] != ass2[i]):
-            transposition += 1
-    transposition = transposition / 2.0
-
-    # Compute number of characters are common at beginning of both strings, for Jaro-Winkler distance
-
-    minlen = min(len1, len2)
-    for same in range(minlen + 1):
-        if (str1[:same] != str2[:same]):
-            break
-    same -= 1
-    if (same > 4):
-        same = 4
-
-    common1 = float(common1)
-    w = 1. / 3. * (common1 / float(len1) + common1 / float(len2) + (common1 - transposition) / common1)
-
-    wn = w + same * 0.1 * (1.0 - w)
-    return wn
+    return s3_jaro_winkler(str1, str2)
 
 def jaro_winkler_distance_row(row1, row2):
     '''
@@ -182,11 +118,38 @@ def jaro_winkler_distance_row(row1, row2):
     num_similar = 0
     for x in range(0, len(row1)):
         str1 = row1[x]
-    str2 = row2[x]
-    dw = jaro_winkler(str1, str2)
-    if dw > 0.8:
-        num_similar += 1
+        str2 = row2[x]
+        dw = jaro_winkler(str1, str2)
+        if dw > 0.8:
+            num_similar += 1
     if num_similar > (0.75 * (len(row1))):
         return True
     else:
         return False
+
+def similar_rows(rows, max_block=100):
+    """
+        Finds the rows of a spreadsheet which are similar to another row
+        (see jaro_winkler_distance_row), comparing each row only with the
+        rows which have the same beginning in at least one column rather
+        than all pairs. Beginnings shared by more than max_block rows
+        (e.g. in a gender or country column) are too unspecific and
+        therefore ignored
+
+        Returns a list of row indexes
+    """
+
+    keys = [s3_key_prefix(x, 2) for x in range(0, max([0] + map(len, rows)))]
+    index = S3MatchIndex(keys, [], max_block=max_block)
+    for i in range(0, len(rows)):
+        index.add(i, enumerate(rows[i]))
+
+    similar = set()
+    for x in range(0, len(rows)):
+        for y in index.candidates(index.records[x], exclude_large=True):
+            if y <= x or x in similar and y in similar:
+                continue
+            if jaro_winkler_distance_row(rows[x], rows[y]):
+                similar.add(x)
+                similar.add(y)
+    return sorted(similar)
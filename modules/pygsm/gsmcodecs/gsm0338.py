@@ -15,6 +15,16 @@ import re
 # Shared funcs
 #
 def _encode(input,errors='strict'):
+    # fast path: one lookup per char in the precomputed
+    # table of the default alphabet and the extension table
+    if isinstance(input,unicode):
+        try:
+            return (''.join([septet_encode_map[c] for c in input]),len(input))
+        except KeyError:
+            # not encodable, let the standard
+            # encoder deal with it (and the errors)
+            pass
+
     # split to see if we have any 'extended' characters
     runs=unicode_splitter.split(input)
     
@@ -440,6 +450,12 @@ decoding_table = (
 
 encoding_table=codecs.charmap_build(decoding_table)
 
+# Unicode->GSM string lookup table for the whole
+# alphabet (7-bit default table + extended chars
+# with their indicator)
+septet_encode_map=dict([(decoding_table[i],chr(i)) for i in range(128)])
+septet_encode_map.update([(u,extended_indicator+g) for u,g in extended_encode_map.items()])
+
 
 if __name__ == "__main__":
     """
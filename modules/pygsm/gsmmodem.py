@@ -87,6 +87,10 @@ class GsmModem(object):
            the default proxy-args-to-pySerial behavior. This is useful when testing,
            or wrapping the serial connection with some custom logic."""
 
+        # one lock per modem (the class-level lock would serialize
+        # the commands of all modems in the process)
+        self.modem_lock = threading.RLock()
+
         if "logger" in kwargs:
             self.logger = kwargs.pop("logger")
         
@@ -447,7 +451,7 @@ class GsmModem(object):
 
         """
         with self.modem_lock:
-            self.smshandler.send_sms(recipient, text)
+            return self.smshandler.send_sms(recipient, text)
 
     def break_out_of_prompt(self):
         self._write(chr(27))
@@ -562,53 +562,76 @@ def _read_ts(seq):
    
     return dt
 
-def _to_binary(n):
-    s = ""
-    for i in range(8):
-        s = ("%1d" % (n & 1)) + s
-        n >>= 1
-    return s
-
 def _unpack_septets(seq,padding=0):
-    """ 
-    this function taken from:
-    http://offog.org/darcs/misccode/desms.py
+    """
+    Unpacks the hex string seq of 7-bit packed
+    GSM data into a string of septets (GSM chars)
+
+    padding -- number of fill bits before the
+    first septet (after a user data header)
 
-    Thank you Adam Sampson <ats@offog.org>!
     """
 
-    # Unpack 7-bit characters
-    msgbytes,r = _consume_bytes(seq,len(seq)/2)
-    msgbytes.reverse()
-    asbinary = ''.join(map(_to_binary, msgbytes))
-    if padding != 0:
-        asbinary = asbinary[:-padding]
+    # Septets are packed LSB first: shift each octet in
+    # above the bits left over from the previous ones
+    # and take 7 bits at a time from the bottom
+    data = bytearray(seq[:len(seq)/2*2].decode('hex'))
     chars = []
-    while len(asbinary) >= 7:
-        chars.append(int(asbinary[-7:], 2))
-        asbinary = asbinary[:-7]
-    return "".join(map(chr, chars))
+    acc = 0
+    bits = -padding
+    for octet in data:
+        if bits < 0:
+            # drop the fill bits
+            octet >>= -bits
+            bits += 8
+            if bits <= 0:
+                continue
+            acc = octet
+        else:
+            acc |= octet << bits
+            bits += 8
+        while bits >= 7:
+            chars.append(acc & 0x7F)
+            acc >>= 7
+            bits -= 7
+    return str(bytearray(chars))
 
 def _pack_septets(str, padding=0):
-    bytes=[ord(c) for c in str]
-    bytes.reverse()
-    asbinary = ''.join([_to_binary(b)[1:] for b in bytes])
-    # add padding
-    for i in range(padding):
-        asbinary+='0'
-    
-    # zero extend last octet if needed
-    extra = len(asbinary) % 8
-    if extra>0:
-        for i in range(8-extra):
-            asbinary='0'+asbinary
-        
-    # convert back to bytes
-    bytes=[]
-    for i in range(0,len(asbinary),8):
-        bytes.append(int(asbinary[i:i+8],2))
-    bytes.reverse()
-    return ''.join([chr(b) for b in bytes])
+    """
+    Packs the string of septets (GSM chars) str
+    into octets, with padding fill bits before
+    the first septet
+
+    """
+
+    octets = bytearray()
+    acc = 0
+    bits = padding
+    for c in bytearray(str):
+        acc |= (c & 0x7F) << bits
+        bits += 7
+        if bits >= 8:
+            octets.append(acc & 0xFF)
+            acc >>= 8
+            bits -= 8
+    if bits > 0:
+        octets.append(acc & 0xFF)
+    return bytes(octets)
+
+def get_outbound_pdu_strings(messages):
+    """
+    Batch version of 'get_outbound_pdus()': returns
+    the PDU strings for many messages in one call.
+
+    messages -- a list of (text, recipient) tuples
+
+    Returns a list with a list of PDU strings for
+    each message (more than one for a CSM).
+
+    """
+
+    return [[pdu.pdu_string for pdu in get_outbound_pdus(text, recipient)]
+            for text, recipient in messages]
 
 if __name__ == "__main__":
     # poor man's unit tests
@@ -650,6 +673,87 @@ if __name__ == "__main__":
         print op.dump()
         print '-----------------------------'
 
+    # round-trip and compatibility checks of the septet codec
+    # against the original bit-string implementation
+    import random, time
+
+    def _to_binary(n):
+        s = ""
+        for i in range(8):
+            s = ("%1d" % (n & 1)) + s
+            n >>= 1
+        return s
+
+    def _unpack_septets_ref(seq,padding=0):
+        msgbytes,r = _consume_bytes(seq,len(seq)/2)
+        msgbytes.reverse()
+        asbinary = ''.join(map(_to_binary, msgbytes))
+        if padding != 0:
+            asbinary = asbinary[:-padding]
+        chars = []
+        while len(asbinary) >= 7:
+            chars.append(int(asbinary[-7:], 2))
+            asbinary = asbinary[:-7]
+        return "".join(map(chr, chars))
+
+    def _pack_septets_ref(str, padding=0):
+        bytes=[ord(c) for c in str]
+        bytes.reverse()
+        asbinary = ''.join([_to_binary(b)[1:] for b in bytes])
+        for i in range(padding):
+            asbinary+='0'
+        extra = len(asbinary) % 8
+        if extra>0:
+            for i in range(8-extra):
+                asbinary='0'+asbinary
+        bytes=[]
+        for i in range(0,len(asbinary),8):
+            bytes.append(int(asbinary[i:i+8],2))
+        bytes.reverse()
+        return ''.join([chr(b) for b in bytes])
+
+    # (without 0x1B, the escape to the extension table)
+    alphabet = gsmcodecs.gsm0338.decoding_table[:0x1B] + \
+               gsmcodecs.gsm0338.decoding_table[0x1C:128] + \
+               u''.join(gsmcodecs.gsm0338.extended_encode_map.keys())
+    rnd = random.Random(0)
+    for n in range(2000):
+        text = u''.join([rnd.choice(alphabet) for i in range(rnd.randint(0, 200))])
+        septets = text.encode('gsm')
+        assert septets == gsmcodecs.gsm0338.Codec().encode(text)[0]
+        for padding in range(7):
+            packed = _pack_septets(septets, padding)
+            assert packed == _pack_septets_ref(septets, padding)
+            hex = packed.encode('hex').upper()
+            unpacked = _unpack_septets(hex, padding)
+            assert unpacked == _unpack_septets_ref(hex, padding)
+            assert unpacked[:len(septets)] == septets
+        if septets and not text.endswith(u'@'):
+            # (a trailing '@' is taken for fill bits by the decoder)
+            unpacked = _unpack_septets(_pack_septets(septets).encode('hex'))
+            assert unpacked[:len(septets)].decode('gsm') == text
+    for p in pdus:
+        rp = ReceivedGsmPdu(p)
+        assert get_outbound_pdu_strings([(rp.text, rp.address)])[0] == \
+               [op.pdu_string for op in get_outbound_pdus(rp.text, rp.address)]
+    print '\nSeptet codec round-trip: OK'
+
+    # throughput
+    text = u''.join([rnd.choice(alphabet) for i in range(1000)])
+    messages = [(text, '+14153773715')] * 100
+    start = time.time()
+    pdus = get_outbound_pdu_strings(messages)
+    duration = time.time() - start
+    print 'Encoded %s messages (%s PDUs) in %.3fs' % \
+        (len(messages), sum([len(p) for p in pdus]), duration)
+    septets = text.encode('gsm')
+    for name, pack in (('new', _pack_septets), ('old', _pack_septets_ref)):
+        start = time.time()
+        for i in range(100):
+            pack(septets, 1)
+        print 'Packing (%s): %.0f septets/s' % \
+            (name, 100 * len(septets) / (time.time() - start))
+
         
         
 
@@ -28,7 +28,9 @@ class PduSmsHandler(SmsHandler):
                 )
 
         for pdu in pdus:
-            self._send_pdu(pdu)
+            if not self._send_pdu(pdu):
+                return None
+        return True
             
     def _send_pdu(self, pdu):
         # outer try to catch any error and make sure to
@@ -11,6 +11,7 @@ class S3Config(Storage):
         self.database = Storage()
         self.gis = Storage()
         self.mail = Storage()
+        self.msg = Storage()
         self.twitter = Storage()
         self.L10n = Storage()
         self.osm = Storage()
@@ -39,6 +40,16 @@ class S3Config(Storage):
         return self.base.get("public_url", "http://127.0.0.1:8000")
     def get_base_cdn(self):
         return self.base.get("cdn", False)
+    def get_base_profiler(self):
+        return self.base.get("profiler", False)
+    def get_base_profiler_log(self):
+        return self.base.get("profiler_log", False)
+    def get_base_profiler_max_queries(self):
+        return self.base.get("profiler_max_queries", 100)
+    def get_base_profiler_max_time(self):
+        return self.base.get("profiler_max_time", 1.0)
+    def get_base_profiler_max_repeat(self):
+        return self.base.get("profiler_max_repeat", 10)
 
     # Database settings
     def get_database_string(self):
@@ -145,6 +156,10 @@ class S3Config(Storage):
     def get_mail_approver(self):
         return self.mail.get("approver", "useradmin@your.org")
 
+    # Messaging Settings
+    def get_msg_sms_router(self):
+        return self.msg.get("sms_router", False)
+
     # Security Settings
     def get_security_archive_not_delete(self):
         return self.security.get("archive_not_delete", True)
@@ -152,6 +167,8 @@ class S3Config(Storage):
         return self.security.get("audit_read", False)
     def get_security_audit_write(self):
         return self.security.get("audit_write", False)
+    def get_security_audit_buffer(self):
+        return self.security.get("audit_buffer", 0)
     def get_security_policy(self):
         return self.security.get("policy", 1)
     def get_security_map(self):
@@ -1097,6 +1097,32 @@ class GIS(object):
 
         return
 
+    # -----------------------------------------------------------------------------
+    def update_location_subtree(self, location_id):
+        """
+            Update the Materialized paths of all descendants of a GIS Location,
+            e.g. after children have been re-parented by a merge
+        """
+
+        db = self.db
+        table = db.gis_location
+
+        done = set([location_id])
+        parents = [location_id]
+        while parents:
+            query = (table.deleted == False) & (table.parent.belongs(parents))
+            children = db(query).select(table.id, table.parent, table.level)
+            parents = []
+            for child in children:
+                if child.id in done:
+                    # Loop in the hierarchy
+                    continue
+                self.update_location_tree(child.parent, child.level, child.id)
+                done.add(child.id)
+                parents.append(child.id)
+
+        return
+
     # -----------------------------------------------------------------------------
     def wkt_centroid(self, form):
         """
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+
+""" Sahana-Eden Image Processing
+
+    Processing of uploaded photos (doc_image) outside of the request:
+    EXIF metadata, thumbnails and content checksums, used by
+    cron/doc_image_process.py
+
+    @copyright: 2010 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+__all__ = ["S3ImageProcessor",
+           "s3_image_size_name"]
+
+import datetime
+import os
+import sys
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+try:
+    import Image
+except ImportError:
+    # PIL not installed: thumbnails embedded in the EXIF data only
+    Image = None
+
+import EXIF
+
+# *****************************************************************************
+def s3_image_size_name(filename, size):
+
+    """ Name of a generated size of an uploaded image, e.g.
+        doc_image.image.<key>.<name>.png => doc_image.thumbnail.<key>.<name>.jpg
+
+        @param filename: the name of the uploaded image
+        @param size: the size ("thumbnail" or "preview")
+
+    """
+
+    parts = filename.split(".")
+    if len(parts) > 2:
+        parts[1] = size
+        parts[-1] = "jpg"
+        return ".".join(parts)
+    return "doc_image.%s.%s.jpg" % (size, filename.replace(".", "_"))
+
+
+# *****************************************************************************
+class S3ImageProcessor(object):
+
+    """ Processes the uploaded images which haven't been processed yet:
+
+            - computes the SHA1 checksum of the file, and if there is an
+              identical earlier upload, replaces the file by that one
+            - generates the thumbnail and preview sizes (JPEG)
+            - reads date and GPS position from the EXIF data, and sets
+              date and location of the image unless already set
+
+        Each image is committed separately (before removing duplicate
+        files).
+
+        @param db: the database
+        @param batch_size: maximum number of images per run
+
+    """
+
+    # Maximum width and height of the generated sizes
+    SIZES = (("thumbnail", (120, 120)),
+             ("preview", (640, 640)))
+
+    def __init__(self, db, batch_size=50):
+
+        self.db = db
+        self.batch_size = batch_size
+
+        self.processed = 0
+        self.duplicates = 0
+        self.located = 0
+        self.errors = []
+
+
+    # -------------------------------------------------------------------------
+    def process(self):
+
+        """ Processes the next batch of images
+
+            @returns: the number of processed images
+
+        """
+
+        db = self.db
+        table = db.doc_image
+
+        query = (table.processed == False) & (table.deleted == False)
+        rows = db(query).select(table.ALL,
+                                orderby=table.id,
+                                limitby=(0, self.batch_size))
+        for row in rows:
+            try:
+                self.process_image(row)
+            except Exception, e:
+                db.rollback()
+                self.errors.append("Image %s: %s" % (row.id, e))
+                # Don't retry on every run
+                db(table.id == row.id).update(processed=True)
+            db.commit()
+            self.processed += 1
+
+        return len(rows)
+
+
+    # -------------------------------------------------------------------------
+    def process_image(self, row):
+
+        """ Processes an image
+
+            @param row: the doc_image record
+
+        """
+
+        db = self.db
+        table = db.doc_image
+        folder = table.image.uploadfolder
+
+        data = dict(processed=True)
+        if not row.image:
+            db(table.id == row.id).update(**data)
+            return
+
+        path = os.path.join(folder, row.image)
+        redundant = None
+        checksum = self.checksum(path)
+        data.update(checksum=checksum)
+
+        # Identical upload?
+        query = (table.checksum == checksum) & \
+                (table.id != row.id) & \
+                (table.processed == True) & \
+                (table.image != None) & \
+                (table.image != "")
+        original = db(query).select(table.image,
+                                    orderby=table.id,
+                                    limitby=(0, 1)).first()
+        if original and original.image != row.image and \
+           os.path.exists(os.path.join(folder, original.image)):
+            # Share the stored file (and its sizes), remove the copy
+            # once the record has been updated
+            redundant = path
+            image = original.image
+            path = os.path.join(folder, image)
+            data.update(image=image)
+            self.duplicates += 1
+        else:
+            image = row.image
+
+        f = open(path, "rb")
+        try:
+            tags = EXIF.process_file(f, details=False)
+        except:
+            tags = {}
+        f.close()
+
+        for size, (width, height) in self.SIZES:
+            name = s3_image_size_name(image, size)
+            if not os.path.exists(os.path.join(folder, name)):
+                thumbnail = self.resize(path, width, height)
+                if thumbnail is None and size == "thumbnail":
+                    thumbnail = tags.get("JPEGThumbnail", None)
+                if thumbnail is None:
+                    continue
+                f = open(os.path.join(folder, name), "wb")
+                f.write(thumbnail)
+                f.close()
+            data[size] = name
+
+        if not row.date:
+            date = self.exif_date(tags)
+            if date:
+                data.update(date=date)
+
+        if not row.location_id:
+            position = self.exif_position(tags)
+            if position:
+                lat, lon = position
+                location_id = db.gis_location.insert(name=row.name,
+                                                     lat=lat,
+                                                     lon=lon)
+                data.update(location_id=location_id)
+                self.located += 1
+
+        db(table.id == row.id).update(**data)
+        db.commit()
+
+        if redundant:
+            try:
+                os.unlink(redundant)
+            except OSError:
+                pass
+
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def checksum(path):
+
+        """ SHA1 of a file (read in blocks) """
+
+        digest = sha1()
+        f = open(path, "rb")
+        try:
+            while True:
+                block = f.read(65536)
+                if not block:
+                    break
+                digest.update(block)
+        finally:
+            f.close()
+        return digest.hexdigest()
+
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def resize(path, width, height):
+
+        """ Scales an image down to fit into width x height
+
+            @returns: the JPEG data, or None if PIL is not available or
+                can't read the image
+
+        """
+
+        if Image is None:
+            return None
+        try:
+            im = Image.open(path)
+            im.thumbnail((width, height), Image.ANTIALIAS)
+            if im.mode not in ("RGB", "L"):
+                im = im.convert("RGB")
+            output = StringIO()
+            im.save(output, "JPEG", quality=85)
+        except (IOError, ValueError):
+            return None
+        return output.getvalue()
+
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def exif_date(tags):
+
+        """ Date the photo was taken, from the EXIF tags """
+
+        for tag in ("EXIF DateTimeOriginal", "Image DateTime"):
+            value = tags.get(tag, None)
+            if value:
+                try:
+                    return datetime.datetime.strptime(str(value).strip(),
+                                                      "%Y:%m:%d %H:%M:%S").date()
+                except ValueError:
+                    continue
+        return None
+
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def exif_position(tags):
+
+        """ GPS position from the EXIF tags
+
+            @returns: tuple (lat, lon), or None
+
+        """
+
+        def degrees(tag, ref, negative):
+            value = tags.get(tag, None)
+            if value is None:
+                return None
+            try:
+                d, m, s = [float(r.num) / r.den for r in value.values]
+            except (ValueError, ZeroDivisionError, AttributeError, TypeError):
+                return None
+            result = d + m / 60.0 + s / 3600.0
+            if str(tags.get(ref, "")).strip().upper() == negative:
+                result = -result
+            return result
+
+        lat = degrees("GPS GPSLatitude", "GPS GPSLatitudeRef", "S")
+        lon = degrees("GPS GPSLongitude", "GPS GPSLongitudeRef", "W")
+        if lat is None or lon is None or \
+           not -90 <= lat <= 90 or not -180 <= lon <= 180 or \
+           (lat == 0 and lon == 0):
+            return None
+        return (lat, lon)
+
+
+    # -------------------------------------------------------------------------
+    def report(self):
+
+        """ Summary of this run """
+
+        report = "%s images processed, %s duplicates, %s located" % \
+                 (self.processed, self.duplicates, self.located)
+        if self.errors:
+            report = "%s\n%s" % (report, "\n".join(self.errors))
+        return report
+
+
+# *****************************************************************************
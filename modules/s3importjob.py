@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+
+""" Sahana-Eden Import Job Pipeline
+
+    Batch processing of admin_import_job records (CSV uploads), used by
+    the cron scripts import_job_do_processing.py and import_job_do_import.py
+
+    @copyright: 2010 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+__all__ = ["S3ImportJob",
+           "s3_import_line_data"]
+
+import cPickle as pickle
+import csv
+import os
+import sys
+import time
+
+from gluon.storage import Storage
+from gluon.validators import IS_NOT_IN_DB
+import gluon.contrib.simplejson as json
+
+# *****************************************************************************
+def s3_import_line_data(data):
+
+    """ Decodes the data of an admin_import_line (compact JSON, or a
+        pickled dict from earlier versions)
+
+        @param data: the encoded data
+
+        @returns: dict of field values, None if the data can't be decoded
+
+    """
+
+    if not data:
+        return {}
+    try:
+        return json.loads(data)
+    except ValueError:
+        pass
+    try:
+        return pickle.loads(data)
+    except:
+        return None
+
+
+# *****************************************************************************
+class S3ImportJob(object):
+
+    """ Import job pipeline: streams the source file, validates lines in
+        batches with the validators of the target fields and writes the
+        import lines and records with one bulk insert per batch
+
+        @param db: the database
+        @param job: the admin_import_job record
+        @param folder: the application folder (request.folder)
+        @param batch_size: number of lines per batch
+
+    """
+
+    BATCH_SIZE = 500
+
+    def __init__(self, db, job, folder, batch_size=None):
+
+        self.db = db
+        self.job = job
+        self.folder = folder
+        self.batch_size = batch_size or self.BATCH_SIZE
+
+        self.table = db["%s_%s" % (job.module, job.resource)]
+        self.lines = db.admin_import_line
+        self.jobs = db.admin_import_job
+
+        self.validators = None
+        self.unique = None
+
+        # Progress counters
+        self.counters = Storage(lines=0, valid=0, imported=0, failed=0)
+        self.start = time.time()
+
+
+    # -------------------------------------------------------------------------
+    def column_map(self):
+
+        """ Reads the column map of the job, list of (heading, fieldname) """
+
+        try:
+            return pickle.loads(self.job.column_map)
+        except:
+            return []
+
+
+    # -------------------------------------------------------------------------
+    def compile(self, fields):
+
+        """ Collects the validators for the mapped fields once per job,
+            plus those of any other writable fields without default
+            value (which would fail in a form as well)
+
+            @param fields: the names of the mapped fields
+
+        """
+
+        table = self.table
+        validators = []
+        unique = []
+        for f in table.fields:
+            field = table[f]
+            if f == "id" or not field.writable:
+                continue
+            if f not in fields and field.default is not None:
+                continue
+            requires = field.requires
+            if not requires:
+                continue
+            if not isinstance(requires, (list, tuple)):
+                requires = [requires]
+            validators.append((f, requires))
+            if field.unique or \
+               [v for v in requires if isinstance(v, IS_NOT_IN_DB)]:
+                unique.append(f)
+
+        self.validators = validators
+        # Fields which must be unique (IS_NOT_IN_DB can't see the records
+        # of the same batch, as they are inserted after validation)
+        self.unique = unique
+
+
+    # -------------------------------------------------------------------------
+    def validate(self, data):
+
+        """ Validates a line
+
+            @param data: dict of field values (strings) as read from the file
+
+            @returns: tuple (values, errors) with the converted values of
+                the mapped fields, and the names of the invalid fields
+
+        """
+
+        values = dict()
+        errors = []
+        for f, requires in self.validators:
+            value = data.get(f, "")
+            for validator in requires:
+                (value, error) = validator(value)
+                if error:
+                    errors.append(f)
+                    break
+            if f in data:
+                values[f] = value
+
+        return (values, errors)
+
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def encode(data):
+
+        """ Compact encoding of the line data: JSON object without
+            empty values
+
+            @param data: dict of field values
+
+        """
+
+        data = dict([(k, v) for k, v in data.items() if v not in (None, "")])
+        return json.dumps(data, separators=(",", ":"))
+
+
+    # -------------------------------------------------------------------------
+    def process(self):
+
+        """ Validates the source file and stores the import lines
+
+            @returns: the number of valid lines
+
+        """
+
+        db = self.db
+        job = self.job
+        counters = self.counters
+
+        column_map = self.column_map()
+        fields = [c[1] for c in column_map]
+        self.compile([f for f in fields if f])
+
+        # Remove the lines of an earlier, interrupted run
+        db(self.lines.import_job == job.id).delete()
+        db.commit()
+
+        filepath = os.path.join(self.folder, "uploads", job.source_file)
+        reader = csv.reader(open(filepath, "r"))
+
+        # Retrieve column headings from the first line.
+        try:
+            csv_headings = reader.next()
+        except StopIteration:
+            csv_headings = []
+        if csv_headings != [c[0] for c in column_map]:
+            print >> sys.stderr, \
+                  "Cannot process job #%d. Column headings do not match DB!" % job.id
+            return None
+
+        batch = []
+        for line_num, line in enumerate(reader):
+            # Map CSV headers to model fields.
+            line_data = dict([(fields[idx], col)
+                              for idx, col in enumerate(line)
+                              if idx < len(fields) and fields[idx]])
+            values, errors = self.validate(line_data)
+            item = dict(import_job=job.id,
+                        line_no=line_num + 2,  # +2 (zero offset + header line).
+                        data=self.encode(line_data),
+                        valid=not errors)
+            if errors:
+                item.update(errors="Invalid Fields: %s" % ", ".join(errors),
+                            status="ignore")
+            else:
+                item.update(errors=None, status="import")
+                counters.valid += 1
+            batch.append(item)
+            counters.lines += 1
+
+            if len(batch) >= self.batch_size:
+                self.lines.bulk_insert(batch)
+                batch = []
+                # Commit per batch, so that the status page shows the progress
+                db.commit()
+
+        if batch:
+            self.lines.bulk_insert(batch)
+
+        # Update job status.
+        if counters.valid:
+            db(self.jobs.id == job.id).update(status="processed")
+        else:
+            db(self.jobs.id == job.id).update(status="failed",
+                                              failure_reason="no valid lines in file")
+        db.commit()
+
+        return counters.valid
+
+
+    # -------------------------------------------------------------------------
+    def do_import(self):
+
+        """ Imports all lines flagged for import, in one transaction
+
+            @returns: the number of imported lines
+
+        """
+
+        db = self.db
+        job = self.job
+        lines = self.lines
+        counters = self.counters
+
+        self.compile([f for h, f in self.column_map() if f])
+
+        query = (lines.import_job == job.id) & (lines.status == "import")
+        rows = db(query).select(lines.id, lines.valid, lines.data,
+                                orderby=lines.line_no)
+
+        # Unique values of the lines imported so far
+        seen = dict([(f, set()) for f in self.unique])
+
+        imported = []
+        try:
+            records = []
+            for line in rows:
+                counters.lines += 1
+                if not line.valid:
+                    # Skip invalid lines.
+                    counters.failed += 1
+                    continue
+                data = s3_import_line_data(line.data)
+                if data is None:
+                    counters.failed += 1
+                    db(lines.id == line.id).update(errors="Could not decode data")
+                    continue
+                values, errors = self.validate(data)
+                if errors:
+                    counters.failed += 1
+                    db(lines.id == line.id).update(
+                        errors="Import Failed: %s" % ", ".join(errors))
+                    continue
+                duplicates = [f for f in seen
+                              if values.get(f, None) not in (None, "") and
+                                 values[f] in seen[f]]
+                if duplicates:
+                    counters.failed += 1
+                    db(lines.id == line.id).update(
+                        errors="Import Failed: duplicate %s" % ", ".join(duplicates))
+                    continue
+                for f in seen:
+                    if values.get(f, None) not in (None, ""):
+                        seen[f].add(values[f])
+                records.append(values)
+                imported.append(line.id)
+
+                if len(records) >= self.batch_size:
+                    self.table.bulk_insert(records)
+                    records = []
+            if records:
+                self.table.bulk_insert(records)
+
+            for i in xrange(0, len(imported), self.batch_size):
+                ids = imported[i:i + self.batch_size]
+                db(lines.id.belongs(ids)).update(status="imported", errors=None)
+        except:
+            db.rollback()
+            counters.failed += len(imported)
+            counters.imported = 0
+            print >> sys.stderr, "Import job #%d failed: %s" % \
+                                 (job.id, sys.exc_info()[1])
+            db(self.jobs.id == job.id).update(status="processed",
+                                              failure_reason=str(sys.exc_info()[1]))
+            db.commit()
+            return 0
+        counters.imported = len(imported)
+
+        # Update job status.
+        if not counters.failed:
+            db(self.jobs.id == job.id).update(status="imported")
+        else:
+            # If one or more lines failed, put back into processed state,
+            # for user to examine further.
+            db(self.jobs.id == job.id).update(status="processed")
+        db.commit()
+
+        return counters.imported
+
+
+    # -------------------------------------------------------------------------
+    def report(self):
+
+        """ Progress report for the cron log """
+
+        counters = self.counters
+        duration = time.time() - self.start
+        rate = duration and counters.lines / duration or 0
+        return "Import job #%d: %s lines, %s valid, %s imported, %s failed " \
+               "(%.1fs, %.0f lines/s)" % (self.job.id,
+                                          counters.lines,
+                                          counters.valid,
+                                          counters.imported,
+                                          counters.failed,
+                                          duration,
+                                          rate)
+
+
+# *****************************************************************************
@@ -0,0 +1,434 @@
+# -*- coding: utf-8 -*-
+
+""" Sahana-Eden Mailbox Polling
+
+    Incremental download of inbound emails from an IMAP or POP3 mailbox
+    into msg_email_inbox and msg_log, used by cron/email_receive.py
+
+    @copyright: 2010 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+__all__ = ["S3Mailbox"]
+
+import imaplib
+import poplib
+import re
+import socket
+import sys
+import time
+
+from cStringIO import StringIO
+from email.feedparser import FeedParser
+from email.header import decode_header
+
+from gluon.storage import Storage
+
+# *****************************************************************************
+class S3Mailbox(object):
+
+    """ Mailbox poller
+
+        Only new messages are downloaded: for IMAP, the highest UID seen
+        is kept in msg_email_inbound_status (together with UIDVALIDITY),
+        for POP3 the UIDLs of the stored messages are compared with the
+        UIDL list of the server. Messages are fetched, parsed and stored
+        in batches, with one commit per batch, so that an interrupted run
+        continues where it stopped.
+
+        To test against a local mail server, set the server in
+        msg_email_settings to localhost (or pass a connected and logged
+        in imaplib/poplib instance as server).
+
+        @param db: the database
+        @param settings: the msg_email_settings record
+        @param server: an open connection to the server (optional)
+
+    """
+
+    BATCH_SIZE = 50
+
+    # Number of POP3 UIDLs to look up in one query
+    QUERY_SIZE = 500
+
+    def __init__(self, db, settings, server=None):
+
+        self.db = db
+        self.settings = settings
+        self.server = server
+        self.imap = settings.inbound_mail_type == "imap"
+        self.account = "%s@%s" % (settings.inbound_mail_username,
+                                  settings.inbound_mail_server)
+
+        self.counters = Storage(messages=0, attachments=0)
+        self.start = time.time()
+
+
+    # -------------------------------------------------------------------------
+    def status(self, status=None, **fields):
+
+        """ Reads or updates the inbound status record
+
+            @param status: the status message
+            @param fields: other fields to update
+
+            @returns: the status record (before the update)
+
+        """
+
+        db = self.db
+        table = db.msg_email_inbound_status
+        record = db(table.id > 0).select(limitby=(0, 1)).first()
+        if status is not None:
+            fields.update(status=status)
+        if fields:
+            if record:
+                db(table.id == record.id).update(**fields)
+            else:
+                table.insert(**fields)
+        return record
+
+
+    # -------------------------------------------------------------------------
+    def connect(self):
+
+        """ Connects to the server and logs in
+
+            @returns: an error message, or None if successful
+
+        """
+
+        if self.server is not None:
+            return None
+
+        settings = self.settings
+        host = settings.inbound_mail_server
+        port = settings.inbound_mail_port
+        username = settings.inbound_mail_username
+        password = settings.inbound_mail_password
+
+        if self.imap:
+            try:
+                if settings.inbound_mail_ssl:
+                    server = imaplib.IMAP4_SSL(host, port)
+                else:
+                    server = imaplib.IMAP4(host, port)
+            except socket.error, e:
+                return "Cannot connect: %s" % e
+            try:
+                server.login(username, password)
+            except server.error, e:
+                return "Login failed: %s" % e
+        else:
+            try:
+                if settings.inbound_mail_ssl:
+                    server = poplib.POP3_SSL(host, port)
+                else:
+                    server = poplib.POP3(host, port)
+            except socket.error, e:
+                return "Cannot connect: %s" % e
+            try:
+                # Attempting APOP authentication...
+                server.apop(username, password)
+            except poplib.error_proto:
+                # Attempting standard authentication...
+                try:
+                    server.user(username)
+                    server.pass_(password)
+                except poplib.error_proto, e:
+                    return "Login failed: %s" % e
+
+        self.server = server
+        return None
+
+
+    # -------------------------------------------------------------------------
+    def receive(self):
+
+        """ Downloads all new messages
+
+            @returns: the number of received messages, None if the
+                connection failed
+
+        """
+
+        error = self.connect()
+        if error:
+            print >> sys.stderr, error
+            self.status(error)
+            # Explicitly commit DB operations when running from Cron
+            self.db.commit()
+            return None
+
+        if self.imap:
+            self.__receive_imap()
+        else:
+            self.__receive_pop3()
+
+        self.status(self.report())
+        self.db.commit()
+        return self.counters.messages
+
+
+    # -------------------------------------------------------------------------
+    def __receive_imap(self):
+
+        """ Downloads the new messages from an IMAP server """
+
+        server = self.server
+        delete = self.settings.inbound_mail_delete
+
+        server.select()
+        typ, data = server.response("UIDVALIDITY")
+        uidvalidity = data and data[0] and int(data[0]) or 0
+
+        status = self.status()
+        if status and status.uidvalidity == uidvalidity:
+            last_uid = status.last_uid or 0
+        else:
+            # New mailbox (or UIDs have been reassigned by the server)
+            last_uid = 0
+
+        typ, data = server.uid("search", None, "UID %s:*" % (last_uid + 1))
+        # "n:*" always matches the highest UID, even if it is < n
+        uids = [int(uid) for uid in data[0].split() if int(uid) > last_uid]
+        uids.sort()
+
+        for i in xrange(0, len(uids), self.BATCH_SIZE):
+            batch = uids[i:i + self.BATCH_SIZE]
+            typ, data = server.uid("fetch", ",".join(map(str, batch)),
+                                   "(UID BODY.PEEK[])")
+            messages = []
+            for response_part in data:
+                if not isinstance(response_part, tuple):
+                    continue
+                m = re.search(r"UID (\d+)", response_part[0])
+                if m is None:
+                    continue
+                uid = "%s.%s" % (uidvalidity, m.group(1))
+                messages.append(self.parse(uid, [response_part[1]]))
+            self.store(messages)
+            self.status(uidvalidity=uidvalidity, last_uid=batch[-1])
+            # Commit per batch (checkpoint)
+            self.db.commit()
+            if delete:
+                server.uid("store", ",".join(map(str, batch)),
+                           "+FLAGS", r"(\Deleted)")
+
+        if delete and uids:
+            server.expunge()
+        server.close()
+        server.logout()
+
+
+    # -------------------------------------------------------------------------
+    def __receive_pop3(self):
+
+        """ Downloads the new messages from a POP3 server """
+
+        db = self.db
+        server = self.server
+        delete = self.settings.inbound_mail_delete
+
+        try:
+            # List of "number uidl"
+            listing = [item.split(" ", 1) for item in server.uidl()[1]]
+        except poplib.error_proto:
+            # UIDL not supported: download all messages
+            listing = [(item.split(" ")[0], None) for item in server.list()[1]]
+        else:
+            # Look up only the UIDLs on the server, for this account
+            # (messages stored before accounts were recorded have none)
+            table = db.msg_email_inbox
+            account = (table.account == self.account) | \
+                      (table.account == None)
+            uids = [uid for number, uid in listing]
+            known = set()
+            for i in xrange(0, len(uids), self.QUERY_SIZE):
+                query = account & \
+                        (table.uid.belongs(uids[i:i + self.QUERY_SIZE]))
+                known.update([row.uid for row in
+                              db(query).select(table.uid)])
+            listing = [(number, uid) for number, uid in listing
+                       if uid not in known]
+
+        for i in xrange(0, len(listing), self.BATCH_SIZE):
+            batch = listing[i:i + self.BATCH_SIZE]
+            messages = []
+            for number, uid in batch:
+                # Retrieve the message (as list of lines)
+                lines = server.retr(number)[1]
+                messages.append(self.parse(uid, lines, separator="\n"))
+            self.store(messages)
+            # Commit per batch (checkpoint)
+            db.commit()
+            if delete:
+                for number, uid in batch:
+                    server.dele(number)
+
+        server.quit()
+
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def decode(value, charset=None):
+
+        """ Decodes a header value or text part into a UTF-8 string
+
+            @param value: the value
+            @param charset: the charset of the value (for text parts)
+
+        """
+
+        if value is None:
+            return ""
+        if charset is None:
+            # Encoded words in headers
+            try:
+                parts = decode_header(value)
+            except:
+                return value
+            value = []
+            for text, charset in parts:
+                try:
+                    value.append(text.decode(charset or "ascii"))
+                except (LookupError, UnicodeError):
+                    value.append(text.decode("latin-1"))
+            return u" ".join(value).encode("utf-8")
+        try:
+            return value.decode(charset).encode("utf-8")
+        except (LookupError, UnicodeError):
+            return value.decode("latin-1").encode("utf-8")
+
+
+    # -------------------------------------------------------------------------
+    def parse(self, uid, chunks, separator=""):
+
+        """ Parses a message
+
+            @param uid: the UID of the message
+            @param chunks: iterable of the parts of the message source
+                (e.g. lines), fed one by one into the MIME parser
+            @param separator: string to append to each chunk
+
+            @returns: Storage with the message data
+
+        """
+
+        parser = FeedParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+            if separator:
+                parser.feed(separator)
+        msg = parser.close()
+
+        decode = self.decode
+        body = []
+        html = []
+        attachments = []
+        for part in msg.walk():
+            if part.is_multipart():
+                continue
+            filename = part.get_filename()
+            disposition = part.get("Content-Disposition", "").lower()
+            content_type = part.get_content_type()
+            if filename or disposition.startswith("attachment"):
+                attachments.append((decode(filename) or "attachment",
+                                    part.get_payload(decode=True) or ""))
+            elif content_type == "text/plain":
+                charset = part.get_content_charset() or "ascii"
+                body.append(decode(part.get_payload(decode=True) or "", charset))
+            elif content_type == "text/html":
+                charset = part.get_content_charset() or "ascii"
+                html.append(decode(part.get_payload(decode=True) or "", charset))
+
+        return Storage(uid=uid,
+                       sender=decode(msg["from"]),
+                       subject=decode(msg["subject"]),
+                       body="\n".join(body or html),
+                       attachments=attachments)
+
+
+    # -------------------------------------------------------------------------
+    def store(self, messages):
+
+        """ Stores a batch of messages
+
+            @param messages: list of parsed messages (from parse())
+
+        """
+
+        if not messages:
+            return
+
+        db = self.db
+
+        # Message Log (inbound, channel email)
+        log_ids = db.msg_log.bulk_insert([dict(inbound=True,
+                                               fromaddress=m.sender,
+                                               subject=m.subject.decode("utf-8")[:78].encode("utf-8"),
+                                               message=m.body)
+                                          for m in messages])
+        db.msg_channel.bulk_insert([dict(message_id=message_id,
+                                         pr_message_method=1)
+                                    for message_id in log_ids])
+
+        email_ids = db.msg_email_inbox.bulk_insert([dict(message_id=message_id,
+                                                         account=self.account,
+                                                         uid=m.uid,
+                                                         sender=m.sender,
+                                                         subject=m.subject,
+                                                         body=m.body)
+                                                    for m, message_id in
+                                                    zip(messages, log_ids)])
+
+        table = db.msg_email_attachment
+        attachments = []
+        for m, email_id in zip(messages, email_ids):
+            for name, data in m.attachments:
+                attachments.append(dict(email_id=email_id,
+                                        name=name,
+                                        file=table.file.store(StringIO(data),
+                                                              name)))
+        if attachments:
+            table.bulk_insert(attachments)
+
+        self.counters.messages += len(messages)
+        self.counters.attachments += len(attachments)
+
+
+    # -------------------------------------------------------------------------
+    def report(self):
+
+        """ Status report """
+
+        counters = self.counters
+        return "%s messages (%s attachments) received in %.1fs" % \
+               (counters.messages,
+                counters.attachments,
+                time.time() - self.start)
+
+
+# *****************************************************************************
@@ -0,0 +1,435 @@
+# -*- coding: utf-8 -*-
+
+""" Sahana-Eden Record Matching Toolkit
+
+    String similarity kernels and a blocking index for fuzzy matching
+    and de-duplication of records (persons, locations, spreadsheet rows)
+
+    @copyright: 2010 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+__all__ = ["s3_levenshtein",
+           "s3_rlevenshtein",
+           "s3_jaro_winkler",
+           "s3_soundex",
+           "s3_key_soundex",
+           "s3_key_prefix",
+           "s3_key_year",
+           "S3MatchIndex"]
+
+from array import array
+
+# *****************************************************************************
+# Similarity kernels
+#
+def s3_levenshtein(str1, str2, limit=None):
+
+    """ Levenshtein distance of two strings, computed with two rows
+        of an integer array instead of the full matrix
+
+        @param str1: the first string
+        @param str2: the second string
+        @param limit: stop as soon as the distance exceeds this value
+            (returns limit + 1 then)
+
+    """
+
+    if str1 == str2:
+        return 0
+
+    l1 = len(str1)
+    l2 = len(str2)
+    if l1 < l2:
+        str1, str2, l1, l2 = str2, str1, l2, l1
+    if limit is not None and l1 - l2 > limit:
+        return limit + 1
+    if not l2:
+        return l1
+
+    previous = array("l", xrange(l2 + 1))
+    current = array("l", [0]) * (l2 + 1)
+
+    for i in xrange(1, l1 + 1):
+        c = str1[i - 1]
+        current[0] = rowmin = i
+        for j in xrange(1, l2 + 1):
+            value = previous[j - 1]
+            if c != str2[j - 1]:
+                value += 1
+            other = current[j - 1] + 1
+            if other < value:
+                value = other
+            other = previous[j] + 1
+            if other < value:
+                value = other
+            current[j] = value
+            if value < rowmin:
+                rowmin = value
+        if limit is not None and rowmin > limit:
+            return limit + 1
+        previous, current = current, previous
+
+    distance = previous[l2]
+    if limit is not None and distance > limit:
+        return limit + 1
+    return distance
+
+
+# -----------------------------------------------------------------------------
+def s3_rlevenshtein(str1, str2):
+
+    """ Levenshtein distance in relation to the maximum string length,
+        hence 0.0 for identical and 1.0 for completely different strings
+
+        @param str1: the first string
+        @param str2: the second string
+
+    """
+
+    length = max(len(str1), len(str2))
+    if not length:
+        return 0.0
+    return float(s3_levenshtein(str1, str2)) / length
+
+
+# -----------------------------------------------------------------------------
+def s3_jaro_winkler(str1, str2, prefix_weight=0.1):
+
+    """ Jaro-Winkler similarity of two strings (between 0.0 and 1.0)
+
+        @param str1: the first string
+        @param str2: the second string
+        @param prefix_weight: weight of the common prefix (max. 4 characters)
+
+    """
+
+    if str1 == str2:
+        return 1.0
+
+    l1 = len(str1)
+    l2 = len(str2)
+    if not l1 or not l2:
+        return 0.0
+
+    window = max(max(l1, l2) / 2 - 1, 0)
+    flags1 = array("b", [0]) * l1
+    flags2 = array("b", [0]) * l2
+
+    # Common characters
+    common = 0
+    for i in xrange(l1):
+        c = str1[i]
+        for j in xrange(max(0, i - window), min(i + window + 1, l2)):
+            if not flags2[j] and str2[j] == c:
+                flags1[i] = flags2[j] = 1
+                common += 1
+                break
+    if not common:
+        return 0.0
+
+    # Transpositions
+    transpositions = 0
+    k = 0
+    for i in xrange(l1):
+        if flags1[i]:
+            while not flags2[k]:
+                k += 1
+            if str1[i] != str2[k]:
+                transpositions += 1
+            k += 1
+
+    m = float(common)
+    jaro = (m / l1 + m / l2 + (m - transpositions / 2.0) / m) / 3.0
+
+    # Common prefix
+    prefix = 0
+    for i in xrange(min(4, l1, l2)):
+        if str1[i] != str2[i]:
+            break
+        prefix += 1
+
+    return jaro + prefix * prefix_weight * (1.0 - jaro)
+
+
+# -----------------------------------------------------------------------------
+SOUNDEX_CODES = dict([(c, str(code))
+                      for code, letters in enumerate(["aeiouyhw",
+                                                      "bfpv",
+                                                      "cgjkqsxz",
+                                                      "dt",
+                                                      "l",
+                                                      "mn",
+                                                      "r"])
+                      for c in letters])
+
+def s3_soundex(name):
+
+    """ American Soundex code of a name (e.g. "R163" for "Robert"),
+        None if the name contains no (ASCII) letters
+
+        @param name: the name
+
+    """
+
+    letters = [c for c in name.lower() if c in SOUNDEX_CODES]
+    if not letters:
+        return None
+
+    first = letters[0]
+    code = [first.upper()]
+    last = SOUNDEX_CODES[first]
+    for c in letters[1:]:
+        digit = SOUNDEX_CODES[c]
+        if digit != "0" and digit != last:
+            code.append(digit)
+            if len(code) == 4:
+                break
+        if c not in "hw":
+            last = digit
+
+    return "".join(code).ljust(4, "0")
+
+
+# *****************************************************************************
+# Blocking keys
+#
+def s3_key_soundex(field):
+
+    """ Blocking key: Soundex code of a field value """
+
+    def key(record):
+        value = record.get(field, None)
+        return value and s3_soundex(value) or None
+    return key
+
+
+# -----------------------------------------------------------------------------
+def s3_key_prefix(field, length=2):
+
+    """ Blocking key: first characters of a field value """
+
+    def key(record):
+        value = record.get(field, None)
+        if value:
+            if not isinstance(value, basestring):
+                value = str(value)
+            value = value.strip().lower()
+        return value and value[:length] or None
+    return key
+
+
+# -----------------------------------------------------------------------------
+def s3_key_year(field):
+
+    """ Blocking key: year of a date field """
+
+    def key(record):
+        value = record.get(field, None)
+        return value and getattr(value, "year", None) or None
+    return key
+
+
+# *****************************************************************************
+class S3MatchIndex(object):
+
+    """ Candidate index for fuzzy record matching
+
+        Records are grouped into blocks by a number of blocking keys
+        (e.g. Soundex code of the last name, first name prefix, birth
+        year), and only records sharing at least one block are compared.
+
+        @param keys: list of blocking key functions, each taking a record
+            and returning a key (or None if the key doesn't apply)
+        @param fields: list of (fieldname, weight) to compare
+        @param max_block: blocks with more records than this are ignored
+            when searching for duplicates (too unspecific)
+
+    """
+
+    def __init__(self, keys, fields, max_block=None):
+
+        self.keys = keys
+        self.fields = [(f, float(w)) for f, w in fields]
+        self.max_block = max_block
+
+        self.blocks = {}
+        self.records = {}
+
+
+    # -------------------------------------------------------------------------
+    def add(self, id, record):
+
+        """ Adds a record to the index
+
+            @param id: the record ID
+            @param record: the record (dict-like)
+
+        """
+
+        self.records[id] = self.normalize(record)
+        record = self.records[id]
+        blocks = self.blocks
+        for i in xrange(len(self.keys)):
+            k = self.keys[i](record)
+            if k is None:
+                continue
+            block = (i, k)
+            if block in blocks:
+                blocks[block].append(id)
+            else:
+                blocks[block] = [id]
+
+
+    # -------------------------------------------------------------------------
+    def normalize(self, record):
+
+        """ Normalizes the text values of the compared fields """
+
+        data = dict(record)
+        for f, w in self.fields:
+            value = data.get(f, None)
+            if isinstance(value, str):
+                value = value.decode("utf-8")
+            if isinstance(value, unicode):
+                value = u" ".join(value.lower().split())
+            data[f] = value
+        return data
+
+
+    # -------------------------------------------------------------------------
+    def candidates(self, record, exclude_large=False):
+
+        """ Finds all records which share a block with this record
+
+            @param record: the record (dict-like)
+            @param exclude_large: ignore the blocks with more than
+                max_block records
+
+            @returns: set of record IDs
+
+        """
+
+        record = self.normalize(record)
+        max_block = exclude_large and self.max_block or None
+        candidates = set()
+        for i in xrange(len(self.keys)):
+            k = self.keys[i](record)
+            if k is not None:
+                ids = self.blocks.get((i, k), [])
+                if max_block and len(ids) > max_block:
+                    continue
+                candidates.update(ids)
+        return candidates
+
+
+    # -------------------------------------------------------------------------
+    def score(self, record1, record2):
+
+        """ Weighted Jaro-Winkler similarity of two (normalized) records,
+            over the fields which have a value in both records
+
+            @param record1: the first record
+            @param record2: the second record
+
+        """
+
+        total = 0.0
+        weights = 0.0
+        for f, w in self.fields:
+            v1 = record1.get(f, None)
+            v2 = record2.get(f, None)
+            if v1 is None or v2 is None or v1 == "" or v2 == "":
+                continue
+            if isinstance(v1, basestring) and isinstance(v2, basestring):
+                total += w * s3_jaro_winkler(v1, v2)
+            else:
+                total += w * (v1 == v2 and 1.0 or 0.0)
+            weights += w
+        return weights and total / weights or 0.0
+
+
+    # -------------------------------------------------------------------------
+    def match(self, record, threshold=0.85, limit=None):
+
+        """ Finds the records in the index which match a record
+
+            @param record: the record (dict-like)
+            @param threshold: minimum similarity score
+            @param limit: maximum number of results
+
+            @returns: list of tuples (score, id), best matches first
+
+        """
+
+        normalized = self.normalize(record)
+        records = self.records
+        results = []
+        for id in self.candidates(record):
+            score = self.score(normalized, records[id])
+            if score >= threshold:
+                results.append((score, id))
+        results.sort(reverse=True)
+        if limit:
+            results = results[:limit]
+        return results
+
+
+    # -------------------------------------------------------------------------
+    def duplicates(self, threshold=0.9):
+
+        """ Finds all pairs of records in the index which match each other
+
+            @param threshold: minimum similarity score
+
+            @returns: list of tuples (score, id1, id2), best matches first
+
+        """
+
+        records = self.records
+        max_block = self.max_block
+        seen = set()
+        results = []
+        for ids in self.blocks.values():
+            n = len(ids)
+            if n < 2 or max_block and n > max_block:
+                continue
+            for i in xrange(n):
+                id1 = ids[i]
+                record1 = records[id1]
+                for j in xrange(i + 1, n):
+                    id2 = ids[j]
+                    pair = id1 < id2 and (id1, id2) or (id2, id1)
+                    if pair in seen:
+                        continue
+                    seen.add(pair)
+                    score = self.score(record1, records[id2])
+                    if score >= threshold:
+                        results.append((score, pair[0], pair[1]))
+        results.sort(reverse=True)
+        return results
+
+
+# *****************************************************************************
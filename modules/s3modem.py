@@ -0,0 +1,674 @@
+# -*- coding: utf-8 -*-
+
+""" Sahana-Eden SMS Modem Gateway
+
+    Runs any number of locally attached GSM modems in parallel: one
+    worker thread per modem, all taking outgoing messages from a shared
+    queue (so that idle modems pick up the load of busy ones), and
+    receiving new messages as they are indicated by the modem rather
+    than by scanning the SIM storage.
+
+    Used by cron/sms_handler_modem.py
+
+    @copyright: 2010 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+__all__ = ["S3SmsGateway",
+           "S3ModemWorker",
+           "S3ModemSimulator"]
+
+import Queue
+import re
+import sys
+import threading
+import time
+
+# time.strptime (used by pygsm) imports this module on first use,
+# which fails if the first call happens in a thread
+import _strptime
+
+from collections import deque
+
+from gluon.storage import Storage
+from pygsm import errors
+
+# *****************************************************************************
+class S3SmsGateway(object):
+
+    """ SMS gateway for locally attached modems
+
+        All database access happens in the thread which calls run() (or
+        poll()), the worker threads only talk to their modem:
+
+            - outgoing messages from msg_outbox are handed over to the
+              gateway by Msg.process_outbox (the gateway acts as the
+              modem of the Msg instance), and sent by the next idle worker
+            - msg_outbox entries are "Queued" until a worker has sent them,
+              then marked as "Sent"; entries still queued when the gateway
+              starts (=from a previous run which died) are sent again
+            - messages which could not be sent are retried (by any modem)
+              up to MAX_ATTEMPTS times, then marked as invalid
+            - incoming messages are passed from the workers to the gateway
+              and stored in msg_log
+
+        @param msg: the s3msg.Msg instance
+        @param modems: list of pygsm.GsmModem instances
+        @param router: S3Router to answer keyword queries (optional)
+
+    """
+
+    # Seconds between two polls of the database
+    POLL_INTERVAL = 2
+
+    # Don't fetch more messages from msg_outbox while the queue is longer
+    QUEUE_LIMIT = 100
+
+    # Maximum number of attempts to send a message
+    MAX_ATTEMPTS = 3
+
+    # Time window for the send rate, in seconds
+    RATE_WINDOW = 60
+
+    # Seconds between two status reports
+    REPORT_INTERVAL = 300
+
+    def __init__(self, msg, modems, router=None):
+
+        self.msg = msg
+        self.db = msg.db
+        self.router = router
+
+        # The gateway acts as modem for Msg.send_sms_via_modem
+        msg.modem = self
+
+        self.outbox = Queue.Queue()
+        self.inbox = Queue.Queue()
+        self.completed = Queue.Queue()
+        self.failed = Queue.Queue()
+
+        self.sent = deque()
+        self.lock = threading.Lock()
+
+        self.workers = [S3ModemWorker(self, modem, i + 1)
+                        for i, modem in enumerate(modems)]
+
+        self.last_report = time.time()
+
+
+    # -------------------------------------------------------------------------
+    def start(self):
+
+        """ Starts the worker threads """
+
+        # Messages which were queued by a previous run, but not sent
+        db = self.db
+        table = db.msg_outbox
+        db((table.status == 5) & (table.pr_message_method == 2)).update(status=1)
+        db.commit()
+
+        for worker in self.workers:
+            worker.start()
+
+
+    # -------------------------------------------------------------------------
+    def stop(self, timeout=None):
+
+        """ Stops the worker threads (after their current job)
+
+            @param timeout: seconds to wait for each worker
+
+        """
+
+        for worker in self.workers:
+            worker.stopped = True
+        for worker in self.workers:
+            if worker.isAlive():
+                worker.join(timeout)
+
+
+    # -------------------------------------------------------------------------
+    def run(self):
+
+        """ Runs the gateway (forever) """
+
+        self.start()
+        try:
+            while True:
+                self.poll()
+                time.sleep(self.POLL_INTERVAL)
+        finally:
+            self.stop()
+            # Record the messages sent by the workers before they stopped
+            self.update_sent()
+            self.update_failed()
+
+
+    # -------------------------------------------------------------------------
+    def poll(self):
+
+        """ Stores the received messages, answers keyword queries, and
+            queues the pending messages from msg_outbox """
+
+        self.receive()
+
+        if self.router is not None:
+            self.router.process_inbox(self.db, method=2,
+                                      reply=lambda row, text: \
+                                            self.queue_sms(row.fromaddress, text))
+
+        self.update_sent()
+        self.update_failed()
+
+        if self.outbox.qsize() < self.QUEUE_LIMIT:
+            self.msg.process_outbox(contact_method=2, option=2)
+
+        now = time.time()
+        if now - self.last_report > self.REPORT_INTERVAL:
+            self.last_report = now
+            print >> sys.stderr, self.report()
+
+
+    # -------------------------------------------------------------------------
+    def queue_sms(self, recipient, text, outbox_id=None):
+
+        """ Queues an outgoing message
+
+            @param recipient: the phone number
+            @param text: the message text
+            @param outbox_id: the msg_outbox record ID
+
+            @returns: True
+
+        """
+
+        self.outbox.put(Storage(recipient=recipient,
+                                text=text,
+                                outbox_id=outbox_id,
+                                attempts=0))
+        return True
+
+    # Replaces GsmModem.send_sms where the gateway is used as modem
+    send_sms = queue_sms
+
+
+    # -------------------------------------------------------------------------
+    def done(self, job, success):
+
+        """ Called by the workers when a job has been processed
+
+            @param job: the job
+            @param success: whether the message has been sent
+
+        """
+
+        if success:
+            now = time.time()
+            self.lock.acquire()
+            try:
+                self.sent.append(now)
+                self.__expire(now)
+            finally:
+                self.lock.release()
+            self.completed.put(job)
+        else:
+            job.attempts += 1
+            if job.attempts < self.MAX_ATTEMPTS:
+                self.outbox.put(job)
+            else:
+                self.failed.put(job)
+
+
+    # -------------------------------------------------------------------------
+    def received(self, message):
+
+        """ Called by the workers for each incoming message
+
+            @param message: the pygsm IncomingMessage
+
+        """
+
+        self.inbox.put(message)
+
+
+    # -------------------------------------------------------------------------
+    def receive(self):
+
+        """ Stores the received messages in msg_log
+
+            @returns: the number of stored messages
+
+        """
+
+        count = 0
+        while True:
+            try:
+                message = self.inbox.get_nowait()
+            except Queue.Empty:
+                break
+            self.msg.receive_msg(message=message.text,
+                                 fromaddress=message.sender,
+                                 pr_message_method=2)
+            count += 1
+        return count
+
+
+    # -------------------------------------------------------------------------
+    def update_sent(self):
+
+        """ Marks the outbox entries which have been sent as sent """
+
+        ids = []
+        while True:
+            try:
+                job = self.completed.get_nowait()
+            except Queue.Empty:
+                break
+            if job.outbox_id:
+                ids.append(job.outbox_id)
+        if ids:
+            db = self.db
+            table = db.msg_outbox
+            db(table.id.belongs(ids)).update(status=2)
+            db.commit()
+
+
+    # -------------------------------------------------------------------------
+    def update_failed(self):
+
+        """ Marks the outbox entries which could not be sent as invalid """
+
+        ids = []
+        while True:
+            try:
+                job = self.failed.get_nowait()
+            except Queue.Empty:
+                break
+            print >> sys.stderr, "S3SmsGateway: could not send message " \
+                                 "to %s" % job.recipient
+            if job.outbox_id:
+                ids.append(job.outbox_id)
+        if ids:
+            db = self.db
+            table = db.msg_outbox
+            db(table.id.belongs(ids)).update(status=4,
+                                             log="Sending via modem failed")
+            db.commit()
+
+
+    # -------------------------------------------------------------------------
+    def rate(self):
+
+        """ Number of messages sent per minute, over the RATE_WINDOW """
+
+        self.lock.acquire()
+        try:
+            self.__expire(time.time())
+            count = len(self.sent)
+        finally:
+            self.lock.release()
+        return count * 60.0 / self.RATE_WINDOW
+
+
+    # -------------------------------------------------------------------------
+    def stats(self):
+
+        """ Current status of the gateway
+
+            @returns: Storage with the queue depth, send rate (messages
+                per minute) and the statistics of each modem
+
+        """
+
+        return Storage(queue=self.outbox.qsize(),
+                       rate=self.rate(),
+                       modems=[worker.stats for worker in self.workers])
+
+
+    # -------------------------------------------------------------------------
+    def report(self):
+
+        """ Status report for the cron log """
+
+        stats = self.stats()
+        modems = ", ".join(["#%s: %s sent, %s failed, %s received%s" %
+                            (s.number, s.sent, s.failed, s.received,
+                             not s.alive and " (stopped)" or "")
+                            for s in stats.modems])
+        return "S3SmsGateway: %s queued, %.1f sent/min (%s)" % \
+               (stats.queue, stats.rate, modems)
+
+
+    # -------------------------------------------------------------------------
+    def __expire(self, now):
+
+        """ Removes the send times outside of the RATE_WINDOW """
+
+        sent = self.sent
+        limit = now - self.RATE_WINDOW
+        while sent and sent[0] < limit:
+            sent.popleft()
+
+
+# *****************************************************************************
+class S3ModemWorker(threading.Thread):
+
+    """ Worker thread for one modem: sends the messages from the queue of
+        the gateway and collects incoming messages
+
+        Incoming messages are delivered directly (AT+CNMI=2,2 as set by
+        pygsm, intercepted with any command response) or indicated with
+        +CMTI, in which case the unread messages are fetched from the
+        storage with a single AT+CMGL. The storage is additionally checked
+        every FETCH_INTERVAL, for modems which support neither.
+
+        @param gateway: the S3SmsGateway
+        @param modem: the pygsm.GsmModem
+        @param number: the number of the modem (for reports)
+
+    """
+
+    # Seconds to wait for a job before polling the modem
+    PING_INTERVAL = 1
+
+    # Seconds between two checks of the storage
+    FETCH_INTERVAL = 60
+
+    # Seconds to wait after an error of the modem
+    ERROR_DELAY = 10
+
+    def __init__(self, gateway, modem, number):
+
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+
+        self.gateway = gateway
+        self.modem = modem
+        self.stopped = False
+
+        self.stats = Storage(number=number,
+                             sent=0,
+                             failed=0,
+                             received=0,
+                             alive=False)
+
+        self.last_ping = 0
+        self.last_fetch = 0
+
+
+    # -------------------------------------------------------------------------
+    def run(self):
+
+        """ Thread main loop """
+
+        self.stats.alive = True
+        try:
+            while not self.stopped:
+                try:
+                    self.step()
+                except:
+                    print >> sys.stderr, "S3ModemWorker #%s: %s" % \
+                                         (self.stats.number, sys.exc_info()[1])
+                    time.sleep(self.ERROR_DELAY)
+        finally:
+            self.stats.alive = False
+
+
+    # -------------------------------------------------------------------------
+    def step(self):
+
+        """ Processes one job from the queue (if any), and collects the
+            incoming messages """
+
+        gateway = self.gateway
+
+        try:
+            job = gateway.outbox.get(True, self.PING_INTERVAL)
+        except Queue.Empty:
+            job = None
+
+        if job is not None:
+            try:
+                success = self.modem.send_sms(job.recipient, job.text)
+            except:
+                # Modem failure: counts as a failed attempt (the job goes
+                # back to the queue for the other modems until MAX_ATTEMPTS)
+                self.stats.failed += 1
+                gateway.done(job, False)
+                raise
+            if not success:
+                self.stats.failed += 1
+                gateway.done(job, False)
+            else:
+                self.stats.sent += 1
+                gateway.done(job, True)
+
+        self.collect()
+
+
+    # -------------------------------------------------------------------------
+    def collect(self):
+
+        """ Collects the incoming messages of the modem """
+
+        modem = self.modem
+
+        now = time.time()
+        if now - self.last_ping >= self.PING_INTERVAL:
+            # Any command response delivers pending +CMT messages, and
+            # +CMTI indications for messages put into the storage
+            self.last_ping = now
+            lines = modem.command("AT", raise_errors=False) or []
+            indicated = [l for l in lines if l.startswith("+CMTI:")]
+            if indicated or now - self.last_fetch >= self.FETCH_INTERVAL:
+                self.last_fetch = now
+                self.fetch()
+
+        while True:
+            message = modem.next_message(ping=False, fetch=False)
+            if message is None:
+                break
+            self.stats.received += 1
+            self.gateway.received(message)
+
+
+    # -------------------------------------------------------------------------
+    def fetch(self):
+
+        """ Fetches the unread messages from the storage of the modem,
+            and deletes all read messages from it """
+
+        modem = self.modem
+        before = len(modem.incoming_queue)
+        try:
+            modem._fetch_stored_messages()
+        except errors.GsmError:
+            # Storage not supported
+            return
+        if len(modem.incoming_queue) > before:
+            # AT+CMGD=1,1 deletes all read messages
+            modem.command("AT+CMGD=1,1", raise_errors=False)
+
+
+# *****************************************************************************
+class S3ModemSimulator(object):
+
+    """ Simulated GSM modem in text mode, implementing the device
+        interface of pygsm (pygsm.devicewrapper.DeviceWrapper), so that
+        the gateway can be tested without hardware:
+
+            device = S3ModemSimulator(delay=0.5)
+            modem = pygsm.GsmModem(device=device, mode="text")
+            device.deliver("+1234567", "get hospital phone")
+            ...
+            print device.sent
+
+        @param delay: seconds to send a message
+        @param store: store incoming messages and indicate them with
+            +CMTI (otherwise delivered directly with +CMT)
+        @param fail: list of recipients which fail to receive messages
+
+    """
+
+    CMGS = re.compile(r'^AT\+CMGS="(.+?)"$')
+    TIMESTAMP = "10/10/10,12:00:00+00"
+
+    def __init__(self, delay=0, store=False, fail=None):
+
+        self.delay = delay
+        self.store = store
+        self.fail = fail or []
+
+        self.lock = threading.Lock()
+
+        self.sent = []
+        self.storage = dict()
+        self.unsolicited = []
+
+        self.recipient = None
+        self.response = None
+        self.is_open = True
+
+
+    # -------------------------------------------------------------------------
+    def deliver(self, sender, text):
+
+        """ Simulates the arrival of a message
+
+            @param sender: the phone number of the sender
+            @param text: the message text
+
+        """
+
+        self.lock.acquire()
+        try:
+            if self.store:
+                index = max([0] + self.storage.keys()) + 1
+                self.storage[index] = Storage(sender=sender,
+                                              text=text,
+                                              read=False)
+                self.unsolicited.append('+CMTI: "SM",%s' % index)
+            else:
+                self.unsolicited.extend(['+CMT: "%s","","%s"' %
+                                         (sender, self.TIMESTAMP), text])
+        finally:
+            self.lock.release()
+
+
+    # -------------------------------------------------------------------------
+    def isOpen(self):
+
+        return self.is_open
+
+
+    # -------------------------------------------------------------------------
+    def close(self):
+
+        self.is_open = False
+
+
+    # -------------------------------------------------------------------------
+    def write(self, str):
+
+        """ Receives a command (or the message text after AT+CMGS) """
+
+        self.lock.acquire()
+        try:
+            if self.recipient is not None:
+                # Message text, terminated with ctrl+z
+                recipient = self.recipient
+                self.recipient = None
+                if self.delay:
+                    time.sleep(self.delay)
+                if recipient in self.fail:
+                    self.response = ["+CMS ERROR: 500"]
+                else:
+                    self.sent.append((recipient, str.rstrip(chr(26))))
+                    self.response = ["+CMGS: %s" % len(self.sent), "OK"]
+            else:
+                self.response = self.__command(str.strip())
+        finally:
+            self.lock.release()
+
+
+    # -------------------------------------------------------------------------
+    def read_lines(self, read_term=None, read_timeout=None):
+
+        """ Returns the response to the last command, preceded by any
+            unsolicited messages """
+
+        self.lock.acquire()
+        try:
+            response = self.response
+            self.response = None
+            if response is None:
+                # Prompt for the message text
+                raise errors.GsmReadTimeoutError([">", " "])
+            lines = self.unsolicited + response
+            self.unsolicited = []
+        finally:
+            self.lock.release()
+
+        if lines[-1] != "OK":
+            m = re.match(r"^\+(CM[ES]) ERROR: (\d+)$", lines[-1])
+            if m is not None:
+                raise errors.GsmModemError(m.group(1), int(m.group(2)))
+            raise errors.GsmModemError
+        return lines
+
+
+    # -------------------------------------------------------------------------
+    def __command(self, cmd):
+
+        """ Response to an AT command """
+
+        m = self.CMGS.match(cmd)
+        if m is not None:
+            self.recipient = m.group(1)
+            return None
+
+        if cmd.startswith("AT+CMGL"):
+            lines = []
+            for index in sorted(self.storage.keys()):
+                message = self.storage[index]
+                if not message.read:
+                    message.read = True
+                    lines.append('+CMGL: %s,"REC UNREAD","%s",,"%s"' %
+                                 (index, message.sender, self.TIMESTAMP))
+                    lines.append(message.text)
+            return lines + ["OK"]
+        elif cmd == "AT+CMGD=1,1":
+            for index in self.storage.keys():
+                if self.storage[index].read:
+                    del self.storage[index]
+        elif cmd == "AT+CSQ":
+            return ["+CSQ: 20,99", "OK"]
+        elif cmd == "AT+CSMP?":
+            return ["+CSMP: 17,167,0,0", "OK"]
+
+        return ["OK"]
+
+
+# *****************************************************************************
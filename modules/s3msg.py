@@ -124,9 +124,11 @@ class Msg(object):
 
         return clean
 
-    def send_sms_via_modem(self, mobile, text=""):
+    def send_sms_via_modem(self, mobile, text="", outbox_id=None):
         """
             Function to send SMS via locally-attached Modem
+            - outbox_id: the msg_outbox record (the modem gateway
+              sends the message asynchronously)
         """
 
         mobile = self.sanitise_phone(mobile)
@@ -135,6 +137,8 @@ class Msg(object):
         mobile = "+" + mobile
 
         try:
+            if outbox_id is not None and hasattr(self.modem, "queue_sms"):
+                return self.modem.queue_sms(mobile, text, outbox_id)
             self.modem.send_sms(mobile, text)
             return True
         except:
@@ -403,7 +407,8 @@ class Msg(object):
                         return self.send_text_via_twitter(recipient.value, message)
                     if (contact_method == 2 and option == 2):
                         if self.outgoing_sms_handler == "Modem":
-                            return self.send_sms_via_modem(recipient.value, message)
+                            return self.send_sms_via_modem(recipient.value, message,
+                                                           outbox_id=row.id)
                         else:
                             return False
                     if (contact_method == 2 and option == 1):
@@ -469,8 +474,14 @@ class Msg(object):
                 status = dispatch_to_pe_id(entity)
 
             if status:
-                # Update status to sent in Outbox
-                db(table.id == row.id).update(status=2)
+                if contact_method == 2 and option == 2 and \
+                   hasattr(self.modem, "queue_sms"):
+                    # Queued in the modem gateway, which marks it as sent
+                    # (or invalid) when the modem is done
+                    db(table.id == row.id).update(status=5)
+                else:
+                    # Update status to sent in Outbox
+                    db(table.id == row.id).update(status=2)
                 # Set message log to actioned
                 db(db.msg_log.id == message_id).update(actioned=True)
                 # Explicitly commit DB operations when running from Cron
@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+
+""" Sahana-Eden Query Profiler
+
+    Opt-in instrumentation of the database queries of a request
+
+    @copyright: 2010 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+__all__ = ["S3ProfilingCursor",
+           "S3QueryProfiler"]
+
+import os
+import re
+import sys
+import time
+import traceback
+
+import gluon.contrib.simplejson as json
+
+from gluon.storage import Storage
+from gluon.html import DIV, TABLE, THEAD, TBODY, TR, TH, TD, PRE
+
+# *****************************************************************************
+class S3ProfilingCursor(object):
+
+    """ Wrapper for a DB-API cursor, which records every statement
+        executed through it in the profiler
+
+        @param cursor: the cursor
+        @param profiler: the S3QueryProfiler
+
+    """
+
+    def __init__(self, cursor, profiler):
+
+        self.__cursor = cursor
+        self.__profiler = profiler
+        self.__query = None
+
+
+    # -------------------------------------------------------------------------
+    def __getattr__(self, name):
+
+        return getattr(self.__cursor, name)
+
+
+    # -------------------------------------------------------------------------
+    def __iter__(self):
+
+        return iter(self.__cursor)
+
+
+    # -------------------------------------------------------------------------
+    def execute(self, sql, *args, **kwargs):
+
+        """ Executes a statement and records it """
+
+        start = time.time()
+        try:
+            return self.__cursor.execute(sql, *args, **kwargs)
+        finally:
+            self.__query = self.__profiler.record(sql, time.time() - start)
+
+
+    # -------------------------------------------------------------------------
+    def __fetch(self, method, *args):
+
+        start = time.time()
+        rows = getattr(self.__cursor, method)(*args)
+        query = self.__query
+        if query is not None:
+            query.duration += time.time() - start
+            if rows is not None:
+                if method == "fetchone":
+                    query.rows += 1
+                else:
+                    query.rows += len(rows)
+        return rows
+
+
+    # -------------------------------------------------------------------------
+    def fetchall(self):
+
+        return self.__fetch("fetchall")
+
+
+    # -------------------------------------------------------------------------
+    def fetchmany(self, *args):
+
+        return self.__fetch("fetchmany", *args)
+
+
+    # -------------------------------------------------------------------------
+    def fetchone(self):
+
+        return self.__fetch("fetchone")
+
+
+# *****************************************************************************
+class S3QueryProfiler(object):
+
+    """ Records SQL, duration, row count and caller of each query of
+        the current request, groups identical statements (different
+        only in their literal values) in order to find N+1 patterns
+        (queries in loops), and reports a per-request summary as debug
+        footer and/or as JSON line in the server log.
+
+        Enable in 000_config.py:
+
+            deployment_settings.base.profiler = True
+
+        Requests which exceed the thresholds are always logged.
+
+        @param db: the database
+        @param request: the current request
+        @param log: write a JSON summary line for every request
+        @param max_queries: threshold for the number of queries
+        @param max_time: threshold for the total query time (seconds)
+        @param max_repeat: threshold for the number of executions of
+            the same statement (N+1 detection)
+
+    """
+
+    # Literals in SQL statements
+    STRING = re.compile(r"'(?:[^']|'')*'")
+    NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+    LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+    # Number of statements to show in the summary
+    TOP = 10
+
+    def __init__(self, db, request,
+                 log=False,
+                 max_queries=100,
+                 max_time=1.0,
+                 max_repeat=10):
+
+        self.db = db
+        self.request = request
+        self.log = log
+        self.max_queries = max_queries
+        self.max_time = max_time
+        self.max_repeat = max_repeat
+
+        self.queries = []
+        self.start = time.time()
+        self.logged = False
+
+        # Our own source file (frames in here are not the caller)
+        self.__srcfile = os.path.splitext(os.path.normcase(__file__))[0]
+
+        self.install()
+
+
+    # -------------------------------------------------------------------------
+    def install(self):
+
+        """ Wraps the cursor of the database connection """
+
+        db = self.db
+        adapter = getattr(db, "_adapter", None)
+        if adapter is not None and hasattr(adapter, "cursor"):
+            # DAL
+            if not isinstance(adapter.cursor, S3ProfilingCursor):
+                adapter.cursor = S3ProfilingCursor(adapter.cursor, self)
+        elif hasattr(db, "_cursor"):
+            # SQLDB
+            if not isinstance(db._cursor, S3ProfilingCursor):
+                db._cursor = S3ProfilingCursor(db._cursor, self)
+
+
+    # -------------------------------------------------------------------------
+    def caller(self):
+
+        """ Finds the frame outside of gluon which issued the query
+
+            @returns: "filename:lineno function" or None
+
+        """
+
+        srcfile = self.__srcfile
+        for filename, lineno, function, text in \
+            reversed(traceback.extract_stack()[:-2]):
+            path = os.path.normcase(filename)
+            if "gluon" in path or os.path.splitext(path)[0] == srcfile:
+                continue
+            return "%s:%s %s" % (filename, lineno, function)
+        return None
+
+
+    # -------------------------------------------------------------------------
+    def record(self, sql, duration):
+
+        """ Records a query (called by S3ProfilingCursor)
+
+            @param sql: the SQL statement
+            @param duration: the execution time (seconds)
+
+            @returns: the query record (updated while fetching rows)
+
+        """
+
+        if not isinstance(sql, basestring):
+            sql = str(sql)
+        query = Storage(sql=sql,
+                        duration=duration,
+                        rows=0,
+                        caller=self.caller())
+        self.queries.append(query)
+        return query
+
+
+    # -------------------------------------------------------------------------
+    def statement(self, sql):
+
+        """ Normalizes an SQL statement (replaces literal values) """
+
+        sql = self.STRING.sub("?", sql)
+        sql = self.NUMBER.sub("?", sql)
+        sql = self.LIST.sub("(?)", sql)
+        return " ".join(sql.split())
+
+
+    # -------------------------------------------------------------------------
+    def summary(self):
+
+        """ Summary of the queries of this request
+
+            @returns: Storage with totals, the statements grouped and
+                sorted by total time, and warnings about thresholds
+                which have been exceeded
+
+        """
+
+        groups = dict()
+        for query in self.queries:
+            statement = self.statement(query.sql)
+            group = groups.get(statement, None)
+            if group is None:
+                group = groups[statement] = Storage(sql=statement,
+                                                    count=0,
+                                                    duration=0.0,
+                                                    rows=0,
+                                                    callers=[])
+            group.count += 1
+            group.duration += query.duration
+            group.rows += query.rows
+            if query.caller and query.caller not in group.callers:
+                group.callers.append(query.caller)
+        statements = groups.values()
+        statements.sort(key=lambda g: g.duration, reverse=True)
+
+        total = len(self.queries)
+        duration = sum([query.duration for query in self.queries])
+        rows = sum([query.rows for query in self.queries])
+
+        warnings = []
+        if self.max_queries and total > self.max_queries:
+            warnings.append("%s queries (max %s)" % (total, self.max_queries))
+        if self.max_time and duration > self.max_time:
+            warnings.append("%.3fs query time (max %.3fs)" % \
+                            (duration, self.max_time))
+        if self.max_repeat:
+            for g in statements:
+                if g.count > self.max_repeat:
+                    warnings.append("N+1: %s x %s (%s)" % \
+                                    (g.count, g.sql[:80],
+                                     ", ".join(g.callers[:3])))
+
+        request = self.request
+        return Storage(url="%s/%s/%s" % (request.controller,
+                                         request.function,
+                                         "/".join(request.args or [])),
+                       method=request.env.request_method,
+                       queries=total,
+                       statements=len(statements),
+                       duration=duration,
+                       rows=rows,
+                       time=time.time() - self.start,
+                       top=statements[:self.TOP],
+                       warnings=warnings)
+
+
+    # -------------------------------------------------------------------------
+    def finish(self, output=None):
+
+        """ Writes the JSON summary line to the server log, if enabled
+            or if thresholds have been exceeded. Can be appended to
+            response.postprocessing, and hence returns the output.
+
+            @param output: the output of the controller
+
+        """
+
+        if not self.logged:
+            self.logged = True
+            summary = self.summary()
+            if self.log or summary.warnings:
+                summary.top = [dict(g) for g in summary.top[:3]]
+                print >> sys.stderr, "S3 Profiler: %s" % json.dumps(summary)
+
+        return output
+
+
+    # -------------------------------------------------------------------------
+    def footer(self):
+
+        """ Summary of the queries of this request as debug footer
+
+            @returns: a DIV
+
+        """
+
+        summary = self.summary()
+
+        header = "%s queries (%s distinct), %.3fs, %s rows, request %.3fs" % \
+                 (summary.queries,
+                  summary.statements,
+                  summary.duration,
+                  summary.rows,
+                  summary.time)
+
+        rows = []
+        for g in summary.top:
+            if self.max_repeat and g.count > self.max_repeat:
+                _class = "error"
+            else:
+                _class = None
+            rows.append(TR(TD(g.count),
+                           TD("%.3f" % g.duration),
+                           TD(g.rows),
+                           TD(PRE(g.sql)),
+                           TD("\n".join(g.callers[:3])),
+                           _class=_class))
+
+        warnings = [DIV(w, _class="warning") for w in summary.warnings]
+
+        return DIV(DIV(header),
+                   DIV(*warnings),
+                   TABLE(THEAD(TR(TH("count"),
+                                  TH("time (s)"),
+                                  TH("rows"),
+                                  TH("statement"),
+                                  TH("called from"))),
+                         TBODY(*rows)),
+                   _id="s3_profiler")
+
+
+# *****************************************************************************
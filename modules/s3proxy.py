@@ -0,0 +1,538 @@
+# -*- coding: utf-8 -*-
+
+""" Sahana-Eden HTTP Proxy
+
+    Caching, streaming proxy for remote map layers and feeds (used by
+    gis/proxy, which OpenLayers uses as ProxyHost)
+
+    @copyright: 2010 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+__all__ = ["S3Proxy"]
+
+import os
+import re
+import socket
+import threading
+import time
+import urllib2
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+import gluon.contrib.simplejson as json
+
+# *****************************************************************************
+class S3Proxy(object):
+
+    """ Caching, streaming HTTP proxy
+
+        Responses are passed through to the client in chunks, and GET
+        responses are written to an on-disk cache at the same time,
+        keyed by the URL and the request headers which select the
+        representation (Accept, Accept-Language). Cached responses are
+        served until they expire (max-age of the upstream, or the
+        default TTL), and are then revalidated with If-None-Match /
+        If-Modified-Since. If the upstream fails, a stale copy is
+        served rather than an error.
+
+        Responses which exceed the size limit or the timeout are never
+        passed on incomplete: responses without Content-Length are read
+        completely before the status is sent (and answered with 502 if
+        they exceed the limits), and streamed responses are aborted
+        (the connection is dropped).
+
+        Concurrent requests for the same URL (in the same process) are
+        collapsed into one upstream request: the others wait for it to
+        complete, and are then served from the cache.
+
+        @param folder: the cache folder
+        @param ttl: default time-to-live of cache entries (seconds)
+        @param max_size: maximum size of a response (bytes)
+        @param timeout: maximum time for an upstream request (seconds)
+
+    """
+
+    CHUNK_SIZE = 65536
+
+    # Request headers which select the representation
+    VARY = ("Accept", "Accept-Language")
+
+    # Response headers passed on to the client
+    HEADERS = ("Content-Type",
+               "Content-Encoding",
+               "Content-Language",
+               "Content-Disposition",
+               "ETag",
+               "Last-Modified",
+               "Cache-Control",
+               "Expires")
+
+    MAX_AGE = re.compile(r"max-age\s*=\s*(\d+)")
+
+    # Upstream requests in progress (per process), by cache key
+    pending = dict()
+    lock = threading.Lock()
+
+    def __init__(self, folder,
+                 ttl=300,
+                 max_size=10485760,
+                 timeout=30):
+
+        self.folder = folder
+        self.ttl = ttl
+        self.max_size = max_size
+        self.timeout = timeout
+
+        if not os.path.exists(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # Created in the meantime
+                pass
+
+
+    # -------------------------------------------------------------------------
+    def get(self, url, headers=None):
+
+        """ GET a URL through the cache
+
+            @param url: the URL
+            @param headers: the request headers {name:value}
+
+            @returns: tuple (status, headers, body), where body is
+                an iterable of chunks
+
+        """
+
+        headers = self.__request_headers(headers)
+        key = self.key(url, headers)
+
+        meta = self.__read_meta(key)
+        if meta and meta["expires"] > time.time():
+            body = self.__read(key)
+            if body is not None:
+                return self.__cached(meta, body, "HIT")
+
+        # Collapse concurrent requests for the same URL
+        self.lock.acquire()
+        try:
+            event = self.pending.get(key, None)
+            if event is None:
+                event = self.pending[key] = threading.Event()
+                leader = True
+            else:
+                leader = False
+        finally:
+            self.lock.release()
+
+        if not leader:
+            start = time.time()
+            event.wait(self.timeout)
+            meta = self.__read_meta(key)
+            if meta and \
+               (meta["expires"] > time.time() or meta["date"] >= start):
+                # Fresh, or just fetched by the other request
+                body = self.__read(key)
+                if body is not None:
+                    return self.__cached(meta, body, "HIT")
+            # The other request didn't produce a cache entry
+            return self.forward(url, headers=headers)
+
+        try:
+            return self.__refresh(key, url, headers, meta)
+        except:
+            self.__release(key)
+            raise
+
+
+    # -------------------------------------------------------------------------
+    def forward(self, url, data=None, headers=None):
+
+        """ Forwards a request without caching (e.g. POST)
+
+            @param url: the URL
+            @param data: the request body
+            @param headers: the request headers {name:value}
+
+            @returns: tuple (status, headers, body)
+
+        """
+
+        request = urllib2.Request(url, data, headers or {})
+        try:
+            upstream = urllib2.urlopen(request, timeout=self.timeout)
+        except urllib2.HTTPError, e:
+            upstream = e
+        except (urllib2.URLError, socket.error), e:
+            return self.__error(502, "Upstream request failed: %s" % e)
+
+        status = upstream.code
+        response_headers = self.__response_headers(upstream.info())
+        source, length = self.__body(upstream)
+        if source is None:
+            return self.__error(502, length)
+
+        response_headers["Content-Length"] = str(length)
+        return (status, response_headers, self.__stream(source, length))
+
+
+    # -------------------------------------------------------------------------
+    def key(self, url, headers):
+
+        """ Cache key for a request """
+
+        vary = ["%s:%s" % (h, headers.get(h, "")) for h in self.VARY]
+        return sha1("\n".join([url] + vary)).hexdigest()
+
+
+    # -------------------------------------------------------------------------
+    def clean(self):
+
+        """ Removes cache entries which have expired more than a day
+            ago (and left-over temporary files)
+
+            @returns: the number of removed entries
+
+        """
+
+        now = time.time()
+        removed = 0
+        for filename in os.listdir(self.folder):
+            path = os.path.join(self.folder, filename)
+            if filename.endswith(".tmp"):
+                if os.path.getmtime(path) < now - 3600:
+                    os.unlink(path)
+                continue
+            if not filename.endswith(".meta"):
+                continue
+            key = filename[:-5]
+            meta = self.__read_meta(key)
+            if meta is None or meta["expires"] < now - 86400:
+                for suffix in (".meta", ".data"):
+                    try:
+                        os.unlink(os.path.join(self.folder, key + suffix))
+                    except OSError:
+                        pass
+                removed += 1
+        return removed
+
+
+    # -------------------------------------------------------------------------
+    def __refresh(self, key, url, headers, meta):
+
+        """ Fetches or revalidates a cache entry (leader request) """
+
+        request_headers = dict(headers)
+        if meta:
+            if meta.get("etag", None):
+                request_headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified", None):
+                request_headers["If-Modified-Since"] = meta["last_modified"]
+
+        request = urllib2.Request(url, None, request_headers)
+        try:
+            upstream = urllib2.urlopen(request, timeout=self.timeout)
+        except urllib2.HTTPError, e:
+            if e.code == 304 and meta:
+                # Not modified: extend the cache entry
+                body = self.__read(key)
+                if body is not None:
+                    meta["date"] = time.time()
+                    meta["expires"] = meta["date"] + self.__max_age(e.info())
+                    self.__write_meta(key, meta)
+                    self.__release(key)
+                    return self.__cached(meta, body, "REVALIDATED")
+            self.__release(key)
+            response_headers = self.__response_headers(e.info())
+            source, length = self.__body(e)
+            if source is None:
+                return self.__error(502, length)
+            response_headers["Content-Length"] = str(length)
+            return (e.code, response_headers, self.__stream(source, length))
+        except (urllib2.URLError, socket.error), e:
+            self.__release(key)
+            if meta:
+                # Serve stale
+                body = self.__read(key)
+                if body is not None:
+                    return self.__cached(meta, body, "STALE")
+            return self.__error(502, "Upstream request failed: %s" % e)
+
+        info = upstream.info()
+        response_headers = self.__response_headers(info)
+        source, length = self.__body(upstream)
+        if source is None:
+            self.__release(key)
+            return self.__error(502, length)
+
+        cache_control = info.get("Cache-Control", "").lower()
+        if upstream.code == 200 and \
+           "no-store" not in cache_control and \
+           "private" not in cache_control:
+            meta = dict(url=url,
+                        headers=response_headers,
+                        etag=info.get("ETag", None),
+                        last_modified=info.get("Last-Modified", None),
+                        date=time.time(),
+                        expires=time.time() + self.__max_age(info))
+        else:
+            meta = None
+
+        response_headers["Content-Length"] = str(length)
+        response_headers["X-Proxy-Cache"] = "MISS"
+        return (upstream.code, response_headers,
+                self.__stream(source, length, key=key, meta=meta))
+
+
+    # -------------------------------------------------------------------------
+    def __body(self, upstream):
+
+        """ Checks the size of an upstream response before the status is
+            passed on: a response without Content-Length is read into
+            memory (within the limits)
+
+            @param upstream: the upstream response
+
+            @returns: tuple (source, length), where source is a file-like
+                object with the body, or (None, error message) if the
+                response exceeds the limits
+
+        """
+
+        length = upstream.info().get("Content-Length", None)
+        if length and length.isdigit():
+            length = int(length)
+            if length > self.max_size:
+                upstream.close()
+                return (None, "Upstream response too large")
+            return (upstream, length)
+
+        deadline = time.time() + self.timeout
+        chunks = []
+        size = 0
+        try:
+            while True:
+                chunk = upstream.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > self.max_size:
+                    return (None, "Upstream response too large")
+                if time.time() > deadline:
+                    return (None, "Upstream response timed out")
+                chunks.append(chunk)
+        except (IOError, socket.error), e:
+            return (None, "Upstream request failed: %s" % e)
+        finally:
+            upstream.close()
+        return (StringIO("".join(chunks)), size)
+
+
+    # -------------------------------------------------------------------------
+    def __stream(self, source, length, key=None, meta=None):
+
+        """ Streams the upstream response in chunks, and writes it
+            into the cache if meta is given. If the response doesn't
+            complete within the timeout, or is shorter than announced,
+            the stream is aborted with an exception (so that the client
+            doesn't take it for complete)
+
+            @param source: the body of the upstream response
+            @param length: the length of the body
+            @param key: the cache key (if this is the leader request)
+            @param meta: the meta data of the cache entry to write
+
+        """
+
+        tmp = None
+        if meta is not None:
+            tmp = os.path.join(self.folder, "%s.%s.%s.tmp" % \
+                                            (key, os.getpid(), id(source)))
+            f = open(tmp, "wb")
+        deadline = time.time() + self.timeout
+        size = 0
+        complete = False
+        try:
+            while size < length:
+                chunk = source.read(min(self.CHUNK_SIZE, length - size))
+                if not chunk:
+                    raise IOError("Upstream response incomplete")
+                size += len(chunk)
+                if time.time() > deadline:
+                    raise IOError("Upstream response timed out")
+                if tmp:
+                    f.write(chunk)
+                yield chunk
+            complete = True
+        finally:
+            source.close()
+            if tmp:
+                f.close()
+                if complete:
+                    path = os.path.join(self.folder, "%s.data" % key)
+                    if os.name == "nt" and os.path.exists(path):
+                        os.unlink(path)
+                    os.rename(tmp, path)
+                    self.__write_meta(key, meta)
+                else:
+                    os.unlink(tmp)
+            if key is not None:
+                self.__release(key)
+
+
+    # -------------------------------------------------------------------------
+    def __cached(self, meta, body, state):
+
+        """ Response from the cache """
+
+        headers = dict([(str(k), str(v)) for k, v in meta["headers"].items()])
+        headers["Content-Length"] = str(os.fstat(body.fileno()).st_size)
+        headers["X-Proxy-Cache"] = state
+        return (200, headers, self.__chunks(body))
+
+
+    # -------------------------------------------------------------------------
+    def __chunks(self, f):
+
+        try:
+            while True:
+                chunk = f.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            f.close()
+
+
+    # -------------------------------------------------------------------------
+    def __read(self, key):
+
+        """ Opens the data file of a cache entry (None if missing) """
+
+        try:
+            return open(os.path.join(self.folder, "%s.data" % key), "rb")
+        except IOError:
+            return None
+
+
+    # -------------------------------------------------------------------------
+    def __read_meta(self, key):
+
+        try:
+            f = open(os.path.join(self.folder, "%s.meta" % key), "rb")
+            try:
+                return json.loads(f.read())
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return None
+
+
+    # -------------------------------------------------------------------------
+    def __write_meta(self, key, meta):
+
+        path = os.path.join(self.folder, "%s.meta" % key)
+        tmp = "%s.%s.%s.tmp" % (path, os.getpid(), threading.currentThread().getName())
+        f = open(tmp, "wb")
+        try:
+            f.write(json.dumps(meta))
+        finally:
+            f.close()
+        if os.name == "nt" and os.path.exists(path):
+            os.unlink(path)
+        os.rename(tmp, path)
+
+
+    # -------------------------------------------------------------------------
+    def __release(self, key):
+
+        """ Ends the collapsing of requests for this key """
+
+        self.lock.acquire()
+        try:
+            event = self.pending.pop(key, None)
+        finally:
+            self.lock.release()
+        if event is not None:
+            event.set()
+
+
+    # -------------------------------------------------------------------------
+    def __max_age(self, info):
+
+        """ Lifetime of a response according to its headers """
+
+        cache_control = info.get("Cache-Control", "") or ""
+        match = self.MAX_AGE.search(cache_control)
+        if match:
+            return int(match.group(1))
+        elif "no-cache" in cache_control.lower():
+            return 0
+        return self.ttl
+
+
+    # -------------------------------------------------------------------------
+    def __request_headers(self, headers):
+
+        """ Request headers passed on to the upstream """
+
+        result = dict()
+        if headers:
+            for name in self.VARY:
+                value = headers.get(name, None)
+                if value:
+                    result[name] = value
+        return result
+
+
+    # -------------------------------------------------------------------------
+    def __response_headers(self, info):
+
+        """ Response headers passed on to the client """
+
+        result = dict()
+        for name in self.HEADERS:
+            value = info.get(name, None)
+            if value:
+                result[name] = value
+        return result
+
+
+    # -------------------------------------------------------------------------
+    def __error(self, status, message):
+
+        return (status, {"Content-Type": "text/plain"}, [message])
+
+
+# *****************************************************************************
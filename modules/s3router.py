@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+""" Sahana-Eden Message Router
+
+    Keyword router for inbound text messages (SMS, Tropo, Twitter):
+    "get <name> hospital phone" is parsed into the keywords {get,
+    hospital, phone} and the search terms ["<name>"], and dispatched
+    to the handler registered for "hospital".
+
+    @copyright: 2010 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+__all__ = ["S3KeywordTrie",
+           "S3Router"]
+
+import sys
+import time
+
+from gluon.storage import Storage
+
+# *****************************************************************************
+class S3KeywordTrie(object):
+
+    """ Trie of keywords, for exact and fuzzy (Levenshtein) lookup of
+        words in a single pass over the trie
+
+        @param keywords: dict {word:canonical keyword}
+
+    """
+
+    END = None
+
+    def __init__(self, keywords):
+
+        self.root = dict()
+        for word, keyword in keywords.items():
+            node = self.root
+            for c in word:
+                node = node.setdefault(c, dict())
+            node[self.END] = keyword
+
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def tolerance(word):
+
+        """ Maximum edit distance for a word of this length """
+
+        length = len(word)
+        if length < 3:
+            return 0
+        elif length < 5:
+            return 1
+        elif length < 9:
+            return 2
+        else:
+            return 3
+
+
+    # -------------------------------------------------------------------------
+    def lookup(self, word):
+
+        """ Finds the keyword for a word
+
+            @param word: the word (lower case)
+
+            @returns: the canonical keyword, or None if no keyword is
+                within the tolerance of the word
+
+        """
+
+        END = self.END
+
+        # Exact match
+        node = self.root
+        for c in word:
+            node = node.get(c, None)
+            if node is None:
+                break
+        else:
+            if END in node:
+                return node[END]
+
+        limit = self.tolerance(word)
+        if not limit:
+            return None
+
+        # Fuzzy match: one row of the Levenshtein matrix per trie level
+        best = [limit + 1, None]
+        first = range(len(word) + 1)
+
+        def search(node, c, previous):
+            current = [previous[0] + 1]
+            for i in xrange(1, len(previous)):
+                cost = previous[i - 1]
+                if word[i - 1] != c:
+                    cost += 1
+                insert = current[i - 1] + 1
+                if insert < cost:
+                    cost = insert
+                delete = previous[i] + 1
+                if delete < cost:
+                    cost = delete
+                current.append(cost)
+            distance = current[-1]
+            if END in node and distance < best[0]:
+                best[0] = distance
+                best[1] = node[END]
+            if min(current) < best[0]:
+                for k, child in node.items():
+                    if k is not END:
+                        search(child, k, current)
+
+        for c, child in self.root.items():
+            if c is not END:
+                search(child, c, first)
+
+        return best[1]
+
+
+# *****************************************************************************
+class S3Router(object):
+
+    """ Keyword router for inbound messages
+
+        Modules register their keywords and a handler for their resource
+        keyword, e.g.:
+
+            router.keywords("phone", "email")
+            router.handler("hospital", shn_hms_msg_handler)
+
+        The handler receives the parsed command, a Storage with:
+
+            message     - the message text
+            keywords    - set of the (canonical) keywords in the message
+            terms       - list of the other words (search terms)
+            name        - the search terms as string
+
+        and returns the reply text.
+
+        The keyword trie is compiled once per process and set of keywords.
+
+    """
+
+    # Compiled tries, by keyword set
+    tries = dict()
+
+    # Handler statistics (per process), by resource keyword
+    statistics = dict()
+
+    def __init__(self):
+
+        self.words = dict()
+        self.handlers = Storage()
+        self.trie = None
+
+
+    # -------------------------------------------------------------------------
+    def keywords(self, *words, **synonyms):
+
+        """ Adds keywords
+
+            @param words: the keywords
+            @param synonyms: word=keyword pairs, e.g. give="get"
+
+        """
+
+        for word in words:
+            self.words[word.lower()] = word.lower()
+        for word, keyword in synonyms.items():
+            self.words[word.lower()] = keyword.lower()
+        self.trie = None
+
+
+    # -------------------------------------------------------------------------
+    def handler(self, keyword, handler):
+
+        """ Registers a handler for a resource keyword
+
+            @param keyword: the resource keyword (e.g. "hospital")
+            @param handler: the handler function
+
+        """
+
+        self.keywords(keyword)
+        self.handlers[keyword.lower()] = handler
+
+
+    # -------------------------------------------------------------------------
+    def compile(self):
+
+        """ Gets the trie for the current keywords (compiled only once
+            per process) """
+
+        if self.trie is None:
+            signature = tuple(sorted(self.words.items()))
+            trie = self.tries.get(signature, None)
+            if trie is None:
+                trie = S3KeywordTrie(self.words)
+                self.tries[signature] = trie
+            self.trie = trie
+        return self.trie
+
+
+    # -------------------------------------------------------------------------
+    def parse(self, message):
+
+        """ Parses a message into keywords and search terms
+
+            @param message: the message text
+
+        """
+
+        trie = self.compile()
+
+        if isinstance(message, unicode):
+            message = message.encode("utf-8")
+        keywords = set()
+        terms = []
+        for word in message.split():
+            keyword = trie.lookup(word.lower())
+            if keyword:
+                keywords.add(keyword)
+            else:
+                terms.append(word)
+
+        return Storage(message=message,
+                       keywords=keywords,
+                       terms=terms,
+                       name=" ".join(terms))
+
+
+    # -------------------------------------------------------------------------
+    def route(self, message):
+
+        """ Routes a message to its handler
+
+            @param message: the message text
+
+            @returns: the reply text
+
+        """
+
+        command = self.parse(message)
+
+        handlers = [k for k in command.keywords if k in self.handlers]
+        if len(handlers) != 1:
+            return "Please provide one of the keywords - %s" % \
+                   ", ".join(sorted(self.handlers.keys()))
+        keyword = handlers[0]
+
+        start = time.time()
+        try:
+            reply = self.handlers[keyword](command)
+        except:
+            print >> sys.stderr, "S3Router: %s handler failed: %s" % \
+                                 (keyword, sys.exc_info()[1])
+            reply = None
+        duration = time.time() - start
+
+        stats = self.statistics.get(keyword, None)
+        if stats is None:
+            stats = self.statistics[keyword] = Storage(count=0, total=0.0, max=0.0)
+        stats.count += 1
+        stats.total += duration
+        if duration > stats.max:
+            stats.max = duration
+
+        return reply or "No Match"
+
+
+    # -------------------------------------------------------------------------
+    def stats(self):
+
+        """ Handler latency statistics of this process
+
+            @returns: list of Storages (keyword, count, avg, max), in
+                seconds, slowest handlers first
+
+        """
+
+        result = []
+        for keyword, s in self.statistics.items():
+            result.append(Storage(keyword=keyword,
+                                  count=s.count,
+                                  avg=s.count and s.total / s.count or 0.0,
+                                  max=s.max))
+        result.sort(key=lambda s: s.avg, reverse=True)
+        return result
+
+
+    # -------------------------------------------------------------------------
+    def process_inbox(self, db, method=None, reply=None, limit=100):
+
+        """ Routes the pending inbound messages in msg_log
+
+            @param db: the database
+            @param method: only messages received via this method
+                (pr_message_method, e.g. 2 for SMS)
+            @param reply: function to send the reply, reply(row, text)
+            @param limit: maximum number of messages to process
+
+            @returns: the number of processed messages
+
+        """
+
+        table = db.msg_log
+        query = (table.inbound == True) & \
+                (table.actioned == False) & \
+                (table.deleted == False)
+        if method is not None:
+            channel = db.msg_channel
+            query = query & (channel.message_id == table.id) & \
+                            (channel.pr_message_method == method)
+        rows = db(query).select(table.id,
+                                table.fromaddress,
+                                table.message,
+                                orderby=table.id,
+                                limitby=(0, limit))
+
+        # Messages by reply
+        replies = dict()
+        for row in rows:
+            text = self.route(row.message or "")
+            if reply is not None:
+                reply(row, text)
+            replies.setdefault(text, []).append(row.id)
+
+        # Mark as actioned, one update per distinct reply
+        for text, ids in replies.items():
+            db(table.id.belongs(ids)).update(actioned=True,
+                                             actioned_comments=text)
+        db.commit()
+
+        return len(rows)
+
+
+# *****************************************************************************
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+
+""" Sahana-Eden Search Index
+
+    Indexed text search for autocomplete and simple search, using the
+    full-text search extension of SQLite (FTS3) or trigram indexes in
+    PostgreSQL (pg_trgm). Other backends fall back to LIKE queries.
+
+    @author: nursix
+    @copyright: 2010 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+__all__ = ["S3SearchIndex"]
+
+import re
+import sys
+
+from gluon.storage import Storage
+
+# *****************************************************************************
+class S3SearchIndex(object):
+
+    """ Search index for text fields
+
+        The index structures are maintained by the database itself
+        (FTS triggers in SQLite, GIN trigram indexes in PostgreSQL),
+        so that imports and direct DAL writes are covered as well.
+
+        @param db: the database
+        @param migrate: create missing index structures
+
+    """
+
+    SQLITE = "sqlite"
+    POSTGRES = "postgres"
+
+    # Index structures known to exist (per process)
+    created = set()
+
+    # Characters which are stripped from search terms
+    SPECIAL = re.compile(r"[^\w\s\-\.']+", re.UNICODE)
+    SEPARATORS = re.compile(r"\W+", re.UNICODE)
+
+    def __init__(self, db, migrate=True):
+
+        self.db = db
+        self.migrate = migrate
+        self.backend = db._dbname
+        self.indexes = Storage()
+
+
+    # -------------------------------------------------------------------------
+    def define(self, table, *fields):
+
+        """ Defines a search index for a table
+
+            @param table: the table
+            @param fields: the names of the text fields to index
+
+        """
+
+        tablename = table._tablename
+        fields = [f for f in fields if f in table.fields]
+        if not fields or \
+           self.backend not in (self.SQLITE, self.POSTGRES):
+            return False
+
+        if tablename not in self.created:
+            if self.migrate:
+                try:
+                    if self.backend == self.SQLITE:
+                        self.__create_fts(table, fields)
+                    else:
+                        self.__create_trgm(table, fields)
+                except:
+                    # Missing FTS support or pg_trgm extension
+                    self.db.rollback()
+                    print >> sys.stderr, "S3SearchIndex: cannot create index " \
+                                         "for %s: %s" % (tablename, sys.exc_info()[1])
+                    return False
+            elif not self.__exists(table, fields):
+                # Not migrating, and the index hasn't been created
+                # => searches use LIKE queries
+                return False
+            self.created.add(tablename)
+
+        self.indexes[tablename] = fields
+        return True
+
+
+    # -------------------------------------------------------------------------
+    def indexed(self, table, fields=None):
+
+        """ Checks whether a table (and the given fields) are indexed
+
+            @param table: the table
+            @param fields: list of field names to search in, None for all
+                indexed fields
+
+        """
+
+        indexed = self.indexes.get(table._tablename, None)
+        if not indexed:
+            return False
+        if not fields:
+            return True
+        fields = set(fields)
+        if self.backend == self.SQLITE:
+            # FTS searches across all columns of the index table
+            return fields == set(indexed)
+        else:
+            return fields.issubset(indexed)
+
+
+    # -------------------------------------------------------------------------
+    def search(self, table, value, fields=None, limit=None, query=None):
+
+        """ Finds the records which match all terms in value, ordered by
+            relevance
+
+            Unlike LIKE queries (substrings), SQLite FTS matches the terms
+            as prefixes of words: "ann" finds "Anna" and "Mary Ann", but
+            not "Joanne". PostgreSQL (pg_trgm) matches substrings.
+
+            @param table: the table
+            @param value: the search string (terms separated by spaces)
+            @param fields: list of field names to search in, None for all
+                indexed fields
+            @param limit: maximum number of record IDs to return
+            @param query: a DAL query to filter the records by (e.g.
+                accessible and not deleted), applied in the same SQL as
+                the index match, so that the limit applies to the
+                filtered results
+
+            @returns: list of record IDs, or None if the table (or any
+                of the fields) is not indexed and the caller has to fall
+                back to a LIKE query
+
+        """
+
+        if not self.indexed(table, fields):
+            return None
+        if not fields:
+            fields = self.indexes[table._tablename]
+
+        if isinstance(value, str):
+            value = value.decode("utf-8")
+        value = value.lower()
+        if self.backend == self.SQLITE:
+            # The FTS tokenizer splits at any non-alphanumeric character
+            terms = [t for t in self.SEPARATORS.split(value) if t]
+        else:
+            terms = self.SPECIAL.sub(" ", value).split()
+        if not terms:
+            return []
+
+        if query is not None:
+            subselect = self.db(query)._select(table.id).rstrip().rstrip(";")
+            if isinstance(subselect, str):
+                subselect = subselect.decode("utf-8")
+        else:
+            subselect = None
+
+        if self.backend == self.SQLITE:
+            sql = self.__query_fts(table, fields, terms, limit, subselect)
+        else:
+            sql = self.__query_trgm(table, fields, terms, limit, subselect)
+        if isinstance(sql, unicode):
+            sql = sql.encode("utf-8")
+
+        return [row[0] for row in self.db.executesql(sql)]
+
+
+    # -------------------------------------------------------------------------
+    def rebuild(self, table):
+
+        """ Rebuilds the search index for a table (e.g. after a restore
+            from a dump which did not include the index tables)
+
+            @param table: the table
+
+        """
+
+        tablename = table._tablename
+        fields = self.indexes.get(tablename, None)
+        if not fields:
+            return False
+
+        if self.backend == self.SQLITE:
+            fts = "s3_fts_%s" % tablename
+            columns = ", ".join(fields)
+            if "deleted" in table.fields:
+                where = " WHERE (deleted IS NULL OR deleted<>'T')"
+            else:
+                where = ""
+            self.db.executesql("DELETE FROM %s;" % fts)
+            self.db.executesql("INSERT INTO %s(docid, %s) SELECT id, %s FROM %s%s;" %
+                               (fts, columns, columns, tablename, where))
+        else:
+            self.db.executesql("REINDEX TABLE %s;" % tablename)
+
+        return True
+
+
+    # -------------------------------------------------------------------------
+    def __exists(self, table, fields):
+
+        """ Checks whether the index structures for a table exist in the
+            database (without creating them)
+
+            @param table: the table
+            @param fields: the indexed fields
+
+        """
+
+        db = self.db
+        tablename = table._tablename
+
+        try:
+            if self.backend == self.SQLITE:
+                fts = "s3_fts_%s" % tablename
+                return bool(db.executesql("SELECT name FROM sqlite_master "
+                                          "WHERE type='table' AND name='%s';" % fts))
+            else:
+                if not db.executesql("SELECT proname FROM pg_proc "
+                                     "WHERE proname='similarity';"):
+                    # pg_trgm not installed
+                    return False
+                for f in fields:
+                    index = "s3_trgm_%s_%s" % (tablename, f)
+                    if not db.executesql("SELECT indexname FROM pg_indexes "
+                                         "WHERE indexname='%s';" % index.lower()):
+                        return False
+                return True
+        except:
+            db.rollback()
+            return False
+
+
+    # -------------------------------------------------------------------------
+    def __create_fts(self, table, fields):
+
+        """ Creates an FTS3 index table and the triggers to maintain it
+
+            @param table: the table
+            @param fields: the fields to index
+
+        """
+
+        db = self.db
+        tablename = table._tablename
+        fts = "s3_fts_%s" % tablename
+
+        if db.executesql("SELECT name FROM sqlite_master "
+                         "WHERE type='table' AND name='%s';" % fts):
+            return
+
+        columns = ", ".join(fields)
+        values = ", ".join(["new.%s" % f for f in fields])
+        if "deleted" in table.fields:
+            where = " WHERE (new.deleted IS NULL OR new.deleted<>'T')"
+        else:
+            where = ""
+
+        db.executesql("CREATE VIRTUAL TABLE %s USING fts3(%s);" % (fts, columns))
+        db.executesql("CREATE TRIGGER %s_ai AFTER INSERT ON %s BEGIN "
+                      "INSERT INTO %s(docid, %s) SELECT new.id, %s%s; END;" %
+                      (fts, tablename, fts, columns, values, where))
+        db.executesql("CREATE TRIGGER %s_au AFTER UPDATE ON %s BEGIN "
+                      "DELETE FROM %s WHERE docid=old.id; "
+                      "INSERT INTO %s(docid, %s) SELECT new.id, %s%s; END;" %
+                      (fts, tablename, fts, fts, columns, values, where))
+        db.executesql("CREATE TRIGGER %s_ad AFTER DELETE ON %s BEGIN "
+                      "DELETE FROM %s WHERE docid=old.id; END;" %
+                      (fts, tablename, fts))
+        self.rebuild(table)
+        db.commit()
+
+
+    # -------------------------------------------------------------------------
+    def __create_trgm(self, table, fields):
+
+        """ Creates GIN trigram indexes for the fields (requires the
+            pg_trgm extension to be installed in the database)
+
+            @param table: the table
+            @param fields: the fields to index
+
+        """
+
+        db = self.db
+        tablename = table._tablename
+
+        for f in fields:
+            index = "s3_trgm_%s_%s" % (tablename, f)
+            if db.executesql("SELECT indexname FROM pg_indexes "
+                             "WHERE indexname='%s';" % index.lower()):
+                continue
+            db.executesql("CREATE INDEX %s ON %s "
+                          "USING gin (lower(%s) gin_trgm_ops);" %
+                          (index, tablename, f))
+        db.commit()
+
+
+    # -------------------------------------------------------------------------
+    def __query_fts(self, table, fields, terms, limit, subselect=None):
+
+        """ Builds the SQL to search an FTS index, matching all terms
+            as word prefixes, exact matches of terms ranked first
+
+            @param table: the table
+            @param fields: the indexed fields
+            @param terms: list of search terms
+            @param limit: maximum number of results
+            @param subselect: SQL selecting the IDs of eligible records
+
+        """
+
+        fts = "s3_fts_%s" % table._tablename
+        match = u" ".join([u"%s*" % t for t in terms])
+        rank = u" + ".join([u"(lower(%s)='%s')" % (f, t)
+                            for f in fields for t in terms])
+
+        if subselect:
+            where = u" AND docid IN (%s)" % subselect
+        else:
+            where = u""
+
+        sql = u"SELECT docid FROM %s WHERE %s MATCH '%s'%s " \
+              u"ORDER BY %s DESC, docid" % (fts, fts, match, where, rank)
+        if limit:
+            sql = u"%s LIMIT %d" % (sql, int(limit))
+
+        return u"%s;" % sql
+
+
+    # -------------------------------------------------------------------------
+    def __query_trgm(self, table, fields, terms, limit, subselect=None):
+
+        """ Builds the SQL to search trigram-indexed fields, matching all
+            terms as substrings of any of the fields, ranked by similarity
+
+            @param table: the table
+            @param fields: the fields to search in
+            @param terms: list of search terms
+            @param limit: maximum number of results
+            @param subselect: SQL selecting the IDs of eligible records
+
+        """
+
+        def escape(term):
+            term = term.replace("\\", "\\\\").replace("'", "''")
+            return term.replace("%", "\\%").replace("_", "\\_")
+
+        conditions = []
+        for t in terms:
+            t = escape(t)
+            conditions.append(u"(%s)" % u" OR ".join(
+                              [u"lower(%s) LIKE '%%%s%%'" % (f, t)
+                               for f in fields]))
+
+        if "deleted" in table.fields:
+            conditions.append(u"(deleted IS NULL OR deleted<>'T')")
+        if subselect:
+            conditions.append(u"id IN (%s)" % subselect)
+
+        value = u" ".join(terms).replace("'", "''")
+        if len(fields) > 1:
+            rank = u"greatest(%s)" % u", ".join(
+                   [u"similarity(lower(%s), '%s')" % (f, value) for f in fields])
+        else:
+            rank = u"similarity(lower(%s), '%s')" % (fields[0], value)
+
+        sql = u"SELECT id FROM %s WHERE %s ORDER BY %s DESC, id" % \
+              (table._tablename, u" AND ".join(conditions), rank)
+        if limit:
+            sql = u"%s LIMIT %d" % (sql, int(limit))
+
+        return u"%s;" % sql
+
+
+# *****************************************************************************
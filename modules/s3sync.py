@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+
+""" Sahana-Eden Synchronization Notification Bus
+
+    In-process message queue and halt flag for manual synchronization
+    runs (sync/now), so that progress messages and HALT commands do not
+    need a database transaction each.
+
+    @copyright: 2010 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+__all__ = ["S3SyncBus"]
+
+import threading
+import time
+
+from gluon.storage import Storage
+
+# *****************************************************************************
+class S3SyncBus(object):
+
+    """ Notification bus for synchronization runs
+
+        The channels are shared by all requests in the process: the
+        sync run pushes messages into its channel, and status requests
+        in the same process wait for them (long-poll). Messages which
+        no status request picks up (e.g. because it is served by another
+        process) are written to sync_notification at checkpoints, as is
+        the HALT flag read from sync_status.
+
+        @param db: the database
+
+    """
+
+    # Channels of the sync runs in this process, by sync_status ID
+    channels = dict()
+    lock = threading.Lock()
+
+    # A channel counts as listened to if a status request has been
+    # waiting for it within this number of seconds
+    LISTENER_TIMEOUT = 30
+
+    def __init__(self, db):
+
+        self.db = db
+
+
+    # -------------------------------------------------------------------------
+    def open(self, pid):
+
+        """ Opens the channel for a sync run (called by the run itself)
+
+            @param pid: the sync_status record ID
+
+        """
+
+        self.lock.acquire()
+        try:
+            self.channels[pid] = Storage(messages=[],
+                                         halt=False,
+                                         closed=False,
+                                         flushed=False,
+                                         last_poll=None,
+                                         condition=threading.Condition())
+        finally:
+            self.lock.release()
+
+
+    # -------------------------------------------------------------------------
+    def close(self, pid):
+
+        """ Closes the channel of a sync run, writing any undelivered
+            messages to the database
+
+            @param pid: the sync_status record ID
+
+        """
+
+        channel = self.channels.get(pid, None)
+        if channel is None:
+            return
+        self.flush(pid)
+        channel.condition.acquire()
+        try:
+            channel.closed = True
+            channel.condition.notifyAll()
+        finally:
+            channel.condition.release()
+        self.lock.acquire()
+        try:
+            if self.channels.get(pid, None) is channel:
+                del self.channels[pid]
+        finally:
+            self.lock.release()
+
+
+    # -------------------------------------------------------------------------
+    def active(self, pid):
+
+        """ Checks whether a sync run has an open channel in this process
+
+            @param pid: the sync_status record ID
+
+        """
+
+        return pid is not None and pid in self.channels
+
+
+    # -------------------------------------------------------------------------
+    def push(self, pid, message, type=""):
+
+        """ Pushes a message into the channel of a sync run
+
+            @param pid: the sync_status record ID
+            @param message: the message text
+            @param type: the message type (e.g. "ERROR", "DONE")
+
+            @returns: False if there is no open channel for this run
+
+        """
+
+        channel = self.channels.get(pid, None)
+        if channel is None:
+            return False
+        channel.condition.acquire()
+        try:
+            channel.messages.append(dict(type=type, message=message))
+            channel.condition.notifyAll()
+        finally:
+            channel.condition.release()
+        return True
+
+
+    # -------------------------------------------------------------------------
+    def wait(self, pid, timeout=10):
+
+        """ Waits for messages of a sync run (long-poll)
+
+            @param pid: the sync_status record ID
+            @param timeout: maximum number of seconds to wait
+
+            @returns: list of messages (dicts with type and message),
+                None if there is no open channel for this run
+
+        """
+
+        channel = self.channels.get(pid, None)
+        if channel is None:
+            return None
+        channel.condition.acquire()
+        try:
+            channel.last_poll = time.time()
+            if not channel.messages and not channel.closed:
+                channel.condition.wait(timeout)
+            messages = channel.messages
+            channel.messages = []
+            channel.last_poll = time.time()
+        finally:
+            channel.condition.release()
+        return messages
+
+
+    # -------------------------------------------------------------------------
+    def flushed(self, pid):
+
+        """ Checks whether messages of a sync run have been written to the
+            database since the last call (then the status request has to
+            read them from there)
+
+            @param pid: the sync_status record ID
+
+        """
+
+        channel = self.channels.get(pid, None)
+        if channel is None or not channel.flushed:
+            return False
+        channel.flushed = False
+        return True
+
+
+    # -------------------------------------------------------------------------
+    def halt(self, pid):
+
+        """ Sets the HALT flag of a sync run in this process
+
+            @param pid: the sync_status record ID
+
+        """
+
+        channel = self.channels.get(pid, None)
+        if channel is not None:
+            channel.halt = True
+
+
+    # -------------------------------------------------------------------------
+    def halted(self, pid):
+
+        """ Checks the in-memory HALT flag of a sync run
+
+            @param pid: the sync_status record ID
+
+        """
+
+        channel = self.channels.get(pid, None)
+        return channel is not None and channel.halt
+
+
+    # -------------------------------------------------------------------------
+    def checkpoint(self, pid):
+
+        """ Synchronizes the channel with the database: writes the
+            undelivered messages if nobody listens in this process, and
+            reads the HALT flag (which may have been set by another
+            process). Commits the current transaction.
+
+            @param pid: the sync_status record ID
+
+            @returns: True if the run shall halt
+
+        """
+
+        db = self.db
+        channel = self.channels.get(pid, None)
+        if channel is None:
+            return False
+
+        last_poll = channel.last_poll
+        if not last_poll or time.time() - last_poll > self.LISTENER_TIMEOUT:
+            self.flush(pid, commit=False)
+
+        table = db.sync_status
+        status = db(table.id == pid).select(table.halt, limitby=(0, 1)).first()
+        if status and status.halt:
+            channel.halt = True
+        db.commit()
+
+        return channel.halt
+
+
+    # -------------------------------------------------------------------------
+    def flush(self, pid, commit=True):
+
+        """ Moves the pending messages of a channel into sync_notification
+
+            @param pid: the sync_status record ID
+            @param commit: commit the transaction
+
+        """
+
+        channel = self.channels.get(pid, None)
+        if channel is None:
+            return
+        channel.condition.acquire()
+        try:
+            messages = channel.messages
+            channel.messages = []
+        finally:
+            channel.condition.release()
+        if messages:
+            table = self.db.sync_notification
+            table.bulk_insert([dict(pid=pid,
+                                    message=m["message"],
+                                    type=m["type"]) for m in messages])
+            channel.flushed = True
+            if commit:
+                self.db.commit()
+
+
+# *****************************************************************************
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+
+""" Sahana-Eden Ushahidi Import
+
+    Incremental import of incidents from Ushahidi instances into
+    Incident Reports (irs_ireport)
+
+    @copyright: 2010 (c) Sahana Software Foundation
+    @license: MIT
+
+    Permission is hereby granted, free of charge, to any person
+    obtaining a copy of this software and associated documentation
+    files (the "Software"), to deal in the Software without
+    restriction, including without limitation the rights to use,
+    copy, modify, merge, publish, distribute, sublicense, and/or sell
+    copies of the Software, and to permit persons to whom the
+    Software is furnished to do so, subject to the following
+    conditions:
+
+    The above copyright notice and this permission notice shall be
+    included in all copies or substantial portions of the Software.
+
+    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+    EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+    OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+    NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+    HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+    WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+    FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+    OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+
+__all__ = ["S3UshahidiImport"]
+
+import cgi
+import datetime
+import time
+import urllib
+import urllib2
+import urlparse
+
+from lxml import etree
+
+# *****************************************************************************
+class S3UshahidiImport(object):
+
+    """ Incremental import of Ushahidi incidents
+
+        Remembers the highest incident ID and date imported from each
+        instance (irs_ushahidi), and pulls only newer incidents from the
+        API (by=sinceid) in pages. Incidents which have already been
+        imported are removed from each page with one query, before the
+        page is transformed (XSLT, compiled once) and imported. Each page
+        is committed separately, so an interrupted pull continues where
+        it stopped.
+
+        @param manager: the resource controller (s3xrc)
+        @param resource: the irs_ireport resource
+        @param template: pathname of the XSLT stylesheet
+        @param page_size: number of incidents per request
+
+    """
+
+    TIMEOUT = 60
+
+    def __init__(self, manager, resource, template, page_size=100):
+
+        self.manager = manager
+        self.db = manager.db
+        self.xml = manager.xml
+        self.resource = resource
+        self.template = template
+        self.page_size = page_size
+
+        self.error = None
+
+        self.pages = 0
+        self.imported = 0
+        self.skipped = 0
+        self.duration = 0.0
+
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def base_url(url):
+
+        """ URL of the API of an instance (identifies the source) """
+
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        return urlparse.urlunsplit((scheme, netloc, path, "", ""))
+
+
+    # -------------------------------------------------------------------------
+    def page_url(self, url, since_id):
+
+        """ URL of the next page of incidents after since_id """
+
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(url)
+        vars = dict(cgi.parse_qsl(query))
+        vars.update(task="incidents",
+                    by="sinceid",
+                    id=since_id,
+                    resp="xml",
+                    limit=self.page_size,
+                    orderfield="incidentid",
+                    sort=0)
+        query = urllib.urlencode(sorted(vars.items()))
+        return urlparse.urlunsplit((scheme, netloc, path, query, ""))
+
+
+    # -------------------------------------------------------------------------
+    def source(self, url, reset=False):
+
+        """ The irs_ushahidi record of an instance (created if necessary)
+
+            @param url: the API URL
+            @param reset: import all incidents again
+
+        """
+
+        db = self.db
+        table = db.irs_ushahidi
+
+        url = self.base_url(url)
+        source = db(table.url == url).select(limitby=(0, 1)).first()
+        if source is None:
+            id = table.insert(url=url, last_id=0, imported=0)
+            source = db(table.id == id).select(limitby=(0, 1)).first()
+        elif reset:
+            db(table.id == source.id).update(last_id=0, last_date=None)
+            source = db(table.id == source.id).select(limitby=(0, 1)).first()
+        return source
+
+
+    # -------------------------------------------------------------------------
+    def fetch(self, url):
+
+        """ Fetches a page of incidents
+
+            @returns: the element tree
+
+        """
+
+        f = urllib2.urlopen(url, timeout=self.TIMEOUT)
+        try:
+            return etree.ElementTree(etree.fromstring(f.read()))
+        finally:
+            f.close()
+
+
+    # -------------------------------------------------------------------------
+    def pull(self, url, reset=False, ignore_errors=False, max_pages=None):
+
+        """ Imports all incidents newer than the last pull
+
+            @param url: the API URL of the Ushahidi instance
+            @param reset: import all incidents (not only newer ones)
+            @param ignore_errors: skip invalid incidents
+            @param max_pages: maximum number of pages to import
+
+            @returns: True if successful, otherwise False (see self.error)
+
+        """
+
+        db = self.db
+        xml = self.xml
+        table = self.resource.table
+        UID = xml.UID
+
+        start = time.time()
+
+        source = self.source(url, reset=reset)
+        since_id = source.last_id or 0
+        last_date = source.last_date
+        imported = source.imported or 0
+
+        success = True
+        while True:
+            previous = since_id
+            tree = self.fetch(self.page_url(url, since_id))
+            self.pages += 1
+
+            domain = tree.findtext("payload/domain") or ""
+            incidents = tree.xpath("//incident[id]")
+            if not incidents:
+                break
+
+            # Remove the incidents which have already been imported
+            uids = dict()
+            for incident in incidents:
+                uid = xml.import_uid("%s/%s" % (domain, incident.findtext("id")))
+                uids[uid] = incident
+            query = table[UID].belongs(uids.keys())
+            for row in db(query).select(table[UID]):
+                incident = uids.pop(row[UID], None)
+                if incident is not None:
+                    incident.getparent().remove(incident)
+                    self.skipped += 1
+
+            if uids:
+                result = xml.transform(tree, self.template)
+                if not result:
+                    self.error = xml.error
+                    success = False
+                    break
+                if not self.manager.import_tree(self.resource, None, result,
+                                                ignore_errors=ignore_errors):
+                    db.rollback()
+                    self.error = self.manager.error
+                    success = False
+                    break
+                self.imported += len(uids)
+                imported += len(uids)
+
+            # Remember where to continue
+            for incident in incidents:
+                try:
+                    id = int(incident.findtext("id"))
+                except (TypeError, ValueError):
+                    continue
+                since_id = max(since_id, id)
+                try:
+                    date = datetime.datetime.strptime(incident.findtext("date"),
+                                                      "%Y-%m-%d %H:%M:%S")
+                except (TypeError, ValueError):
+                    continue
+                if last_date is None or date > last_date:
+                    last_date = date
+            db(db.irs_ushahidi.id == source.id).update(last_id=since_id,
+                                                        last_date=last_date,
+                                                        imported=imported)
+            db.commit()
+
+            if len(incidents) < self.page_size or \
+               since_id <= previous or \
+               max_pages and self.pages >= max_pages:
+                # Last page (or the instance doesn't support paging)
+                break
+
+        self.duration = time.time() - start
+        return success
+
+
+    # -------------------------------------------------------------------------
+    def report(self):
+
+        """ Summary of the pull, with throughput """
+
+        if self.duration:
+            rate = self.imported / self.duration
+        else:
+            rate = 0.0
+        return "%s reports imported, %s already imported, %s pages in %.1fs (%.1f reports/s)" % \
+               (self.imported, self.skipped, self.pages, self.duration, rate)
+
+
+# *****************************************************************************
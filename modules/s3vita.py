@@ -34,6 +34,8 @@
 
 from gluon.storage import Storage
 
+from s3match import *
+
 __all__ = ["S3Vita",]
 
 # *****************************************************************************
@@ -125,80 +127,201 @@ class S3Vita(object):
         else:
             id = presence.id
 
-        presence = db(table.id == id).select(table.ALL, limitby=(0,1)).first()
-        if not presence:
+        presence = db(table.id == id).select(table.pe_id,
+                                             table.datetime,
+                                             limitby=(0,1)).first()
+        if not presence or not presence.pe_id or not presence.datetime:
             return
-        else:
-            condition = presence.presence_condition
 
-        pe_id = presence.pe_id
-        datetime = presence.datetime
-        if not datetime or not pe_id:
+        self.presence_update([presence.pe_id])
+        return
+
+
+    # -------------------------------------------------------------------------
+    def presence_update(self, pe_ids):
+
+        """ Re-computes the presence log of person entities from their
+            presence events: one select for all entities, and the
+            changes of all entities applied in batched updates
+
+            @param pe_ids: list of person entity IDs
+
+        """
+
+        db = self.db
+        table = db.pr_presence
+
+        pe_ids = list(set([pe_id for pe_id in pe_ids if pe_id]))
+        if not pe_ids:
             return
 
-        this_entity = ((table.pe_id == pe_id) & (table.deleted == False))
-        earlier = (table.datetime < datetime)
-        later = (table.datetime > datetime)
-        same_place = ((table.location_id == presence.location_id) |
-                        (table.shelter_id == presence.shelter_id))
-        is_present = (table.presence_condition.belongs(self.PERSISTANT_PRESENCE))
-        is_absent = (table.presence_condition.belongs(self.ABSENCE))
-        is_missing = (table.presence_condition == self.MISSING)
+        query = (table.pe_id.belongs(pe_ids)) & \
+                (table.deleted == False) & \
+                (table.datetime != None)
+        rows = db(query).select(table.id,
+                                table.pe_id,
+                                table.datetime,
+                                table.presence_condition,
+                                table.location_id,
+                                table.shelter_id,
+                                table.closed,
+                                orderby=table.pe_id|table.datetime)
+
+        # Event lists per entity
+        events = dict([(pe_id, []) for pe_id in pe_ids])
+        for row in rows:
+            events[row.pe_id].append(row)
+
+        close = []
+        reopen = []
+        missing = []
+        found = []
+        for pe_id in pe_ids:
+            state, is_missing = self.presence_state(events[pe_id])
+            for row in events[pe_id]:
+                closed = state[row.id]
+                if closed and not row.closed:
+                    close.append(row.id)
+                elif not closed and row.closed:
+                    reopen.append(row.id)
+            if is_missing:
+                missing.append(pe_id)
+            else:
+                found.append(pe_id)
+
+        if close:
+            db(table.id.belongs(close)).update(closed=True)
+        if reopen:
+            db(table.id.belongs(reopen)).update(closed=False)
+
+        # Missing-flag of persons (no-op for other entity types)
+        person = db.pr_person
+        if missing:
+            query = (person.pe_id.belongs(missing)) & (person.missing != True)
+            db(query).update(missing=True)
+        if found:
+            query = (person.pe_id.belongs(found)) & (person.missing != False)
+            db(query).update(missing=False)
 
-        if not presence.deleted:
+        return
+
+
+    # -------------------------------------------------------------------------
+    def presence_state(self, events):
+
+        """ Computes the state of the presence log of a person entity
+
+            - transitional presences are open
+            - persistant presences are closed by any later persistant
+              presence, or by a later absence from the same place
+            - absences are closed
+            - missing reports are closed by any later persistant presence
+
+            @param events: the (undeleted) presence records of the entity,
+                ordered by datetime
+
+            @returns: tuple ({record ID: closed}, missing), where missing
+                is True if there is an open missing report
+
+        """
+
+        state = dict()
+        missing = False
+
+        # Times of the latest later events, collected backwards
+        last_present = None
+        last_absent = dict()
+
+        def later(last, dt):
+            return last is not None and last > dt
+
+        for row in reversed(events):
+            condition = row.presence_condition
+            dt = row.datetime
+            places = []
+            if row.location_id is not None:
+                places.append(("location", row.location_id))
+            if row.shelter_id is not None:
+                places.append(("shelter", row.shelter_id))
 
             if condition in self.TRANSITIONAL_PRESENCE:
-                if presence.closed:
-                    db(table.id == id).update(closed=False)
+                closed = False
 
             elif condition in self.PERSISTANT_PRESENCE:
-                if not presence.closed:
-                    query = this_entity & earlier & (is_present | is_missing) & \
-                            (table.closed == False)
-                    db(query).update(closed=True)
-
-                    query = this_entity & later & \
-                            (is_present | (is_absent & same_place))
-                    if db(query).count():
-                        db(table.id == id).update(closed=True)
+                closed = later(last_present, dt)
+                if not closed:
+                    for place in places:
+                        if later(last_absent.get(place, None), dt):
+                            closed = True
+                            break
+                if last_present is None or dt > last_present:
+                    last_present = dt
 
             elif condition in self.ABSENCE:
-                query = this_entity & earlier & is_present & same_place
-                db(query).update(closed=True)
-
-                if not presence.closed:
-                    db(table.id == id).update(closed=True)
-
-        if not presence.closed:
-
-            # Re-open the last persistant presence if no closing event
-            query = this_entity & is_present
-            presence = db(query).select(table.ALL, orderby=~table.datetime, limitby=(0,1)).first()
-            if presence and presence.closed:
-                later = (table.datetime > presence.datetime)
-                query = this_entity & later & is_absent & same_place
-                if not db(query).count():
-                    db(table.id == presence.id).update(closed=False)
-
-            # Re-open the last missing if no later persistant presence
-            query = this_entity & is_missing
-            presence = db(query).select(table.ALL, orderby=~table.datetime, limitby=(0,1)).first()
-            if presence and presence.closed:
-                later = (table.datetime > presence.datetime)
-                query = this_entity & later & is_present
-                if not db(query).count():
-                    db(table.id == presence.id).update(closed=False)
-
-        pentity = db(db.pr_pentity.pe_id == pe_id).select(db.pr_pentity.instance_type,
-                                                          limitby=(0,1)).first()
-        if pentity and pentity.instance_type == "pr_person":
-            query = this_entity & is_missing & (table.closed == False)
-            if db(query).count():
-                db(db.pr_person.pe_id == pe_id).update(missing = True)
+                closed = True
+                for place in places:
+                    last = last_absent.get(place, None)
+                    if last is None or dt > last:
+                        last_absent[place] = dt
+
+            elif condition == self.MISSING:
+                closed = later(last_present, dt)
+                if not closed:
+                    missing = True
+
             else:
-                db(db.pr_person.pe_id == pe_id).update(missing = False)
+                closed = row.closed
+
+            state[row.id] = closed
+
+        return (state, missing)
+
+
+    # -------------------------------------------------------------------------
+    def shelter_presence(self, shelter_id, pe_ids,
+                         condition=None,
+                         datetime=None,
+                         location_id=None,
+                         reporter=None):
+
+        """ Bulk check-in (or check-out) of person entities at a shelter
+
+            @param shelter_id: the shelter record ID
+            @param pe_ids: list of person entity IDs
+            @param condition: the presence condition (default: CHECK_IN)
+            @param datetime: date/time of the check-in (default: now)
+            @param location_id: the location of the shelter
+            @param reporter: the person record ID of the reporter
+
+            @returns: list of the new pr_presence record IDs (the caller
+                has to update the super-entity links of these records,
+                e.g. s3xrc.model.update_super)
+
+        """
+
+        db = self.db
+        table = db.pr_presence
+
+        if condition is None:
+            condition = self.CHECK_IN
+        if datetime is None:
+            datetime = self.environment.request.utcnow
+
+        records = [dict(pe_id=pe_id,
+                        shelter_id=shelter_id,
+                        location_id=location_id,
+                        datetime=datetime,
+                        presence_condition=condition,
+                        reporter=reporter,
+                        closed=condition in self.ABSENCE)
+                   for pe_id in pe_ids if pe_id]
+        if not records:
+            return []
+        ids = table.bulk_insert(records)
+
+        self.presence_update(pe_ids)
+        return ids
 
-        return
 
     # -------------------------------------------------------------------------
     def trace(self, entity, time=None, conditions=None):
@@ -357,10 +480,67 @@ class S3Vita(object):
             q = ((person.gender == None) |
                  (person.gender == 1) |
                  (person.gender == body.gender))
+            query = query & q
 
         return query
 
 
+    # -------------------------------------------------------------------------
+    def person_index(self, query=None):
+
+        """ Builds a match index of persons, blocked by the Soundex code
+            of the last name, the first name prefix and the year of birth
+
+            @param query: query for the persons to index (defaults to
+                all non-deleted persons)
+
+        """
+
+        person = self.db.pr_person
+        if query is None:
+            query = (person.deleted == False)
+
+        index = S3MatchIndex([s3_key_soundex("last_name"),
+                              s3_key_prefix("first_name", 3),
+                              s3_key_year("date_of_birth")],
+                             [("first_name", 2),
+                              ("middle_name", 1),
+                              ("last_name", 3),
+                              ("date_of_birth", 2),
+                              ("gender", 1)],
+                             max_block=500)
+
+        rows = self.db(query).select(person.id,
+                                     person.first_name,
+                                     person.middle_name,
+                                     person.last_name,
+                                     person.date_of_birth,
+                                     person.gender)
+        for row in rows:
+            if row.gender == 1:
+                # Unknown gender doesn't count in the comparison
+                row.gender = None
+            index.add(row.id, row)
+
+        return index
+
+
+    # -------------------------------------------------------------------------
+    def person_duplicates(self, query=None, threshold=0.9):
+
+        """ Finds likely duplicates among persons
+
+            @param query: query for the persons to check
+            @param threshold: minimum similarity (0.0 to 1.0)
+
+            @returns: list of tuples (score, person_id, person_id),
+                best matches first
+
+        """
+
+        return self.person_index(query).duplicates(threshold=threshold)
+
+
     # -------------------------------------------------------------------------
     def fullname(self, record, truncate=True):
 
@@ -412,26 +592,7 @@ class S3Vita(object):
 
         """
 
-        matrix = {}
-        l1 = len(str1)
-        l2 = len(str2)
-
-        for i in range(0, l1+1): matrix[i, 0] = i
-        for j in range(0, l2+1): matrix[0, j] = j
-
-        for i in range(1, l1+1):
-            for j in range(1, l2+1):
-                x = matrix[i-1, j] + 1
-                y = matrix[i, j-1] + 1
-
-                if str1[i-1] == str2[j-1]:
-                    z = matrix[i-1, j-1]
-                else:
-                    z = matrix[i-1, j-1] + 1
-
-                matrix[i, j] = min(x, y, z)
-
-        return float(matrix[l1, l2]) / float(max(l1, l2))
+        return s3_rlevenshtein(str1, str2)
 
 
 #
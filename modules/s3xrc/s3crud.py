@@ -47,6 +47,7 @@ from gluon.storage import Storage
 from gluon.html import URL, DIV, A, SCRIPT, FORM, TABLE, TR, TD, INPUT
 from gluon.http import HTTP, redirect
 from gluon.serializers import json
+from gluon.contrib.simplejson import dumps
 from gluon.sql import Field, Row
 from gluon.validators import IS_EMPTY_OR
 
@@ -62,12 +63,19 @@ class S3Audit(object):
         @param session: the current session
         @param tablename: the name of the audit table
         @param migrate: migration setting
+        @param buffer_size: number of audit entries to buffer before
+            writing them to the database, 0 to write immediately
+
+        @note: with buffering enabled, the buffer must be flushed before
+            the transaction is committed, see commit() - i.e. buffering is
+            for HTTP requests only, not for shell or cron scripts
 
     """
 
     def __init__(self, db, session,
                  tablename="s3_audit",
-                 migrate=True):
+                 migrate=True,
+                 buffer_size=0):
 
         self.db = db
         self.table = db.get(tablename, None)
@@ -90,6 +98,9 @@ class S3Audit(object):
         else:
             self.user = None
 
+        self.buffer_size = buffer_size
+        self.__buffer = []
+
 
     # -------------------------------------------------------------------------
     def __call__(self, operation, prefix, name,
@@ -104,7 +115,8 @@ class S3Audit(object):
             @param prefix: the module prefix of the resource
             @param name: the name of the resource (without prefix)
             @param form: the form
-            @param record: the record ID
+            @param record: the record ID, or - for deletes - the deleted
+                record (saves the audit writer from re-loading it)
             @param representation: the representation format
 
         """
@@ -112,11 +124,12 @@ class S3Audit(object):
         now = datetime.datetime.utcnow()
 
         audit = self.session.s3
-        table = self.table
         db = self.db
 
+        row = None
         if record:
             if isinstance(record, Row):
+                row = record
                 record = record.get("id", None)
                 if not record:
                     return True
@@ -135,46 +148,121 @@ class S3Audit(object):
 
         if operation in ("list", "read"):
             if audit.audit_read:
-                table.insert(timestmp = now,
-                             person = self.user,
-                             operation = operation,
-                             tablename = tablename,
-                             record = record,
-                             representation = representation)
+                self.__log(timestmp = now,
+                           person = self.user,
+                           operation = operation,
+                           tablename = tablename,
+                           record = record,
+                           representation = representation)
 
         elif operation in ("create", "update"):
             if audit.audit_write:
                 if form:
                     record =  form.vars.id
-                    new_value = ["%s:%s" % (var, str(form.vars[var])) for var in form.vars]
+                    new_value = self.encode(form.vars)
                 else:
-                    new_value = []
-                table.insert(timestmp = now,
-                             person = self.user,
-                             operation = operation,
-                             tablename = tablename,
-                             record = record,
-                             representation = representation,
-                             new_value = new_value)
+                    new_value = None
+                self.__log(timestmp = now,
+                           person = self.user,
+                           operation = operation,
+                           tablename = tablename,
+                           record = record,
+                           representation = representation,
+                           new_value = new_value)
 
         elif operation == "delete":
             if audit.audit_write:
-
-                row = db(db[tablename].id == record).select(limitby=(0, 1)).first()
-                old_value = []
+                if row is None and record:
+                    row = db(db[tablename].id == record).select(limitby=(0, 1)).first()
                 if row:
-                    old_value = ["%s:%s" % (field, row[field]) for field in row]
-                table.insert(timestmp = now,
-                             person = self.user,
-                             operation = operation,
-                             tablename = tablename,
-                             record = record,
-                             representation = representation,
-                             old_value = old_value)
+                    old_value = self.encode(row)
+                else:
+                    old_value = None
+                self.__log(timestmp = now,
+                           person = self.user,
+                           operation = operation,
+                           tablename = tablename,
+                           record = record,
+                           representation = representation,
+                           old_value = old_value)
 
         return True
 
 
+    # -------------------------------------------------------------------------
+    def __log(self, **entry):
+
+        """ Writes an audit entry, or adds it to the buffer
+
+            @param entry: the audit entry (field=value)
+
+        """
+
+        if self.buffer_size:
+            self.__buffer.append(entry)
+            if len(self.__buffer) >= self.buffer_size:
+                self.flush()
+        else:
+            self.table.insert(**entry)
+
+
+    # -------------------------------------------------------------------------
+    def flush(self):
+
+        """ Writes all buffered audit entries to the database
+            in one bulk insert
+
+            @returns: the number of entries written
+
+        """
+
+        buffer = self.__buffer
+        if not buffer:
+            return 0
+
+        self.__buffer = []
+        self.table.bulk_insert(buffer)
+
+        return len(buffer)
+
+
+    # -------------------------------------------------------------------------
+    def commit(self):
+
+        """ Flushes the buffer and commits the transaction, to be used
+            as custom commit hook (response._custom_commit) at the end of
+            the request, so that buffered entries get written within the
+            same transaction as the audited changes
+
+        """
+
+        self.flush()
+        self.db.commit()
+
+
+    # -------------------------------------------------------------------------
+    @staticmethod
+    def encode(values):
+
+        """ Compact encoding of old/new values: a JSON object of all
+            field values which are not None, with minimal separators
+
+            @param values: the values as dict-like object (Row or Storage)
+
+        """
+
+        data = dict()
+        for k in values.keys():
+            v = values[k]
+            if v is None or isinstance(v, (Row, dict)):
+                continue
+            if not isinstance(v, (int, long, float, bool, basestring)):
+                v = str(v)
+            data[k] = v
+
+        return dumps(data, separators=(",", ":"))
+
+
 # *****************************************************************************
 class S3MethodHandler(object):
 
@@ -112,6 +112,9 @@ class S3ResourceModel(object):
 
     """
 
+    # Referencing fields, by referenced table (per process)
+    references = dict()
+
     def __init__(self, db):
 
         self.db = db
@@ -475,18 +478,20 @@ class S3ResourceModel(object):
     # -------------------------------------------------------------------------
     def update_super(self, table, record):
 
-        """ Updates the super-entity links of an instance record
+        """ Updates the super-entity links of instance records
+
+            Fields missing in the records are read from the database in
+            one query, the super-entity records are looked up by UUID in
+            one query per super-entity, and only those super-entity
+            records which have changed are written.
 
             @param table: the instance table
-            @param record: the instance record
+            @param record: the instance record, or a list of instance
+                records (e.g. after a bulk import)
 
         """
 
-        # Get the record
-        id = record.get("id", None)
-        record = self.db(table.id == id).select(table.ALL, limitby=(0, 1)).first()
-        if not record:
-            return True
+        db = self.db
 
         # Get the super-entities of this table
         super = self.get_config(table, "super_entity")
@@ -495,45 +500,144 @@ class S3ResourceModel(object):
         elif not isinstance(super, (list, tuple)):
             super = [super]
 
+        if isinstance(record, (list, tuple)):
+            records = record
+        else:
+            records = [record]
+
+        # Field maps {super field: instance field}, and the instance
+        # fields needed to update the super-entities
+        needed = set(["id", "uuid"])
+        if "deleted" in table.fields:
+            needed.add("deleted")
+        maps = []
         for s in super:
-
-            # Get the key
-            for key in s.fields:
-                if str(s[key].type) == "id":
-                    break
-
-            # Get the shared field map
+            key = self.super_key(s)
+            if key in table.fields:
+                needed.add(key)
             shared = self.get_config(table, "%s_fields" % s._tablename)
-            if shared:
-                data = dict([(f, record[shared[f]])
-                             for f in shared if shared[f] in record and f in s.fields])
+            if not shared:
+                shared = dict([(f, f) for f in s.fields])
+            fmap = dict([(f, shared[f]) for f in shared
+                         if f in s.fields and shared[f] in table.fields and
+                            f not in (key, "uuid", "deleted", "instance_type")])
+            needed.update(fmap.values())
+            maps.append((s, key, fmap))
+
+        # Get the instance records (re-read only if incomplete)
+        instances = []
+        missing = []
+        for r in records:
+            id = r.get("id", None)
+            if not id:
+                continue
+            if needed.issubset(r.keys()):
+                instances.append(r)
             else:
-                data = dict([(f, record[f])
-                             for f in s.fields if f in record])
-
-            # Add instance type and deletion status
-            data.update(instance_type=table._tablename,
-                        deleted=record.get("deleted", False))
-
-            # UID
-            uid=record.get("uuid", None)
-            data.update(uuid=uid)
-
-            # Update records
-            row = self.db(s.uuid == uid).select(s[key], limitby=(0, 1)).first()
-            if row:
-                k = {key:row[key]}
-                self.db(s[key] == row[key]).update(**data)
-                if record[key] != row[key]:
-                    self.db(table.id==id).update(k)
+                missing.append(id)
+        if missing:
+            fields = [table[f] for f in needed]
+            instances.extend(db(table.id.belongs(missing)).select(*fields))
+        if not instances:
+            return True
+
+        uids = [i.uuid for i in instances if i.uuid]
+        for s, key, fmap in maps:
+
+            # Existing super-entity records, by UUID
+            fields = [s[key], s.uuid, s.deleted, s.instance_type] + \
+                     [s[f] for f in fmap]
+            if uids:
+                existing = db(s.uuid.belongs(uids)).select(*fields)
+                existing = dict([(row.uuid, row) for row in existing])
             else:
-                k = s.insert(**data)
-                if k:
-                    self.db(table.id == id).update(**{key:k})
+                existing = {}
+
+            inserts = []
+            for i in instances:
+                uid = i.uuid
+                data = dict([(f, i[fmap[f]]) for f in fmap])
+                data.update(instance_type=table._tablename,
+                            deleted=i.get("deleted", False) or False,
+                            uuid=uid)
+                row = uid and existing.get(uid, None) or None
+                if row:
+                    # Update changed fields
+                    changed = dict([(f, data[f]) for f in data
+                                    if row[f] != data[f]])
+                    if changed:
+                        db(s[key] == row[key]).update(**changed)
+                    if i.get(key, None) != row[key]:
+                        db(table.id == i.id).update(**{key:row[key]})
+                elif not uid and i.get(key, None):
+                    # No UID to look up, but linked
+                    db(s[key] == i[key]).update(**data)
+                else:
+                    inserts.append((i, data))
+
+            if inserts:
+                keys = s.bulk_insert([data for i, data in inserts])
+                for (i, data), k in zip(inserts, keys):
+                    if k:
+                        db(table.id == i.id).update(**{key:k})
 
         return True
 
 
+    # -------------------------------------------------------------------------
+    def repair_super(self, super, batch_size=500):
+
+        """ Repairs the links between a super-entity and all its instance
+            tables (e.g. after direct DB writes or failed imports):
+            links missing or pointing to the wrong super-entity record are
+            fixed, and super-entity records without instance record are
+            marked as deleted
+
+            @param super: the super-entity table
+            @param batch_size: number of instance records per batch
+
+            @returns: dict {instance tablename:number of instance records}
+
+        """
+
+        db = self.db
+        key = self.super_key(super)
+
+        instance_tables = []
+        for tablename in self.config:
+            s = self.config[tablename].get("super_entity", None)
+            if s is None:
+                continue
+            if not isinstance(s, (list, tuple)):
+                s = [s]
+            if super._tablename in [t._tablename for t in s] and \
+               tablename in db.tables:
+                instance_tables.append(db[tablename])
+
+        result = dict()
+        uids = set()
+        for table in instance_tables:
+            rows = db(table.id > 0).select(table.id, orderby=table.id)
+            ids = [row.id for row in rows]
+            for i in xrange(0, len(ids), batch_size):
+                self.update_super(table, [dict(id=id)
+                                          for id in ids[i:i + batch_size]])
+            rows = db(table.id > 0).select(table.uuid)
+            uids.update([row.uuid for row in rows])
+            result[table._tablename] = len(ids)
+
+        # Orphaned super-entity records
+        tablenames = [t._tablename for t in instance_tables]
+        query = (super.deleted != True) & \
+                (super.instance_type.belongs(tablenames))
+        rows = db(query).select(super[key], super.uuid)
+        orphans = [row[key] for row in rows if row.uuid not in uids]
+        for i in xrange(0, len(orphans), batch_size):
+            db(super[key].belongs(orphans[i:i + batch_size])).update(deleted=True)
+
+        return result
+
+
     # -------------------------------------------------------------------------
     def delete_super(self, table, record):
 
@@ -559,4 +663,263 @@ class S3ResourceModel(object):
         return True
 
 
+    # Aggregate API ===========================================================
+
+    def aggregate(self, table, key, parent, **fields):
+
+        """ Declares sums of child record fields which are maintained in
+            the parent record (e.g. the total number of beds of a hospital
+            as sum of the bed capacities of its units)
+
+            @param table: the child table
+            @param key: name of the foreign key to the parent table
+            @param parent: the parent table
+            @param fields: parent_field=child_field pairs
+
+        """
+
+        aggregates = self.get_config(table, "aggregates", [])
+        aggregates.append(Storage(table=table,
+                                  key=key,
+                                  parent=parent,
+                                  fields=fields))
+        self.configure(table, aggregates=aggregates)
+
+
+    # -------------------------------------------------------------------------
+    def update_aggregates(self, table, id, old=None, create=False):
+
+        """ Applies the changes of a child record to the aggregates in its
+            parent record - as deltas between the old and the new values,
+            so that the parent is not re-aggregated from all its children
+
+            @param table: the child table
+            @param id: the child record ID
+            @param old: the child record before the change (Row), None
+                if not available (=re-aggregate the parent)
+            @param create: the child record has just been created
+
+        """
+
+        aggregates = self.get_config(table, "aggregates")
+        if not aggregates or not id:
+            return True
+
+        # Get the record after the change (None if deleted)
+        record = self.db(table.id == id).select(table.ALL, limitby=(0, 1)).first()
+        if record and record.get("deleted", False):
+            record = None
+        if old and old.get("deleted", False):
+            old = None
+
+        for a in aggregates:
+
+            new_parent = record and record[a.key] or None
+            if old is None and not create:
+                # Previous state unknown
+                if new_parent:
+                    self.recompute_aggregates(a, [new_parent])
+                continue
+            old_parent = old and old.get(a.key, None) or None
+
+            add = Storage()
+            subtract = Storage()
+            for pf, cf in a.fields.items():
+                new_value = record and record[cf] or 0
+                old_value = old and old.get(cf, None) or 0
+                if new_parent == old_parent:
+                    if new_value != old_value:
+                        add[pf] = new_value - old_value
+                else:
+                    # Moved to another parent (or created/deleted)
+                    if old_value:
+                        subtract[pf] = -old_value
+                    if new_value:
+                        add[pf] = new_value
+            if subtract and old_parent:
+                self.__add_delta(a, old_parent, subtract)
+            if add and new_parent:
+                self.__add_delta(a, new_parent, add)
+
+        return True
+
+
+    # -------------------------------------------------------------------------
+    def __add_delta(self, aggregate, parent_id, deltas):
+
+        """ Adds deltas to the aggregates in a parent record, with one
+            atomic UPDATE (so that concurrent updates can't overwrite
+            each other)
+
+            @param aggregate: the aggregate declaration
+            @param parent_id: the parent record ID
+            @param deltas: dict {parent_field:delta}
+
+        """
+
+        parent = aggregate.parent
+        query = (parent.id == parent_id)
+        for f in deltas:
+            query = query & (parent[f] != None)
+        data = dict([(f, parent[f] + deltas[f]) for f in deltas])
+        success = self.db(query).update(**data)
+        if success == 0:
+            # Aggregates not initialized (NULL) => re-aggregate the parent
+            self.recompute_aggregates(aggregate, [parent_id])
+
+
+    # -------------------------------------------------------------------------
+    def recompute_aggregates(self, table, parent_ids=None):
+
+        """ Re-aggregates parent records from all their children (bulk
+            tool, e.g. after imports or direct DB writes which bypass
+            the framework)
+
+            @param table: the child table, or a single aggregate declaration
+            @param parent_ids: list of parent record IDs, None for all
+
+        """
+
+        db = self.db
+
+        if isinstance(table, Storage):
+            aggregates = [table]
+        else:
+            aggregates = self.get_config(table, "aggregates", [])
+
+        for a in aggregates:
+            child = a.table
+            parent = a.parent
+            key = child[a.key]
+
+            # Sums per parent, in one grouped query
+            sums = [(pf, child[cf].sum()) for pf, cf in a.fields.items()]
+            query = (key != None)
+            if "deleted" in child.fields:
+                query = query & (child.deleted == False)
+            if parent_ids:
+                query = query & (key.belongs(parent_ids))
+            rows = db(query).select(key, groupby=key, *[s for pf, s in sums])
+
+            # Reset all affected parents, then write the sums
+            if parent_ids:
+                reset = parent.id.belongs(parent_ids)
+            else:
+                reset = (parent.id > 0)
+            db(reset).update(**dict([(pf, 0) for pf, s in sums]))
+            for row in rows:
+                data = dict([(pf, row._extra[s] or 0) for pf, s in sums])
+                db(parent.id == row[child._tablename][a.key]).update(**data)
+
+        return True
+
+
+    # Reference API ===========================================================
+
+    def referenced_by(self, table):
+
+        """ Gets all fields which reference a table (determined once
+            per process)
+
+            @param table: the referenced table
+
+            @returns: list of tuples (tablename, fieldname)
+
+        """
+
+        db = self.db
+        tablename = table._tablename
+
+        fields = self.references.get(tablename, None)
+        if fields is None:
+            fields = getattr(table, "_referenced_by", None)
+            if fields:
+                fields = [(t, f) for t, f in fields]
+            else:
+                rtype = "reference %s" % tablename
+                fields = [(t, f) for t in db.tables for f in db[t].fields
+                          if str(db[t][f].type) == rtype]
+            self.references[tablename] = fields
+
+        return [(t, f) for t, f in fields if t in db.tables]
+
+
+    # -------------------------------------------------------------------------
+    def count_references(self, table, id):
+
+        """ Counts the (undeleted) records referencing a record, in all
+            referencing tables with a single query
+
+            @param table: the referenced table
+            @param id: the referenced record ID
+
+            @returns: dict {tablename:count} of the tables with
+                referencing records
+
+        """
+
+        db = self.db
+        id = int(id)
+
+        queries = []
+        for t, f in self.referenced_by(table):
+            sql = "SELECT '%s', COUNT(*) FROM %s WHERE %s=%s" % (t, t, f, id)
+            if "deleted" in db[t].fields:
+                sql = "%s AND deleted<>'T'" % sql
+            queries.append(sql)
+        if not queries:
+            return dict()
+
+        counts = dict()
+        for tablename, count in db.executesql("%s;" % " UNION ALL ".join(queries)):
+            if count:
+                counts[tablename] = counts.get(tablename, 0) + count
+        return counts
+
+
+    # -------------------------------------------------------------------------
+    def merge_references(self, table, old, new):
+
+        """ Re-links all records referencing duplicates of a record to
+            that record, and marks the duplicates as deleted - with one
+            update per referencing field, in one transaction
+
+            @param table: the referenced table
+            @param old: the ID of the duplicate, or a list of IDs
+            @param new: the ID of the record to keep
+
+            @returns: dict {tablename:number of re-linked records}
+
+        """
+
+        db = self.db
+
+        if not isinstance(old, (list, tuple)):
+            old = [old]
+        old = [int(id) for id in old if id and int(id) != int(new)]
+        if not old:
+            return dict()
+
+        counts = dict()
+        try:
+            for t, f in self.referenced_by(table):
+                query = (db[t][f].belongs(old))
+                if t == table._tablename:
+                    # Don't link the record to itself
+                    query = query & (db[t].id != new)
+                updated = db(query).update(**{f:new})
+                if updated:
+                    counts[t] = counts.get(t, 0) + updated
+            if "deleted" in table.fields:
+                db(table.id.belongs(old)).update(deleted=True)
+            else:
+                db(table.id.belongs(old)).delete()
+        except:
+            db.rollback()
+            raise
+        db.commit()
+
+        return counts
+
+
 # *****************************************************************************
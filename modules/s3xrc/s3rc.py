@@ -157,6 +157,7 @@ class S3ResourceController(object):
         self.audit = environment.s3_audit       # Audit
         self.auth = environment.auth            # Auth
         self.gis = environment.gis              # GIS
+        self.search_index = environment.s3_search_index # Search Index
 
         self.model = S3ResourceModel(self.db)   # Resource Model, @todo 2.2: reduce parameter list to (self)?
         self.crud = S3CRUDHandler(self)         # CRUD Handler
@@ -794,6 +795,29 @@ class S3ResourceController(object):
             mci_filter = (table.mci >= 0)
             resource.add_filter(mci_filter)
 
+        # Modified since: records which have been modified after msince
+        # themselves, or which have component records modified after
+        # msince (only those component records are exported)
+        MTIME = self.xml.MTIME
+        if msince is not None:
+            msince_query = None
+            if MTIME in table.fields:
+                msince_query = (table[MTIME] >= msince)
+            for c in resource.components.values():
+                ctable = c.resource.table
+                if MTIME not in ctable.fields or \
+                   self.model.has_components(c.component.prefix,
+                                             c.component.name):
+                    continue
+                modified = self.db(ctable[MTIME] >= msince)._select(ctable[c.fkey])
+                q = (table[c.pkey].belongs(modified))
+                if msince_query:
+                    msince_query = msince_query | q
+                else:
+                    msince_query = q
+            if msince_query:
+                resource.add_filter(msince_query)
+
         # Total number of results
         results = resource.count()
 
@@ -810,6 +834,9 @@ class S3ResourceController(object):
                 mci_filter = (cresource.table.mci >= 0)
                 cresource.add_filter(mci_filter)
 
+            if msince is not None and MTIME in cresource.table.fields:
+                cresource.add_filter(cresource.table[MTIME] >= msince)
+
             cresource.load()
             ctablename = cresource.tablename
             crfields[ctablename], \
@@ -836,11 +863,6 @@ class S3ResourceController(object):
             else:
                 resource_url = None
 
-            msince_add = True
-            if msince is not None and self.xml.MTIME in record:
-                if record[self.xml.MTIME] < msince:
-                    msince_add = False
-
             rmap = self.xml.rmap(table, record, rfields)
             element = self.xml.element(table, record,
                                        fields=dfields,
@@ -875,11 +897,6 @@ class S3ResourceController(object):
                 crecords = resource(record.id, component=cname)
                 for crecord in crecords:
 
-                    if msince is not None and self.xml.MTIME in crecord:
-                        if crecord[self.xml.MTIME] < msince:
-                            continue
-                    msince_add = True
-
                     if audit:
                         audit(self.ACTION["read"], cprefix, cname,
                               record=crecord.id,
@@ -909,15 +926,12 @@ class S3ResourceController(object):
                     else:
                         export_map[c.tablename] = [crecord.id]
 
-            if msince_add:
-                reference_map.extend(rmap)
-                element_list.append(element)
-                if export_map.get(resource.tablename, None):
-                    export_map[resource.tablename].append(record.id)
-                else:
-                    export_map[resource.tablename] = [record.id]
+            reference_map.extend(rmap)
+            element_list.append(element)
+            if export_map.get(resource.tablename, None):
+                export_map[resource.tablename].append(record.id)
             else:
-                results -= 1
+                export_map[resource.tablename] = [record.id]
 
         # Add referenced resources to the tree
         depth = dereference and self.MAX_DEPTH or 0
@@ -1236,6 +1250,23 @@ class S3ResourceController(object):
             labels = label.split()
             results = []
 
+            # Use the search index if all fields are indexed fields
+            # of the master table (wildcards require LIKE queries)
+            index = None
+            tablename = table._tablename
+            if self.search_index and "%" not in label and \
+               search_fields.keys() == [tablename]:
+                fields = [f.name for f in search_fields[tablename]]
+                query = mq[tablename]
+                if filterby:
+                    query = (filterby) & (query)
+                # Filtered by subselect in the index query
+                index = self.search_index.search(table, label,
+                                                 fields=fields,
+                                                 query=query)
+            if index is not None:
+                return index or None
+
             for l in labels:
                 wc = "%"
                 _l = "%s%s%s" % (wc, l, wc)
@@ -1433,6 +1464,7 @@ class S3Vector(object):
         model = self.__manager.model
 
         skip_components = False
+        old = None
 
         if not self.committed:
             if self.accepted and self.permitted:
@@ -1480,6 +1512,7 @@ class S3Vector(object):
                     this = self.db(query).select(self.table.ALL, limitby=(0,1))
                     if this:
                         this = this.first()
+                        old = this
                         if self.MTIME in self.table.fields:
                             this_mtime = this[self.MTIME]
                         else:
@@ -1556,6 +1589,8 @@ class S3Vector(object):
                         self.audit(self.method, self.prefix, self.name,
                                    form=form, record=self.id, representation="xml")
                     model.update_super(self.table, form.vars)
+                    model.update_aggregates(self.table, self.id, old=old,
+                                            create=self.method == self.METHOD.CREATE)
                     if self.onaccept:
                         self.__manager.callback(self.onaccept, form, name=self.tablename)
 
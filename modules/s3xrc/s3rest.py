@@ -38,7 +38,8 @@
 
 __all__ = ["S3Resource", "S3Request"]
 
-import os, sys, cgi, uuid, datetime, time, urllib, StringIO, re
+import os, sys, cgi, uuid, datetime, time, urllib, StringIO, re, threading
+import hashlib, rfc822
 import gluon.contrib.simplejson as json
 
 from gluon.storage import Storage
@@ -46,6 +47,7 @@ from gluon.sql import Row
 from gluon.html import URL, TABLE, TR, TH, TD, THEAD, TBODY, A, DIV, SPAN
 from gluon.http import HTTP, redirect
 from gluon.sqlhtml import SQLTABLE, SQLFORM
+from gluon.validators import IS_DATE, IS_TIME
 
 from lxml import etree
 from s3crud import S3CRUDHandler
@@ -188,6 +190,11 @@ class S3Resource(object):
 
     """
 
+    # URL query plans, by filter signature (shared by all requests)
+    QUERY_PLANS = dict()
+    QUERY_PLAN_LIMIT = 1000
+    QUERY_PLAN_LOCK = threading.Lock()
+
     def __init__(self, manager, prefix, name,
                  id=None,
                  uid=None,
@@ -393,132 +400,251 @@ class S3Resource(object):
 
 
     # -------------------------------------------------------------------------
-    def url_query(self, resource, vars):
+    def query_plan(self, resource, vars):
+
+        """ Get the query plan for the URL vars: which var filters which
+            field of which table with which operator. Plans are cached
+            per filter signature (resource, components, var names and
+            contexts), so
+            that repeated requests only need to convert the values.
+
+            @param resource: the resource
+            @param vars: dict of URL vars
+
+        """
+
+        keys = [k for k in vars if k.find(".") > 0]
+        contexts = [(k, vars[k]) for k in keys
+                    if k[:8] == "context." and isinstance(vars[k], str)]
+        signature = (resource.tablename,
+                     tuple(sorted(resource.components.keys())),
+                     tuple(sorted(keys)),
+                     tuple(sorted(contexts)))
+
+        plans = self.QUERY_PLANS
+        plan = plans.get(signature, None)
+        if plan is None:
+            plan = self.__query_plan(resource, vars, keys)
+            self.QUERY_PLAN_LOCK.acquire()
+            try:
+                if len(plans) >= self.QUERY_PLAN_LIMIT:
+                    # Drop the least used half
+                    ranked = sorted(plans.items(), key=lambda i: i[1].hits)
+                    for k, v in ranked[:len(ranked) / 2]:
+                        del plans[k]
+                plans[signature] = plan
+            finally:
+                self.QUERY_PLAN_LOCK.release()
+        plan.hits += 1
+
+        return plan
 
-        """ Parse URL query
+
+    # -------------------------------------------------------------------------
+    def __query_plan(self, resource, vars, keys):
+
+        """ Build a query plan (see query_plan)
 
             @param resource: the resource
             @param vars: dict of URL vars
+            @param keys: the names of the query vars
 
         """
 
         c = self.parse_context(resource, vars)
-        q = Storage(context=c)
-        for k in vars:
-            if k.find(".") > 0:
-                rname, field = k.split(".", 1)
-                if rname == "context":
+
+        filters = []
+        for k in keys:
+            rname, field = k.split(".", 1)
+            if rname == "context":
+                continue
+            elif rname == resource.name:
+                table = resource.table
+            elif rname in resource.components:
+                table = resource.components[rname].component.table
+            elif rname in c.keys():
+                table = self.db.get(c[rname].table, None)
+                if not table:
                     continue
-                elif rname == resource.name:
-                    table = resource.table
-                elif rname in resource.components:
-                    table = resource.components[rname].component.table
-                elif rname in c.keys():
-                    table = self.db.get(c[rname].table, None)
-                    if not table:
-                        continue
-                else:
+            else:
+                continue
+            if field.find("__") > 0:
+                field, op = field.split("__", 1)
+            else:
+                op = "eq"
+            if field == "uid":
+                field = self.manager.UID
+            if field not in table.fields:
+                continue
+            ftype = str(table[field].type)
+            if op in ("lt", "le", "gt", "ge"):
+                if ftype not in ("integer", "double", "date", "time", "datetime"):
                     continue
-                if field.find("__") > 0:
-                    field, op = field.split("__", 1)
-                else:
-                    op = "eq"
-                if field == "uid":
-                    field = self.manager.UID
-                if field not in table.fields:
+            elif op in ("like", "unlike"):
+                if ftype not in ("string", "text"):
                     continue
-                else:
-                    ftype = str(table[field].type)
-                    values = vars[k]
+            elif op in ("in", "ex"):
+                if not ftype.startswith("list:"):
+                    continue
+            elif op not in ("eq", "ne"):
+                continue
+            filters.append(Storage(key=k,
+                                   rname=rname,
+                                   tablename=table._tablename,
+                                   field=field,
+                                   op=op,
+                                   ftype=ftype))
+
+        # Candidate indexes: equality fields first, then range fields
+        indexes = Storage()
+        for f in filters:
+            if f.field == "id" or f.op not in ("eq", "lt", "le", "gt", "ge"):
+                continue
+            fields = indexes.get(f.tablename, None)
+            if fields is None:
+                fields = indexes[f.tablename] = Storage(eq=[], range=[])
+            if f.op == "eq":
+                if f.field not in fields.eq:
+                    fields.eq.append(f.field)
+            elif f.field not in fields.range:
+                fields.range.append(f.field)
+        indexes = [(tablename,
+                    tuple(sorted(fields.eq) + sorted(fields.range)))
+                   for tablename, fields in indexes.items()]
 
-                    if op in ("lt", "le", "gt", "ge"):
-                        if ftype not in ("integer", "double", "date", "time", "datetime"):
-                            continue
-                        if not isinstance(values, (list, tuple)):
-                            values = [values]
-                        vlist = []
-                        for v in values:
-                            if v.find(",") > 0:
-                                v = v.split(",", 1)[-1]
-                            vlist.append(v)
-                        values = vlist
-                    elif op == "eq":
-                        if isinstance(values, (list, tuple)):
-                            values = values[-1]
-                        if values.find(",") > 0:
-                            values = values.split(",")
-                        else:
-                            values = [values]
-                    elif op == "ne":
-                        if not isinstance(values, (list, tuple)):
-                            values = [values]
-                        vlist = []
-                        for v in values:
-                            if v.find(",") > 0:
-                                v = v.split(",")
-                                vlist.extend(v)
-                            else:
-                                vlist.append(v)
-                        values = vlist
-                    elif op in ("like", "unlike"):
-                        if ftype not in ("string", "text"):
-                            continue
-                        if not isinstance(values, (list, tuple)):
-                            values = [values]
-                    elif op in ("in", "ex"):
-                        if not ftype.startswith("list:"):
-                            continue
-                        if not isinstance(values, (list, tuple)):
-                            values = [values]
+        return Storage(context=c, filters=filters, indexes=indexes, hits=0)
+
+
+    # -------------------------------------------------------------------------
+    @classmethod
+    def index_recommendations(cls, min_hits=100):
+
+        """ Indexes which would support frequently used URL filters
+
+            @param min_hits: minimum number of requests using the filter
+
+            @returns: list of Storages (tablename, fields, hits, sql),
+                most used first
+
+        """
+
+        hits = dict()
+        for plan in cls.QUERY_PLANS.values():
+            for index in plan.indexes:
+                hits[index] = hits.get(index, 0) + plan.hits
+
+        recommendations = []
+        for (tablename, fields), n in hits.items():
+            if n < min_hits:
+                continue
+            name = "s3_idx_%s_%s" % (tablename, "_".join(fields))
+            sql = "CREATE INDEX %s ON %s (%s);" % \
+                  (name, tablename, ", ".join(fields))
+            recommendations.append(Storage(tablename=tablename,
+                                           fields=list(fields),
+                                           hits=n,
+                                           sql=sql))
+        recommendations.sort(key=lambda r: r.hits, reverse=True)
+
+        return recommendations
+
+
+    # -------------------------------------------------------------------------
+    def url_query(self, resource, vars):
+
+        """ Parse URL query
+
+            @param resource: the resource
+            @param vars: dict of URL vars
+
+        """
+
+        plan = self.query_plan(resource, vars)
+        q = Storage(context=plan.context)
+
+        date_validator = None
+        time_validator = None
+        tfmt = "%Y-%m-%dT%H:%M:%SZ"
+
+        for f in plan.filters:
+            op = f.op
+            ftype = f.ftype
+            values = vars[f.key]
+
+            if op in ("lt", "le", "gt", "ge"):
+                if not isinstance(values, (list, tuple)):
+                    values = [values]
+                vlist = []
+                for v in values:
+                    if v.find(",") > 0:
+                        v = v.split(",", 1)[-1]
+                    vlist.append(v)
+                values = vlist
+            elif op == "eq":
+                if isinstance(values, (list, tuple)):
+                    values = values[-1]
+                if values.find(",") > 0:
+                    values = values.split(",")
+                else:
+                    values = [values]
+            elif op == "ne":
+                if not isinstance(values, (list, tuple)):
+                    values = [values]
+                vlist = []
+                for v in values:
+                    if v.find(",") > 0:
+                        v = v.split(",")
+                        vlist.extend(v)
                     else:
+                        vlist.append(v)
+                values = vlist
+            elif not isinstance(values, (list, tuple)):
+                values = [values]
+
+            vlist = []
+            for v in values:
+                if ftype == "boolean":
+                    if v in ("true", "True"):
+                        value = True
+                    else:
+                        value = False
+                elif ftype in ("integer", "double"):
+                    try:
+                        value = float(v)
+                    except ValueError:
                         continue
+                elif ftype == "date":
+                    if date_validator is None:
+                        date_validator = IS_DATE()
+                    value, error = date_validator(v)
+                    if error:
+                        continue
+                elif ftype == "time":
+                    if time_validator is None:
+                        time_validator = IS_TIME()
+                    value, error = time_validator(v)
+                    if error:
+                        continue
+                elif ftype == "datetime":
+                    try:
+                        (y,m,d,hh,mm,ss,t0,t1,t2) = time.strptime(v, tfmt)
+                        value = datetime.datetime(y,m,d,hh,mm,ss)
+                    except ValueError:
+                        continue
+                else:
+                    value = v
 
-                    vlist = []
-                    for v in values:
-                        if ftype == "boolean":
-                            if v in ("true", "True"):
-                                value = True
-                            else:
-                                value = False
-                        elif ftype == "integer":
-                            try:
-                                value = float(v)
-                            except ValueError:
-                                continue
-                        elif ftype == "double":
-                            try:
-                                value = float(v)
-                            except ValueError:
-                                continue
-                        elif ftype == "date":
-                            validator = IS_DATE()
-                            value, error = validator(v)
-                            if error:
-                                continue
-                        elif ftype == "time":
-                            validator = IS_TIME()
-                            value, error = validator(v)
-                            if error:
-                                continue
-                        elif ftype == "datetime":
-                            tfmt = "%Y-%m-%dT%H:%M:%SZ"
-                            try:
-                                (y,m,d,hh,mm,ss,t0,t1,t2) = time.strptime(v, tfmt)
-                                value = datetime.datetime(y,m,d,hh,mm,ss)
-                            except ValueError:
-                                continue
-                        else:
-                            value = v
-
-                        vlist.append(value)
-                    values = vlist
+                vlist.append(value)
+            values = vlist
 
-                    if values:
-                        if rname not in q:
-                            q[rname] = Storage()
-                        if field not in q[rname]:
-                            q[rname][field] = Storage()
-                        q[rname][field][op] = values
+            if values:
+                rname = f.rname
+                field = f.field
+                if rname not in q:
+                    q[rname] = Storage()
+                if field not in q[rname]:
+                    q[rname][field] = Storage()
+                q[rname][field][op] = values
 
         return q
 
@@ -835,6 +961,64 @@ class S3Resource(object):
         return self.__length
 
 
+    # -------------------------------------------------------------------------
+    def version(self):
+
+        """ Data version of this resource: number of records, highest
+            record ID and latest modification time, of the master records
+            and of each component (one query per table)
+
+            The latest modification time includes the soft-deleted records
+            of the table (one more query), which don't match the query
+            anymore, so that it advances when records are deleted.
+
+            @returns: tuple (list of version tuples, latest modification
+                date/time or None)
+
+        """
+
+        MTIME = self.manager.xml.MTIME
+        DELETED = self.manager.DELETED
+
+        if not self.__query:
+            self.build_query()
+            self.__length = None
+
+        if self.__storage is not None:
+            # Other data store
+            raise NotImplementedError
+
+        resources = [self]
+        if self.components:
+            resources.extend([c.resource for c in self.components.values()])
+
+        versions = []
+        last_modified = None
+        for resource in resources:
+            table = resource.table
+            count = table.id.count()
+            maxid = table.id.max()
+            if MTIME in table.fields:
+                mtime = table[MTIME].max()
+                row = self.db(resource.get_query()).select(count, maxid, mtime).first()
+                modified_on = row[mtime]
+                if DELETED in table.fields:
+                    query = (table[DELETED] == True)
+                    deleted = self.db(query).select(mtime).first()[mtime]
+                    if deleted and (modified_on is None or deleted > modified_on):
+                        modified_on = deleted
+                if modified_on and \
+                   (last_modified is None or modified_on > last_modified):
+                    last_modified = modified_on
+            else:
+                row = self.db(resource.get_query()).select(count, maxid).first()
+                modified_on = None
+            versions.append((resource.tablename, row[count], row[maxid],
+                             str(modified_on)))
+
+        return (versions, last_modified)
+
+
     # -------------------------------------------------------------------------
     def load(self, start=None, limit=None):
 
@@ -1449,6 +1633,39 @@ class S3Resource(object):
             except ValueError:
                 msince = None
 
+        # Conditional GET: the version of the data (including all
+        # request filters, so that the ETag changes with every query)
+        # is compared to the one given by the client, and if unchanged,
+        # 304 is returned without building the tree. The msince filter
+        # is part of the request vars and hence of the ETag, and the
+        # latest modification time is independent of it (if it is older
+        # than msince, the result is empty either way).
+        versions, last_modified = self.version()
+        signature = [r.representation, str(template)]
+        vars = r.request.get_vars
+        signature.extend(["%s=%s" % (k, vars[k]) for k in sorted(vars.keys())])
+        signature.extend(versions)
+        etag = '"%s"' % hashlib.md5(repr(signature)).hexdigest()
+        r.response.headers["ETag"] = etag
+        if last_modified is not None:
+            r.response.headers["Last-Modified"] = \
+                last_modified.strftime("%a, %d %b %Y %H:%M:%S GMT")
+
+        env = r.request.env
+        if_none_match = env.http_if_none_match
+        if if_none_match is not None:
+            if etag in [t.strip() for t in if_none_match.split(",")] or \
+               if_none_match.strip() == "*":
+                raise HTTP(304, **r.response.headers)
+        else:
+            if_modified_since = env.http_if_modified_since
+            if if_modified_since and last_modified is not None:
+                since = rfc822.parsedate(if_modified_since.split(";")[0])
+                if since is not None:
+                    since = datetime.datetime(*since[:6])
+                    if last_modified.replace(microsecond=0) <= since:
+                        raise HTTP(304, **r.response.headers)
+
         # Add stylesheet parameters
         args = Storage()
         if template is not None:
@@ -2434,6 +2651,15 @@ class S3Resource(object):
             # Update super entity links
             model.update_super(table, form.vars)
 
+            # Update aggregates in the parent record
+            # (form.record is the source record when copying)
+            if id is None:
+                model.update_aggregates(table, form.vars.id,
+                                        old=None, create=True)
+            else:
+                model.update_aggregates(table, form.vars.id,
+                                        old=form.record)
+
             # Store session vars
             if form.vars.id:
                 self.lastid = str(form.vars.id)
@@ -2489,8 +2715,9 @@ class S3Resource(object):
                     self.db(self.table.id == row.id).update(deleted=True)
                     numrows += 1
                     audit("delete", self.prefix, self.name,
-                          record=row.id, representation=format)
+                          record=row, representation=format)
                     self.manager.model.delete_super(self.table, row)
+                    self.manager.model.update_aggregates(self.table, row.id, old=row)
                     if ondelete:
                         ondelete(row)
 
@@ -2503,8 +2730,9 @@ class S3Resource(object):
                     else:
                         numrows += 1
                         audit("delete", self.prefix, self.name,
-                              record=row.id, representation=format)
+                              record=row, representation=format)
                         self.manager.model.delete_super(self.table, row)
+                        self.manager.model.update_aggregates(self.table, row.id, old=row)
                         if ondelete:
                             ondelete(row)
 
@@ -38,7 +38,9 @@
 
 __all__ = ["S3XML"]
 
+import os
 import sys
+import threading
 from gluon.storage import Storage
 from gluon.validators import IS_EMPTY_OR
 import gluon.contrib.simplejson as json
@@ -64,6 +66,10 @@ class S3XML(object):
 
     CACHE_TTL = 5 # time-to-live of RAM cache for field representations
 
+    # Compiled XSLT stylesheets {path: (mtime, transformer)}, per thread
+    # (libxslt works best with stylesheets parsed in the same thread)
+    transformers = threading.local()
+
     UID = "uuid"
     MCI = "mci"
     MTIME = "modified_on"
@@ -219,12 +225,11 @@ class S3XML(object):
             _args = dict(_args)
         else:
             _args = None
-        ac = etree.XSLTAccessControl(read_file=True, read_network=True)
-        template = self.parse(template_path)
 
-        if template:
+        transformer = self.transformer(template_path)
+
+        if transformer:
             try:
-                transformer = etree.XSLT(template, access_control=ac)
                 if _args:
                     result = transformer(tree, **_args)
                 else:
@@ -239,6 +244,47 @@ class S3XML(object):
             return None
 
 
+    # -------------------------------------------------------------------------
+    def transformer(self, template_path):
+
+        """ Get the compiled XSLT stylesheet for a template, compiles it
+            only once per thread unless the template file has changed
+
+            @param template_path: pathname of the XSLT stylesheet
+
+        """
+
+        cache = getattr(self.transformers, "cache", None)
+        if cache is None:
+            cache = self.transformers.cache = dict()
+
+        try:
+            mtime = os.path.getmtime(template_path)
+        except (OSError, TypeError):
+            # Not a local file
+            mtime = None
+
+        if mtime is not None and template_path in cache:
+            _mtime, transformer = cache[template_path]
+            if _mtime == mtime:
+                return transformer
+
+        ac = etree.XSLTAccessControl(read_file=True, read_network=True)
+        template = self.parse(template_path)
+        if not template:
+            return None
+        try:
+            transformer = etree.XSLT(template, access_control=ac)
+        except:
+            e = sys.exc_info()[1]
+            self.error = e
+            return None
+
+        if mtime is not None:
+            cache[template_path] = (mtime, transformer)
+        return transformer
+
+
     # -------------------------------------------------------------------------
     def tostring(self, tree, pretty_print=False):
 
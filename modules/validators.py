@@ -35,6 +35,7 @@
 import time
 import uuid
 import re
+import threading
 from datetime import datetime, timedelta
 from gluon.validators import Validator, IS_MATCH, IS_NOT_IN_DB
 
@@ -145,9 +146,24 @@ class IS_ONE_OF_EMPTY(Validator):
         to create an option label from the respective record (which has to return
         a string, of course). The function will take the record as an argument
 
+        Option sets are shared between requests in a per-process cache, keyed by
+        table, filter and label, and versioned by the number of records and the
+        latest modification time in the referenced table (so any write to the
+        table invalidates them), and by the language of the request. Labels from
+        functions or lambdas are not cached, as they may translate strings or
+        read other tables.
+
         No 'options' method as designed to be called next to an Autocomplete field so don't download a large dropdown unnecessarily.
     """
 
+    # Shared option set cache
+    OPTIONS = {}
+    OPTIONS_LIMIT = 200
+    options_lock = threading.Lock()
+
+    # Language of the current request (per thread, set in the models)
+    language = threading.local()
+
     def __init__(
         self,
         dbset,
@@ -167,8 +183,10 @@ class IS_ONE_OF_EMPTY(Validator):
 
         if hasattr(dbset, "define_table"):
             self.dbset = dbset()
+            self.shared = True
         else:
             self.dbset = dbset
+            self.shared = False
         self.field = field
         (ktable, kfield) = str(self.field).split(".")
         if not label:
@@ -208,6 +226,45 @@ class IS_ONE_OF_EMPTY(Validator):
         if self._and:
             self._and.record_id = id
 
+    @classmethod
+    def set_language(cls, language):
+        """
+            Sets the language of the current request (part of the key
+            of cached option sets)
+        """
+
+        cls.language.value = language
+
+    def label_key(self):
+        """
+            Key for the label in the option set cache, None if the
+            label can't be cached (functions)
+        """
+
+        label = self.label
+        if isinstance(label, str):
+            return label
+        elif isinstance(label, (list, tuple)):
+            return "|".join(label)
+        return None
+
+    def version(self, query):
+        """
+            Data version of the option set: number of records, highest
+            record ID and latest modification time
+        """
+
+        _table = self.dbset._db[self.ktable]
+        count = _table.id.count()
+        maxid = _table.id.max()
+        if "modified_on" in _table.fields:
+            mtime = _table.modified_on.max()
+            row = self.dbset(query).select(count, maxid, mtime).first()
+            return (row[count], row[maxid], row[mtime])
+        else:
+            row = self.dbset(query).select(count, maxid).first()
+            return (row[count], row[maxid])
+
     def build_set(self):
 
         if self.ktable in self.dbset._db:
@@ -226,6 +283,22 @@ class IS_ONE_OF_EMPTY(Validator):
                     if self.filter_opts:
                         query = query & (_table[self.filterby].belongs(self.filter_opts))
                     dd.update(orderby=_table[self.filterby])
+
+                # Look up the shared cache
+                label_key = self.shared and self.label_key() or None
+                if label_key is not None:
+                    key = (getattr(self.dbset._db, "_uri", None),
+                           self.ktable, self.kfield, str(query),
+                           str(dd["orderby"]), str(groupby), label_key,
+                           getattr(self.language, "value", None))
+                    version = self.version(query)
+                    cached = self.OPTIONS.get(key, None)
+                    if cached and cached[0] == version:
+                        self.theset, self.labels = cached[1], cached[2]
+                        return
+                else:
+                    key = None
+
                 records = self.dbset(query).select(*self.fields, **dd)
             else:
                 import contrib.gql
@@ -235,6 +308,7 @@ class IS_ONE_OF_EMPTY(Validator):
                 dd = dict(orderby=orderby, cache=self.cache)
                 records = \
                     self.dbset.select(self.dbset._db[self.ktable].ALL, **dd)
+                key = None
             self.theset = [str(r[self.kfield]) for r in records]
             #labels = []
             label = self.label
@@ -255,6 +329,16 @@ class IS_ONE_OF_EMPTY(Validator):
                 else:
                     labels = map(lambda r: r[self.kfield], records)
             self.labels = labels
+
+            # Store in the shared cache
+            if key is not None:
+                self.options_lock.acquire()
+                try:
+                    if len(self.OPTIONS) >= self.OPTIONS_LIMIT:
+                        self.OPTIONS.clear()
+                    self.OPTIONS[key] = (version, self.theset, self.labels)
+                finally:
+                    self.options_lock.release()
         else:
             self.theset = None
             self.labels = None
@@ -284,42 +368,35 @@ class IS_ONE_OF_EMPTY(Validator):
                     values = []
 
                 if self.theset:
-                    if not [x for x in values if not x in self.theset]:
+                    theset = set(self.theset)
+                    if not [x for x in values if not str(x) in theset]:
                         return ("|%s|" % "|".join(values), None)
                     else:
                         return (value, self.error_message)
                 else:
-                    for v in values:
-                        q = (_table[self.kfield] == v)
-                        query = query is not None and query | q or q
+                    query = _table[self.kfield].belongs(values)
                     if filter_opts_q != False:
-                        query = query is not None and \
-                                (filter_opts_q & (query)) or filter_opts_q
+                        query = filter_opts_q & query
                     if deleted_q != False:
-                        query = query is not None and \
-                                (deleted_q & (query)) or deleted_q
-                    if self.dbset(query).count() < 1:
+                        query = deleted_q & query
+                    if self.dbset(query).count() < len(set(values)):
                         return (value, self.error_message)
                     return ("|%s|" % "|".join(values), None)
             elif self.theset:
-                if value in self.theset:
+                if str(value) in self.theset:
                     if self._and:
                         return self._and(value)
                     else:
                         return (value, None)
             else:
-                values = [value]
-                query = None
-                for v in values:
-                    q = (_table[self.kfield] == v)
-                    query = query is not None and query | q or q
+                # Indexed lookup of the single value
+                query = (_table[self.kfield] == value)
                 if filter_opts_q != False:
-                    query = query is not None and \
-                            (filter_opts_q & (query)) or filter_opts_q
+                    query = filter_opts_q & query
                 if deleted_q != False:
-                    query = query is not None and \
-                            (deleted_q & (query)) or deleted_q
-                if self.dbset(query).count():
+                    query = deleted_q & query
+                if self.dbset(query).select(_table[self.kfield],
+                                            limitby=(0, 1)).first():
                     if self._and:
                         return self._and(value)
                     else:
@@ -9,6 +9,7 @@
 
 from gluon.sqlhtml import *
 from s3utils import *
+from validators import IS_ONE_OF
 
 # -----------------------------------------------------------------------------
 class S3CheckboxesWidget(OptionsWidget):
@@ -59,18 +60,21 @@ class S3CheckboxesWidget(OptionsWidget):
         self.help_footer = help_footer
 
         if db and lookup_table_name and lookup_field_name:
-            self.requires = IS_NULL_OR(IS_IN_DB(db,
-                                   db[lookup_table_name].id,
+            # IS_ONE_OF shares its option sets between requests
+            self.requires = IS_NULL_OR(IS_ONE_OF(db,
+                                   "%s.id" % lookup_table_name,
                                    "%(" + lookup_field_name + ")s",
                                    multiple = multiple))
+        else:
+            self.requires = None
 
         if options:
             self.options = options
+        elif hasattr(self.requires, "options"):
+            # Options are built when the widget gets rendered
+            self.options = None
         else:
-            if hasattr(self.requires, "options"):
-                self.options = self.requires.options()
-            else:
-                raise SyntaxError, "widget cannot determine options of %s" % field
+            raise SyntaxError, "widget cannot determine options of %s" % lookup_table_name
 
 
     def widget( self,
@@ -86,6 +90,21 @@ class S3CheckboxesWidget(OptionsWidget):
 
         attr = OptionsWidget._attributes(field, {})
 
+        if self.options is None:
+            self.options = self.requires.options()
+
+        # Look up the help texts for all options at once
+        help_texts = {}
+        if self.help_lookup_field_name:
+            lookup_table = db[self.lookup_table_name]
+            ids = [option[0] for option in self.options if option[0]]
+            if ids:
+                rows = db(lookup_table.id.belongs(ids)).select(
+                          lookup_table.id,
+                          lookup_table[self.help_lookup_field_name])
+                help_texts = dict([(str(row.id), row[self.help_lookup_field_name])
+                                   for row in rows])
+
         num_row  = len(self.options)/self.num_column
         # Ensure division  rounds up
         if len(self.options) % self.num_column > 0:
@@ -110,13 +129,7 @@ class S3CheckboxesWidget(OptionsWidget):
                     tip_attr = {}
                     help_text = ""
                     if self.help_lookup_field_name:
-                        help_text = str( P( shn_get_db_field_value(db=db,
-                                                                   table = self.lookup_table_name,
-                                                                   field = self.help_lookup_field_name,
-                                                                   look_up = self.options[index][0],
-                                                                   look_up_field = "id")
-                                          )
-                                        )
+                        help_text = str( P( help_texts.get(str(self.options[index][0]), None) ) )
                     if self.help_footer:
                         help_text = help_text + str(self.help_footer)
                     if help_text:
@@ -452,6 +465,19 @@ class S3MultiSelectWidget(FormWidget):
         else:
             values = [value]
 
+        # Load all linked records at once
+        link_ids = []
+        for value in values:
+            if isinstance( value, (tuple, list) ):
+                value = str( value[0] )
+            if isinstance( value, ( str ) ):
+                link_ids.extend([id for id in shn_split_multi_value(value) if id])
+        if link_ids:
+            link_rows = db(link_table.id.belongs(link_ids)).select()
+            link_rows = dict([(str(row.id), row) for row in link_rows])
+        else:
+            link_rows = {}
+
         for value in values:
             if isinstance( value, (tuple, list) ):
                 value = str( value[0] )
@@ -460,13 +486,13 @@ class S3MultiSelectWidget(FormWidget):
                 for id in ids:
                     # We should put a check here to make sure we don't double display rows
                     if id:
-                        row = db(link_table.id == id).select()
-                        if len(row) > 0:    # If is NOT true, it indicates that a error has occured
+                        row = link_rows.get(str(id), None)
+                        if row:    # If is NOT true, it indicates that a error has occured
                             widget_rows.append(self._generate_row(widget_id,
                                                                   id,
                                                                   column_fields = column_fields,
                                                                   column_fields_represent = self.column_fields_represent,
-                                                                  row = row[0],
+                                                                  row = row,
                                                                   is_dummy_row = False)
                                                 )
             elif isinstance( value, (dict) ):
@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+
+""" Performance Benchmarks
+
+    Times the hot entry points of Sahana Eden (S3XRC export and import,
+    DataTables listing, map, autocomplete search and message outbox)
+    against a database filled with synthetic data, and reports latency
+    percentiles, query counts and peak memory.
+
+    Results can be saved as JSON, and compared with a previous run: the
+    run fails (exit code 1) if the median latency or the number of
+    queries of an entry point exceed those of the reference run by more
+    than the threshold.
+
+    Run from the web2py folder, with the application configured for a
+    dedicated (test) SQLite or PostgreSQL database in models/000_config.py:
+
+        python web2py.py -S eden -M -R applications/eden/tests/benchmark.py -A --size 1000 --output base.json
+
+        python web2py.py -S eden -M -R applications/eden/tests/benchmark.py -A --size 1000 --output new.json --compare base.json --threshold 0.25
+
+    The synthetic records (people, a location hierarchy, hospitals,
+    messages and sync peers) are named "Benchmark ..." and are generated
+    with a fixed random seed. They are kept for subsequent runs of the
+    same size, use --cleanup to remove them.
+
+"""
+
+import gc
+import math
+import optparse
+import random
+import resource
+import sys
+import time
+
+import gluon.contrib.simplejson as json
+
+PREFIX = "Benchmark"
+
+# -----------------------------------------------------------------------------
+def options():
+
+    """ Parses the command line (after -A) """
+
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--size", type="int", default=1000,
+                      help="number of people (other data scales with it)")
+    parser.add_option("--runs", type="int", default=10,
+                      help="timed runs per entry point")
+    parser.add_option("--seed", type="int", default=1,
+                      help="random seed for the synthetic data")
+    parser.add_option("--only", default=None,
+                      help="comma-separated list of entry points to run")
+    parser.add_option("--output", default=None,
+                      help="write the results to this JSON file")
+    parser.add_option("--compare", default=None,
+                      help="compare with the results in this JSON file")
+    parser.add_option("--threshold", type="float", default=0.2,
+                      help="allowed relative regression (0.2 = 20%)")
+    parser.add_option("--cleanup", action="store_true", default=False,
+                      help="remove the synthetic data and exit")
+    return parser.parse_args(sys.argv[1:])[0]
+
+
+# -----------------------------------------------------------------------------
+def login():
+
+    """ Runs as the first administrator (for import and outbox) """
+
+    table = db.auth_membership
+    admin = db(table.group_id == 1).select(table.user_id,
+                                           limitby=(0, 1)).first()
+    if admin:
+        auth.user = db(db.auth_user.id == admin.user_id).select(limitby=(0, 1)).first()
+        session.s3.roles = [1]
+    else:
+        print >> sys.stderr, "No administrator account: import will fail"
+
+
+# -----------------------------------------------------------------------------
+def cleanup():
+
+    """ Removes the synthetic data """
+
+    like = "%s%%" % PREFIX
+
+    table = db.msg_log
+    messages = db(table.subject.like(like))._select(table.id)
+    db(db.msg_outbox.message_id.belongs(messages)).delete()
+    db(table.subject.like(like)).delete()
+
+    table = db.pr_person
+    people = db(table.first_name.like(like))
+    pe_ids = [row.pe_id for row in people.select(table.pe_id)]
+    db(db.pr_pe_contact.pe_id.belongs(pe_ids)).delete()
+    people.delete()
+    db(db.pr_pentity.pe_id.belongs(pe_ids)).delete()
+
+    table = db.hms_hospital
+    hospitals = db(table.name.like(like))
+    site_ids = [row.site_id for row in hospitals.select(table.site_id)]
+    hospitals.delete()
+    db(db.org_site.site_id.belongs(site_ids)).delete()
+
+    # Children before parents
+    table = db.gis_location
+    for level in ("L3", "L2", "L1", "L0"):
+        db(table.name.like(like) & (table.level == level)).delete()
+
+    db(db.sync_peer.name.like(like)).delete()
+
+    db.commit()
+
+
+# -----------------------------------------------------------------------------
+def populate(size, seed):
+
+    """ Fills the database with synthetic data
+
+        @param size: the number of people
+        @param seed: the random seed
+
+    """
+
+    table = db.pr_person
+    existing = db(table.first_name.like("%s%%" % PREFIX)).count()
+    if existing == size:
+        return
+    elif existing:
+        cleanup()
+
+    rand = random.Random(seed)
+
+    # Location hierarchy: 1 L0, size/500 L1, 5 L2 per L1, 5 L3 per L2
+    table = db.gis_location
+    parents = table.bulk_insert([dict(name="%s Country" % PREFIX,
+                                      level="L0",
+                                      lat=0.0,
+                                      lon=0.0)])
+    for level, children in (("L1", max(2, size / 500)), ("L2", 5), ("L3", 5)):
+        locations = []
+        for parent in parents:
+            for i in xrange(children):
+                locations.append(dict(name="%s %s %s-%s" % (PREFIX, level, parent, i),
+                                      level=level,
+                                      parent=parent,
+                                      lat=rand.uniform(-10.0, 10.0),
+                                      lon=rand.uniform(-10.0, 10.0)))
+        parents = table.bulk_insert(locations)
+    locations = parents
+
+    # People, with a mobile phone number each
+    table = db.pr_person
+    ids = table.bulk_insert([dict(first_name="%s" % PREFIX,
+                                  last_name="Person %06d" % i,
+                                  gender=rand.choice((2, 3)))
+                             for i in xrange(size)])
+    s3xrc.model.update_super(table, [Storage(id=id) for id in ids])
+    pe_ids = [row.pe_id for row in
+              db(table.id.belongs(ids)).select(table.pe_id)]
+    db.pr_pe_contact.bulk_insert([dict(pe_id=pe_id,
+                                       contact_method=2,
+                                       value="+%011d" % rand.randint(0, 10**11 - 1),
+                                       priority=1)
+                                  for pe_id in pe_ids])
+
+    # Hospitals
+    table = db.hms_hospital
+    ids = table.bulk_insert([dict(name="%s Hospital %05d" % (PREFIX, i),
+                                  location_id=rand.choice(locations),
+                                  total_beds=rand.randint(10, 500),
+                                  available_beds=rand.randint(0, 10))
+                             for i in xrange(max(1, size / 10))])
+    s3xrc.model.update_super(table, [Storage(id=id) for id in ids])
+
+    # Messages (SMS) in the outbox
+    message_ids = db.msg_log.bulk_insert([dict(subject="%s %s" % (PREFIX, i),
+                                               message="%s message %s" % (PREFIX, i))
+                                          for i in xrange(max(1, size / 5))])
+    db.msg_outbox.bulk_insert([dict(message_id=message_id,
+                                    pe_id=rand.choice(pe_ids),
+                                    pr_message_method=2,
+                                    status=1)
+                               for message_id in message_ids])
+
+    # Sync peers
+    db.sync_peer.bulk_insert([dict(name="%s Peer %s" % (PREFIX, i),
+                                   url="http://127.0.0.1:%s/eden/sync/sync" % (8001 + i),
+                                   type=1,
+                                   format="xml")
+                              for i in xrange(5)])
+
+    db.commit()
+
+
+# -----------------------------------------------------------------------------
+class Sink(object):
+
+    """ Modem stand-in, so that the outbox can be processed without
+        sending anything """
+
+    def queue_sms(self, recipient, text, outbox_id=None):
+        return True
+
+
+# -----------------------------------------------------------------------------
+def entry_points():
+
+    """ The benchmarked entry points
+
+        @returns: list of (name, setup, function)
+
+    """
+
+    points = []
+
+    # S3XRC Export
+    def export_person():
+        return s3xrc._resource("pr", "person").export_xml()
+    points.append(("export_person_xml", None, export_person))
+
+    # S3XRC Import (of a previous export: updates of existing records)
+    source = Storage()
+    def import_setup():
+        if source.xml is None:
+            hospitals = s3xrc._resource("hms", "hospital",
+                                        filter=db.hms_hospital.name.like("%s%%" % PREFIX))
+            source.xml = hospitals.export_xml()
+    def import_hospital():
+        result = s3xrc._resource("hms", "hospital").import_xml(source.xml)
+        db.commit()
+        return result
+    points.append(("import_hospital_xml", import_setup, import_hospital))
+
+    # DataTables listing (aaData)
+    def aadata_person():
+        people = s3xrc._resource("pr", "person")
+        table = people.table
+        fields = [f for f in table if f.readable]
+        return people.select(fields=fields,
+                             start=0,
+                             limit=25,
+                             orderby=table.last_name,
+                             as_page=True,
+                             format="aadata")
+    points.append(("aadata_person", None, aadata_person))
+
+    # Map with a feature layer of all hospitals
+    def show_map():
+        table = db.hms_hospital
+        features = db(table.location_id == db.gis_location.id).select()
+        return gis.show_map(feature_queries=[{"name":"Hospitals",
+                                              "query":features,
+                                              "active":True}],
+                            window=True)
+    points.append(("gis_show_map", None, show_map))
+
+    # Autocomplete (shn_search, JSON representation)
+    def search_setup():
+        request.vars.clear()
+        request.vars.update(field="name", filter="~", value=PREFIX, limit="10")
+    def search_location():
+        r = Storage(request=request,
+                    prefix="gis",
+                    name="location",
+                    table=db.gis_location,
+                    representation="json")
+        return shn_search(r)
+    points.append(("search_location", search_setup, search_location))
+
+    # Outbox (SMS via modem)
+    def outbox_setup():
+        msg.outgoing_sms_handler = "Modem"
+        msg.modem = Sink()
+        db(db.msg_outbox.status.belongs((2, 5))).update(status=1)
+        db.commit()
+    def process_outbox():
+        result = msg.process_outbox(contact_method=2, option=2)
+        db.commit()
+        return result
+    points.append(("msg_process_outbox", outbox_setup, process_outbox))
+
+    return points
+
+
+# -----------------------------------------------------------------------------
+def percentile(values, p):
+
+    """ Nearest-rank percentile of a sorted list """
+
+    if not values:
+        return None
+    k = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[min(max(k, 0), len(values) - 1)]
+
+
+# -----------------------------------------------------------------------------
+def measure(name, setup, function, runs, profiler):
+
+    """ Times an entry point (one untimed warm-up run)
+
+        @returns: dict with the results
+
+    """
+
+    if setup:
+        setup()
+    function()
+
+    gc.collect()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    times = []
+    queries = []
+    for i in xrange(runs):
+        if setup:
+            setup()
+        profiler.queries = []
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+        queries.append(len(profiler.queries))
+    times.sort()
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return dict(name=name,
+                runs=runs,
+                min=times[0],
+                p50=percentile(times, 50),
+                p90=percentile(times, 90),
+                p99=percentile(times, 99),
+                max=times[-1],
+                queries=max(queries),
+                peak_rss=peak,
+                rss_growth=peak - rss)
+
+
+# -----------------------------------------------------------------------------
+def compare(results, reference, threshold):
+
+    """ Compares the results with a reference run
+
+        @returns: list of regressions (strings)
+
+    """
+
+    regressions = []
+    reference = dict([(r["name"], r) for r in reference["results"]])
+    for r in results:
+        ref = reference.get(r["name"], None)
+        if ref is None:
+            continue
+        if ref["p50"] and r["p50"] > ref["p50"] * (1 + threshold):
+            regressions.append("%s: p50 %.4fs (was %.4fs)" % \
+                               (r["name"], r["p50"], ref["p50"]))
+        if r["queries"] > ref["queries"] * (1 + threshold):
+            regressions.append("%s: %s queries (was %s)" % \
+                               (r["name"], r["queries"], ref["queries"]))
+    return regressions
+
+
+# -----------------------------------------------------------------------------
+def benchmark():
+
+    opts = options()
+
+    if opts.cleanup:
+        cleanup()
+        print "Synthetic data removed"
+        return 0
+
+    login()
+    print "Populating (size %s)..." % opts.size
+    populate(opts.size, opts.seed)
+
+    # Use the request profiler if it is enabled, otherwise install one
+    profiler = globals().get("s3_profiler", None)
+    if profiler is None:
+        s3profiler = local_import("s3profiler")
+        profiler = s3profiler.S3QueryProfiler(db, request)
+
+    only = opts.only and opts.only.split(",") or None
+    results = []
+    print "%-22s %9s %9s %9s %9s %8s %10s" % \
+          ("entry point", "min", "p50", "p90", "p99", "queries", "rss (kB)")
+    for name, setup, function in entry_points():
+        if only and name not in only:
+            continue
+        try:
+            r = measure(name, setup, function, opts.runs, profiler)
+        except Exception, e:
+            print "%-22s failed: %s" % (name, e)
+            db.rollback()
+            continue
+        results.append(r)
+        print "%-22s %9.4f %9.4f %9.4f %9.4f %8s %10s" % \
+              (name, r["min"], r["p50"], r["p90"], r["p99"],
+               r["queries"], r["peak_rss"])
+
+    output = dict(size=opts.size,
+                  runs=opts.runs,
+                  seed=opts.seed,
+                  database=deployment_settings.database.get("db_type", "sqlite"),
+                  timestamp=request.utcnow.isoformat(),
+                  results=results)
+    if opts.output:
+        f = open(opts.output, "w")
+        json.dump(output, f, indent=2)
+        f.close()
+
+    if opts.compare:
+        f = open(opts.compare, "r")
+        reference = json.load(f)
+        f.close()
+        if reference.get("size") != opts.size:
+            print "Warning: reference run has size %s" % reference.get("size")
+        regressions = compare(results, reference, opts.threshold)
+        if regressions:
+            print "Regressions (threshold %s%%):" % int(opts.threshold * 100)
+            for regression in regressions:
+                print "  %s" % regression
+            return 1
+        print "No regressions"
+
+    return 0
+
+
+sys.exit(benchmark())
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+""" GIS Proxy Tests
+
+    Requests URLs of a local stub upstream server through S3Proxy (see
+    modules/s3proxy.py, used by gis/proxy), and checks:
+
+        - miss, hit and revalidation (If-None-Match => 304) of cache entries
+        - collapsing of concurrent requests for the same URL into one
+          upstream request
+        - the size limit, with and without Content-Length: too large
+          responses are answered with 502, never truncated
+
+    Run from the web2py folder (no database access, the cache is written
+    to a temporary folder):
+
+        python web2py.py -S eden -M -R applications/eden/tests/gis_proxy.py
+
+"""
+
+import BaseHTTPServer
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+path = os.path.join(request.folder, "modules")
+if not path in sys.path:
+    sys.path.append(path)
+import s3proxy
+
+MAX_SIZE = 100000
+ETAG = '"v1"'
+
+# -----------------------------------------------------------------------------
+class UpstreamHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """ Stub upstream:
+
+            /layer      1000 bytes, ETag, max-age=1 (304 if not modified)
+            /slow       as /layer, but takes 0.5 seconds
+            /big        200000 bytes with Content-Length
+            /stream     200000 bytes without Content-Length
+            /small      50000 bytes without Content-Length
+
+    """
+
+    requests = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        self.lock.acquire()
+        try:
+            UpstreamHandler.requests.append(self.path)
+        finally:
+            self.lock.release()
+
+        if self.path in ("/layer", "/slow"):
+            if self.path == "/slow":
+                time.sleep(0.5)
+            if self.headers.get("If-None-Match", None) == ETAG:
+                self.send_response(304)
+                self.send_header("Cache-Control", "max-age=1")
+                self.end_headers()
+                return
+            body = "L" * 1000
+            length = True
+        elif self.path == "/big":
+            body = "B" * 200000
+            length = True
+        elif self.path == "/stream":
+            body = "S" * 200000
+            length = False
+        else:
+            body = "s" * 50000
+            length = False
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("ETag", ETAG)
+        self.send_header("Cache-Control", "max-age=1")
+        if length:
+            self.send_header("Content-Length", str(len(body)))
+        else:
+            # End of the body = end of the connection
+            self.close_connection = 1
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# -----------------------------------------------------------------------------
+class UpstreamServer(BaseHTTPServer.HTTPServer):
+
+    def handle_error(self, request, client_address):
+        # The proxy drops the connection of too large responses
+        pass
+
+
+# -----------------------------------------------------------------------------
+def test():
+
+    server = UpstreamServer(("127.0.0.1", 0), UpstreamHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    base = "http://127.0.0.1:%s" % server.server_address[1]
+
+    folder = tempfile.mkdtemp()
+    proxy = s3proxy.S3Proxy(folder, max_size=MAX_SIZE, timeout=10)
+
+    failures = []
+    def check(name, value, expected):
+        if value == expected:
+            print "ok      %s" % name
+        else:
+            print "FAILED  %s: %r, expected %r" % (name, value, expected)
+            failures.append(name)
+
+    def get(path, results=None):
+        status, headers, body = proxy.get(base + path, {"Accept": "*/*"})
+        result = (status, headers.get("X-Proxy-Cache", None), len("".join(body)))
+        if results is not None:
+            results.append(result)
+        return result
+
+    def upstream(path):
+        return UpstreamHandler.requests.count(path)
+
+    try:
+        # Miss, hit, revalidation
+        check("miss", get("/layer"), (200, "MISS", 1000))
+        check("hit", get("/layer"), (200, "HIT", 1000))
+        check("hit from cache", upstream("/layer"), 1)
+        time.sleep(1.2)
+        check("revalidated", get("/layer"), (200, "REVALIDATED", 1000))
+        check("revalidation request", upstream("/layer"), 2)
+        check("hit after revalidation", get("/layer"), (200, "HIT", 1000))
+
+        # Concurrent requests are collapsed
+        results = []
+        threads = [threading.Thread(target=get, args=("/slow", results))
+                   for i in xrange(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        check("collapsed responses", sorted([r[0] for r in results]), [200] * 5)
+        check("collapsed sizes", [r[2] for r in results], [1000] * 5)
+        check("collapsed misses", [r[1] for r in results].count("MISS"), 1)
+        check("collapsed upstream requests", upstream("/slow"), 1)
+
+        # Size limit
+        check("too large with Content-Length", get("/big")[0], 502)
+        check("too large without Content-Length", get("/stream")[0], 502)
+        check("without Content-Length", get("/small"), (200, "MISS", 50000))
+        check("without Content-Length cached", get("/small"), (200, "HIT", 50000))
+    finally:
+        server.shutdown()
+        shutil.rmtree(folder)
+
+    if failures:
+        print "%s checks failed" % len(failures)
+        return 1
+    print "All checks passed"
+    return 0
+
+
+sys.exit(test())
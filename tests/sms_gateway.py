@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+""" SMS Gateway Tests
+
+    Sends messages through S3ModemWorkers with simulated modems (see
+    modules/s3modem.py), and checks that a message which can't be sent
+    is retried up to S3SmsGateway.MAX_ATTEMPTS times and then marked as
+    failed - both when the modem reports an error for the recipient
+    and when the device raises an exception.
+
+    Run from the web2py folder (no database access):
+
+        python web2py.py -S eden -M -R applications/eden/tests/sms_gateway.py
+
+"""
+
+import os
+import sys
+
+path = os.path.join(request.folder, "modules")
+if not path in sys.path:
+    sys.path.append(path)
+import pygsm
+import s3modem
+
+from gluon.storage import Storage
+
+# -----------------------------------------------------------------------------
+class BrokenModemSimulator(s3modem.S3ModemSimulator):
+
+    """ Simulated modem which gets disconnected when sending a message:
+        all further writes raise an exception (pygsm catches errors while
+        sending, but not while breaking out of the message prompt) """
+
+    disconnected = False
+
+    def write(self, str):
+        if self.recipient is not None:
+            self.disconnected = True
+        if self.disconnected:
+            raise IOError("device disconnected")
+        return s3modem.S3ModemSimulator.write(self, str)
+
+
+# -----------------------------------------------------------------------------
+def send(devices, recipient):
+
+    """ Queues a message and lets the workers process it until it has
+        been sent or failed (without starting the threads)
+
+        @returns: tuple (gateway, status, job), status is "sent",
+            "failed" or None (still queued)
+
+    """
+
+    modems = [pygsm.GsmModem(device=device, mode="text")
+              for device in devices]
+    gateway = s3modem.S3SmsGateway(Storage(db=None), modems)
+    gateway.queue_sms(recipient, "Test message", outbox_id=1)
+
+    for i in xrange(2 * gateway.MAX_ATTEMPTS):
+        for worker in gateway.workers:
+            try:
+                worker.step()
+            except:
+                # Reported and delayed by S3ModemWorker.run
+                pass
+        if gateway.outbox.empty():
+            break
+
+    if not gateway.completed.empty():
+        return gateway, "sent", gateway.completed.get()
+    if not gateway.failed.empty():
+        return gateway, "failed", gateway.failed.get()
+    return gateway, None, None
+
+
+# -----------------------------------------------------------------------------
+def test():
+
+    pygsm.GsmModem.cmd_delay = 0
+    s3modem.S3ModemWorker.PING_INTERVAL = 0
+    MAX_ATTEMPTS = s3modem.S3SmsGateway.MAX_ATTEMPTS
+
+    failures = []
+    def check(name, value, expected):
+        if value == expected:
+            print "ok      %s" % name
+        else:
+            print "FAILED  %s: %r, expected %r" % (name, value, expected)
+            failures.append(name)
+
+    # Message sent
+    device = s3modem.S3ModemSimulator()
+    gateway, status, job = send([device], "+1001")
+    check("message sent", status, "sent")
+    check("message sent attempts", job and job.attempts, 0)
+    check("message sent by the modem", device.sent, [("+1001", "Test message")])
+
+    # Modem reports an error for the recipient
+    device = s3modem.S3ModemSimulator(fail=["+1002"])
+    gateway, status, job = send([device], "+1002")
+    check("rejected message failed", status, "failed")
+    check("rejected message attempts", job and job.attempts, MAX_ATTEMPTS)
+    check("rejected message not sent", device.sent, [])
+
+    # Device raises an exception, and the other modem rejects the
+    # message: the job must not circulate between the modems forever
+    devices = [BrokenModemSimulator(),
+               s3modem.S3ModemSimulator(fail=["+1003"])]
+    gateway, status, job = send(devices, "+1003")
+    check("exception message failed", status, "failed")
+    check("exception message attempts", job and job.attempts, MAX_ATTEMPTS)
+    check("exception message not queued", gateway.outbox.empty(), True)
+    check("exception counted as failure",
+          sum([w.stats.failed for w in gateway.workers]), MAX_ATTEMPTS)
+
+    # Device raises an exception for every message
+    gateway, status, job = send([BrokenModemSimulator()], "+1004")
+    check("broken modem message failed", status, "failed")
+    check("broken modem message attempts", job and job.attempts, MAX_ATTEMPTS)
+
+    if failures:
+        print "%s checks failed" % len(failures)
+        return 1
+    print "All checks passed"
+    return 0
+
+
+sys.exit(test())
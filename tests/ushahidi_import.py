@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+""" Ushahidi Import Tests
+
+    Pulls the fixture feed in tests/ushahidi from a local HTTP server
+    into Incident Reports (see modules/s3ushahidi.py), and checks that:
+
+        - last_id advances over the pages, and the next pull starts there
+        - incidents which have already been imported are skipped
+        - the pull terminates if the instance ignores paging (and
+          returns the same page again)
+
+    The feed has two pages (3 + 2 incidents, page size 3). In "paging"
+    mode the server returns the page after the requested since_id, in
+    "ignore" mode it always returns the first page.
+
+    Run from the web2py folder (with the irs module enabled, on a test
+    database - imported reports are removed afterwards):
+
+        python web2py.py -S eden -M -R applications/eden/tests/ushahidi_import.py
+
+"""
+
+import BaseHTTPServer
+import cgi
+import datetime
+import os
+import sys
+import threading
+import urlparse
+
+FEED = os.path.join(request.folder, "tests", "ushahidi")
+DOMAIN = "http://ushahidi.example.org/"
+PAGE_SIZE = 3
+
+# -----------------------------------------------------------------------------
+class FeedHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """ Serves the fixture pages, records the requested since_ids """
+
+    mode = "paging"
+    requests = []
+
+    def do_GET(self):
+        query = urlparse.urlsplit(self.path)[3]
+        since_id = int(dict(cgi.parse_qsl(query)).get("id", 0))
+        FeedHandler.requests.append(since_id)
+
+        if self.mode == "ignore" or since_id < 103:
+            page = "incidents_1.xml"
+        elif since_id < 105:
+            page = "incidents_2.xml"
+        else:
+            page = "incidents_none.xml"
+        f = open(os.path.join(FEED, page), "rb")
+        body = f.read()
+        f.close()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# -----------------------------------------------------------------------------
+def login():
+
+    """ Runs as the first administrator (for the import) """
+
+    table = db.auth_membership
+    admin = db(table.group_id == 1).select(table.user_id,
+                                           limitby=(0, 1)).first()
+    if admin:
+        auth.user = db(db.auth_user.id == admin.user_id).select(limitby=(0, 1)).first()
+        session.s3.roles = [1]
+    else:
+        print >> sys.stderr, "No administrator account: import will fail"
+
+
+# -----------------------------------------------------------------------------
+def cleanup(url):
+
+    """ Removes the imported reports and locations """
+
+    like = "%s%%" % DOMAIN
+    db(db.irs_ireport.uuid.like(like)).delete()
+    db(db.gis_location.uuid.like(like)).delete()
+    db(db.irs_ushahidi.url == url).delete()
+    db.commit()
+
+
+# -----------------------------------------------------------------------------
+def pull(url, mode, **attr):
+
+    """ Runs one pull against the fixture server
+
+        @returns: tuple (importer, success, requested since_ids, source record)
+
+    """
+
+    FeedHandler.mode = mode
+    FeedHandler.requests = []
+
+    s3ushahidi = local_import("s3ushahidi")
+    template = os.path.join(request.folder, "static", "xslt", "import", "ushahidi.xsl")
+    resource = s3xrc._resource("irs", "ireport")
+    importer = s3ushahidi.S3UshahidiImport(s3xrc, resource, template,
+                                           page_size=PAGE_SIZE)
+    success = importer.pull(url, **attr)
+
+    table = db.irs_ushahidi
+    source = db(table.url == importer.base_url(url)).select(limitby=(0, 1)).first()
+    return importer, success, FeedHandler.requests, source
+
+
+# -----------------------------------------------------------------------------
+def test():
+
+    if not deployment_settings.has_module("irs"):
+        print >> sys.stderr, "The irs module is disabled"
+        return 1
+
+    login()
+
+    server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0), FeedHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    url = "http://127.0.0.1:%s/api" % server.server_address[1]
+
+    failures = []
+    def check(name, value, expected):
+        if value == expected:
+            print "ok      %s" % name
+        else:
+            print "FAILED  %s: %r, expected %r" % (name, value, expected)
+            failures.append(name)
+
+    cleanup(url)
+    try:
+        # First pull: both pages, until the short page
+        importer, success, requests, source = pull(url, "paging")
+        check("first pull succeeds", success, True)
+        check("first pull requests", requests, [0, 103])
+        check("first pull imports", importer.imported, 5)
+        check("first pull skips", importer.skipped, 0)
+        check("first pull last_id", source.last_id, 105)
+        check("first pull last_date", source.last_date,
+              datetime.datetime(2010, 9, 3, 7, 30))
+        query = db.irs_ireport.uuid.like("%s%%" % DOMAIN) & \
+                (db.irs_ireport.deleted == False)
+        check("reports imported", db(query).count(), 5)
+
+        # Second pull: continues after last_id, nothing new
+        importer, success, requests, source = pull(url, "paging")
+        check("next pull succeeds", success, True)
+        check("next pull requests", requests, [105])
+        check("next pull imports", importer.imported, 0)
+        check("next pull last_id", source.last_id, 105)
+
+        # Reset: all incidents again, all of them already imported
+        importer, success, requests, source = pull(url, "paging", reset=True)
+        check("reset pull requests", requests, [0, 103])
+        check("reset pull imports", importer.imported, 0)
+        check("reset pull skips", importer.skipped, 5)
+        check("reset pull last_id", source.last_id, 105)
+        check("no duplicate reports", db(query).count(), 5)
+
+        # Instance ignoring paging: stops when last_id doesn't advance
+        importer, success, requests, source = pull(url, "ignore",
+                                                   reset=True,
+                                                   max_pages=10)
+        check("repeated page pull succeeds", success, True)
+        check("repeated page pull requests", requests, [0, 103])
+        check("repeated page pull pages", importer.pages, 2)
+        check("repeated page pull imports", importer.imported, 0)
+        check("repeated page pull skips", importer.skipped, 6)
+        check("repeated page pull last_id", source.last_id, 103)
+    finally:
+        cleanup(url)
+        server.shutdown()
+
+    if failures:
+        print "%s checks failed" % len(failures)
+        return 1
+    print "All checks passed"
+    return 0
+
+
+sys.exit(test())